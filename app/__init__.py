@@ -1,36 +1,30 @@
-import os
-import json
-from flask import Flask
-from flask_bcrypt import Bcrypt
-from flask_cors import CORS
-from google.cloud import firestore
-from google.oauth2 import service_account
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-bcrypt = Bcrypt()
+"""
+Application package.
 
-# ✅ Detect if running in Render or Locally
-if os.getenv("RENDER"):
-    # ✅ Running on Render → Use the secret file stored in /etc/secrets/
-    CREDENTIALS_PATH = "/etc/secrets/secret_key.json"
-else:
-    # ✅ Running Locally → Look in the root directory for secret_key.json
-    CREDENTIALS_PATH = os.path.join(os.getcwd(), "secret_key.json")
+The Flask app is built once per process, on first access to ``app.app`` (or
+``get_app()``), so importing the package stays cheap: the Firestore SDK and
+credentials are only loaded when the shared client is first used, normally
+by the warm-up steps gunicorn runs before a worker accepts traffic (see
+app/warmup.py and gunicorn.conf.py).
+"""
+import time
 
-# ✅ Ensure the credentials file exists
-if not os.path.exists(CREDENTIALS_PATH):
-    raise RuntimeError(f"Missing Firebase credentials file at {CREDENTIALS_PATH}")
+_import_started = time.perf_counter()
 
-# ✅ Load Google Service Account Credentials
-cred = service_account.Credentials.from_service_account_file(CREDENTIALS_PATH)
+import os
+import threading
+from flask import Flask
+from flask_cors import CORS
+# ✅ Shared Firestore client (or the in-memory stand-in, with DATASTORE_BACKEND=memory).
+# It is created on first use, so each gunicorn worker builds its own after the fork.
+from .datastore import db
+from .logs import configure_logging
+from .warmup import record_timing, timed
 
-# ✅ Initialize Firebase Admin SDK (only if not already initialized)
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(credentials.Certificate(CREDENTIALS_PATH))
+configure_logging()
 
-# ✅ Firestore Initialization
-db = firestore.Client(credentials=cred)
+_app = None
+_app_lock = threading.Lock()
 
 def create_app():
     app = Flask(__name__)
@@ -58,11 +52,29 @@ def create_app():
         app,
         resources={r"/*": {"origins": allowed_origins}},
         supports_credentials=True,
-        allow_headers=["Authorization", "Content-Type", "device-token"],
+        allow_headers=["Authorization", "Content-Type", "device-token", "Idempotency-Key"],
         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"]
     )
 
-    bcrypt.init_app(app)
+    # Count Firestore reads / writes / RPCs per request
+    from .instrumentation import init_app as init_instrumentation
+    init_instrumentation(app)
+
+    # Request / Firestore metrics on /metrics
+    from .metrics import init_app as init_metrics
+    init_metrics(app)
+
+    # Per-priority-class concurrency limits; sheds admin analytics with 503 when saturated
+    from .admission import init_app as init_admission
+    init_admission(app)
+
+    # Sampled / slow-request profiles (off unless PROFILE_SAMPLE_RATE or PROFILE_SLOW_MS is set)
+    from .profiling import init_app as init_profiling
+    init_profiling(app)
+
+    # Zipkin-format request traces (off unless TRACE_SAMPLE_RATE is set)
+    from .tracing import init_app as init_tracing
+    init_tracing(app)
 
     # Register routes
     from .routes import main_bp
@@ -70,5 +82,22 @@ def create_app():
 
     return app
 
-# Initialize the Flask app
-app = create_app()
+def get_app():
+    """Return the process-wide Flask app, creating it on first use."""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                with timed("create_app"):
+                    _app = create_app()
+    return _app
+
+
+def __getattr__(name):
+    # `gunicorn app:app` and `from app import app` build the app here, exactly once.
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+record_timing("import", time.perf_counter() - _import_started)
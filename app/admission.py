@@ -0,0 +1,187 @@
+"""
+Admission control by priority class.
+
+Every route belongs to a class:
+
+* ``checkin``   - client check-ins, login/logout, registration and the
+                  questionnaire reads a check-in needs
+* ``clinician`` - everything not listed elsewhere (searches, session reads, ...)
+* ``analytics`` - the admin analytics that scan every client (ANALYTICS_ROUTES)
+
+Each class has a concurrency limit and a queue timeout. A request waits up to
+the timeout for a free slot in its class and is otherwise shed with 503 and
+``Retry-After``, before any Firestore work is done. Check-ins are unlimited by
+default, so they only compete for workers, and analytics can never hold more
+than its limit of them.
+
+Slots are shared by every worker process on the host: each slot is a lock
+file in ``ADMISSION_DIR`` (default /tmp/headway-admission) and a request holds
+one with ``flock``. A worker that dies releases its slots with its file
+descriptors. The lock files are only used while the directory is private to
+this user (app/private_dir.py); otherwise each worker enforces the limits on
+its own, so other local users cannot hold the slots. CORS preflights
+(``OPTIONS``) are never queued or shed.
+
+Configuration (``class=value`` lists; a limit of 0 means unlimited):
+
+* ``ADMISSION_LIMITS`` (default ``checkin=0,clinician=0,analytics=2``)
+* ``ADMISSION_QUEUE_TIMEOUT_MS`` (default ``checkin=30000,clinician=5000,analytics=250``)
+* ``ADMISSION_RETRY_AFTER`` - seconds advertised when shedding (default 10)
+* ``ADMISSION_CONTROL=false`` disables the layer
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+
+from .metrics import ADMISSION_REJECTED, ADMISSION_WAIT
+from .private_dir import open_private, private_directory
+
+logger = logging.getLogger(__name__)
+
+CHECKIN_ROUTES = frozenset({
+    "/login", "/register", "/logout-device", "/logout-all",
+    "/user-data/<user_id>/sessions/<session_id>/responses", "/user-data/<user_id>/sessions/batch",
+    "/questions", "/questionnaires", "/validate-invite", "/mark-invite-used",
+})
+# The admin analytics that scan every client or session. app/asgi.py serves the same routes on
+# its analytics thread pool.
+ANALYTICS_ROUTES = frozenset({
+    "/overall-data", "/clinician-data", "/clinician-comparison", "/admin-search-clients", "/question-analytics",
+})
+DEFAULT_CLASS = "clinician"
+
+
+def _parse_classes(value, defaults):
+    parsed = dict(defaults)
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, number = item.split("=", 1)
+            parsed[name.strip()] = float(number)
+    return parsed
+
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").strip().lower() in ("1", "true", "yes")
+ADMISSION_DIR = os.getenv("ADMISSION_DIR", "/tmp/headway-admission")
+ADMISSION_LIMITS = {name: int(limit) for name, limit in _parse_classes(
+    os.getenv("ADMISSION_LIMITS"), {"checkin": 0, "clinician": 0, "analytics": 2}).items()}
+ADMISSION_QUEUE_TIMEOUT_MS = _parse_classes(
+    os.getenv("ADMISSION_QUEUE_TIMEOUT_MS"), {"checkin": 30000, "clinician": 5000, "analytics": 250})
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "10"))
+
+POLL_INTERVAL = 0.01
+
+
+def route_class(rule):
+    """Priority class of a route template (e.g. ``/overall-data``)."""
+    if rule in CHECKIN_ROUTES:
+        return "checkin"
+    if rule in ANALYTICS_ROUTES:
+        return "analytics"
+    return DEFAULT_CLASS
+
+
+class SlotSemaphore:
+    """
+    Counting semaphore shared across processes: `size` lock files, each holder flocks one.
+    Without a private directory the slots only count this process's holders.
+    """
+
+    def __init__(self, directory, name, size):
+        self.directory = directory
+        self.paths = [os.path.join(directory, f"{name}.{slot}.lock") for slot in range(size)]
+        self._fds = None
+        self._pid = None
+        self._held = set()  # slots taken by threads of this process (flock does not exclude them)
+        self._lock = threading.Lock()
+
+    def _descriptors(self):
+        # Descriptors inherited across a fork share their locks with the parent, so each process opens its own.
+        if self._pid != os.getpid():
+            self._fds = [None] * len(self.paths)
+            try:
+                if private_directory(self.directory):
+                    self._fds = [open_private(path, os.O_RDWR | os.O_CREAT) for path in self.paths]
+                else:
+                    logger.warning("Admission directory is not private; limiting each worker on its own",
+                                   extra={"directory": self.directory})
+            except OSError:
+                logger.exception("Admission lock files unavailable; limiting each worker on its own")
+            self._held = set()
+            self._pid = os.getpid()
+        return self._fds
+
+    def try_acquire(self):
+        """Take a free slot and return its number, or None if all are held."""
+        with self._lock:
+            for slot, fd in enumerate(self._descriptors()):
+                if slot in self._held:
+                    continue
+                if fd is not None:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                self._held.add(slot)
+                return slot
+        return None
+
+    def acquire(self, timeout):
+        """Wait up to `timeout` seconds for a slot; returns its number or None."""
+        deadline = time.monotonic() + timeout
+        while True:
+            slot = self.try_acquire()
+            if slot is not None or time.monotonic() >= deadline:
+                return slot
+            time.sleep(POLL_INTERVAL)
+
+    def release(self, slot):
+        with self._lock:
+            if self._fds[slot] is not None:
+                fcntl.flock(self._fds[slot], fcntl.LOCK_UN)
+            self._held.discard(slot)
+
+
+_semaphores = {
+    name: SlotSemaphore(ADMISSION_DIR, name, limit)
+    for name, limit in ADMISSION_LIMITS.items() if limit > 0
+}
+
+
+def init_app(app):
+    """Admit each request of `app` through its class's semaphore; a no-op with ADMISSION_CONTROL=false."""
+    if not ADMISSION_CONTROL or not _semaphores:
+        return
+
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _admit():
+        if request.method == "OPTIONS":
+            return None
+        rule = request.url_rule
+        priority = route_class(rule.rule if rule is not None else None)
+        semaphore = _semaphores.get(priority)
+        if semaphore is None:
+            return None
+
+        started = time.perf_counter()
+        slot = semaphore.acquire(ADMISSION_QUEUE_TIMEOUT_MS.get(priority, 0) / 1000.0)
+        ADMISSION_WAIT.labels(priority=priority).observe(time.perf_counter() - started)
+        if slot is None:
+            ADMISSION_REJECTED.labels(priority=priority).inc()
+            logger.warning("Shedding request", extra={"priority": priority, "route": rule.rule if rule else None})
+            response = jsonify({'message': 'Server is busy; please retry shortly.'})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(ADMISSION_RETRY_AFTER)
+            return response
+        g.admission_slot = (semaphore, slot)
+        return None
+
+    @app.teardown_request
+    def _release(exc):
+        held = g.pop("admission_slot", None)
+        if held is not None:
+            semaphore, slot = held
+            semaphore.release(slot)
@@ -0,0 +1,345 @@
+"""
+Flag-based client archival.
+
+Archiving a client sets ``is_archived`` and ``archived_at`` on their ``users``
+document; their sessions stay where they are in ``user_data``. Readers filter
+on the flag instead of probing a second collection tree.
+
+Older deployments archived clients by moving them into ``archived_users`` and
+``archived_user_data``. Until those trees have been folded back in with
+
+    python -m app.archive
+
+readers keep probing the legacy collections as well. Set
+``LEGACY_ARCHIVE_READS=false`` once the migration has run.
+"""
+import asyncio
+import os
+import sys
+from .bulk_writes import bulk_mutate, delete_collection_ops, update_op
+from .client_timeline import read_timeline
+from .datastore import DELETE_FIELD, SERVER_TIMESTAMP
+from .email_keys import email_key_ref, email_key_data
+from .transactions import run_transaction
+
+ARCHIVED_FIELD = "is_archived"
+ARCHIVED_AT_FIELD = "archived_at"
+
+LEGACY_USERS_COLLECTION = "archived_users"
+LEGACY_DATA_COLLECTION = "archived_user_data"
+
+LEGACY_ARCHIVE_READS = os.getenv("LEGACY_ARCHIVE_READS", "true").strip().lower() in ("1", "true", "yes")
+
+# Accepted values for the `source=` / `filter=` query parameters.
+VALID_SOURCES = ("active", "archived", "all")
+
+BATCH_LIMIT = 500
+
+
+def normalize_source(value, default="active"):
+    """Map a `source=` or `filter=` parameter onto one of VALID_SOURCES."""
+    value = (value or default).strip().lower()
+    if value == "non_archived":
+        return "active"
+    return value
+
+
+def is_archived(user_data):
+    """Return True if a user document is flagged as archived."""
+    return bool(user_data and user_data.get(ARCHIVED_FIELD))
+
+
+def is_legacy(snapshot):
+    """Return True if the snapshot was read from the legacy archived_users collection."""
+    return snapshot.reference.parent.id == LEGACY_USERS_COLLECTION
+
+
+def data_collection_for(snapshot):
+    """Return the collection holding the sessions of the user behind `snapshot`."""
+    return LEGACY_DATA_COLLECTION if is_legacy(snapshot) else "user_data"
+
+
+def get_user(db, user_id):
+    """
+    Fetch a user document regardless of archive status.
+    Returns (snapshot, is_archived), or (None, False) if the user does not exist.
+    """
+    snapshot = db.collection("users").document(user_id).get()
+    if snapshot.exists:
+        return snapshot, is_archived(snapshot.to_dict())
+    if LEGACY_ARCHIVE_READS:
+        legacy_snapshot = db.collection(LEGACY_USERS_COLLECTION).document(user_id).get()
+        if legacy_snapshot.exists:
+            return legacy_snapshot, True
+    return None, False
+
+
+def stream_users(db, source, filters=()):
+    """
+    Yield (snapshot, is_archived) for users matching `filters` and `source`.
+
+    `filters` is a sequence of (field, op, value) tuples applied with `where`.
+    `source` is one of VALID_SOURCES.
+    """
+    query = db.collection("users")
+    for field, op, value in filters:
+        query = query.where(field, op, value)
+
+    if source == "archived":
+        query = query.where(ARCHIVED_FIELD, "==", True)
+    elif source == "active" and not LEGACY_ARCHIVE_READS:
+        # Once migrated every user carries the flag, so this can be filtered server-side.
+        query = query.where(ARCHIVED_FIELD, "==", False)
+
+    for snapshot in query.stream():
+        archived = is_archived(snapshot.to_dict())
+        if source == "active" and archived:
+            continue
+        yield snapshot, archived
+
+    if LEGACY_ARCHIVE_READS and source in ("archived", "all"):
+        legacy_query = db.collection(LEGACY_USERS_COLLECTION)
+        for field, op, value in filters:
+            legacy_query = legacy_query.where(field, op, value)
+        for snapshot in legacy_query.stream():
+            yield snapshot, True
+
+
+async def get_user_async(db, user_id):
+    """
+    `get_user` for an async client: the `users` and legacy probes are issued
+    concurrently instead of one after the other.
+    """
+    reads = [db.collection("users").document(user_id).get()]
+    if LEGACY_ARCHIVE_READS:
+        reads.append(db.collection(LEGACY_USERS_COLLECTION).document(user_id).get())
+    snapshots = await asyncio.gather(*reads)
+    if snapshots[0].exists:
+        return snapshots[0], is_archived(snapshots[0].to_dict())
+    if len(snapshots) > 1 and snapshots[1].exists:
+        return snapshots[1], True
+    return None, False
+
+
+async def stream_users_async(db, source, filters=()):
+    """`stream_users` for an async client, running the `users` and legacy queries concurrently."""
+    query = db.collection("users")
+    for field, op, value in filters:
+        query = query.where(field, op, value)
+
+    if source == "archived":
+        query = query.where(ARCHIVED_FIELD, "==", True)
+    elif source == "active" and not LEGACY_ARCHIVE_READS:
+        query = query.where(ARCHIVED_FIELD, "==", False)
+
+    queries = [query.get()]
+    if LEGACY_ARCHIVE_READS and source in ("archived", "all"):
+        legacy_query = db.collection(LEGACY_USERS_COLLECTION)
+        for field, op, value in filters:
+            legacy_query = legacy_query.where(field, op, value)
+        queries.append(legacy_query.get())
+    results = await asyncio.gather(*queries)
+
+    users = []
+    for snapshot in results[0]:
+        archived = is_archived(snapshot.to_dict())
+        if source == "active" and archived:
+            continue
+        users.append((snapshot, archived))
+    for snapshot in results[1] if len(results) > 1 else ():
+        users.append((snapshot, True))
+    return users
+
+
+def session_collections(source):
+    """Return the parent collections that may hold sessions for the given source."""
+    collections = ["user_data"]
+    if LEGACY_ARCHIVE_READS and source in ("archived", "all"):
+        collections.append(LEGACY_DATA_COLLECTION)
+    return collections
+
+
+def archive_user(db, user_id):
+    """
+    Flag a client as archived, dropping them from their clinician's rollup in the same
+    transaction as the read of their user document, and revoke all of their device sessions.
+    Returns the user's data as it was before archiving, or None if the user does not exist.
+    """
+    from .rollups import queue_client_state  # app.rollups imports this module
+
+    user_ref = db.collection("users").document(user_id)
+
+    def flag(transaction):
+        snapshot = user_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        user_data = snapshot.to_dict()
+        transaction.update(user_ref, {
+            ARCHIVED_FIELD: True,
+            ARCHIVED_AT_FIELD: SERVER_TIMESTAMP,
+        })
+        email = user_data.get("email")
+        if email:
+            transaction.set(email_key_ref(db, email), email_key_data(email, user_id, "users", True))
+        if not is_archived(user_data):
+            queue_client_state(transaction, db, user_data.get("assigned_clinician_id"), user_id, None)
+        return user_data
+
+    user_data = run_transaction(db, flag)
+    if user_data is None:
+        return None
+
+    result = bulk_mutate(db, delete_collection_ops(user_ref.collection("sessions")))
+    if result["failed"]:
+        raise RuntimeError(f"Failed to revoke the sessions of {user_id}: {result['failed']}")
+    return user_data
+
+
+def unarchive_user(db, user_id):
+    """
+    Clear the archived flag on a client, folding in legacy archived data first if needed, and
+    add them back to their clinician's rollup in the same commit.
+    Returns the user's data, or None if no archived client with this ID exists.
+    """
+    from .rollups import client_state, queue_client_state
+
+    user_ref = db.collection("users").document(user_id)
+    data_ref = db.collection("user_data").document(user_id)
+
+    def unflag(transaction):
+        """(whether the user exists, their data if they were archived and are now restored)."""
+        snapshots = {snap.reference.path: snap for snap in db.get_all([user_ref, data_ref], transaction=transaction)}
+        snapshot, data_snapshot = snapshots[user_ref.path], snapshots.get(data_ref.path)
+        if not snapshot.exists:
+            return False, None
+        user_data = snapshot.to_dict()
+        if not is_archived(user_data):
+            return True, None
+        transaction.update(user_ref, {
+            ARCHIVED_FIELD: False,
+            ARCHIVED_AT_FIELD: DELETE_FIELD,
+        })
+        email = user_data.get("email")
+        if email:
+            transaction.set(email_key_ref(db, email), email_key_data(email, user_id, "users", False))
+        timeline = read_timeline(data_snapshot)
+        queue_client_state(transaction, db, user_data.get("assigned_clinician_id"), user_id, client_state(timeline))
+        return True, user_data
+
+    exists, user_data = run_transaction(db, unflag)
+    if not exists and LEGACY_ARCHIVE_READS and fold_legacy_user(db, user_id):
+        exists, user_data = run_transaction(db, unflag)
+    return user_data
+
+
+def fold_legacy_user(db, user_id):
+    """
+    Move one client out of archived_users / archived_user_data back into users / user_data,
+    keeping them flagged as archived. Returns False if there is nothing to fold.
+    """
+    legacy_user_ref = db.collection(LEGACY_USERS_COLLECTION).document(user_id)
+    legacy_user_snapshot = legacy_user_ref.get()
+    if not legacy_user_snapshot.exists:
+        return False
+
+    op_count = 0
+    batch = db.batch()
+
+    def commit_batch_if_needed():
+        nonlocal op_count, batch
+        if op_count >= BATCH_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            op_count = 0
+
+    legacy_data_ref = db.collection(LEGACY_DATA_COLLECTION).document(user_id)
+    legacy_data_snapshot = legacy_data_ref.get()
+    legacy_data = legacy_data_snapshot.to_dict() if legacy_data_snapshot.exists else {}
+
+    user_data = legacy_user_snapshot.to_dict()
+    user_data[ARCHIVED_FIELD] = True
+    user_data[ARCHIVED_AT_FIELD] = legacy_data.get(ARCHIVED_AT_FIELD) or SERVER_TIMESTAMP
+    batch.set(db.collection("users").document(user_id), user_data)
+    op_count += 1
+    commit_batch_if_needed()
+    if user_data.get("email"):
+        batch.set(email_key_ref(db, user_data["email"]), email_key_data(user_data["email"], user_id, "users", True))
+        op_count += 1
+        commit_batch_if_needed()
+
+    # Device sessions of an archived client are stale; drop them rather than copy them.
+    for session in legacy_user_ref.collection("sessions").stream():
+        batch.delete(session.reference)
+        op_count += 1
+        commit_batch_if_needed()
+
+    active_data_ref = db.collection("user_data").document(user_id)
+    if legacy_data_snapshot.exists:
+        top_level = {k: v for k, v in legacy_data.items() if k != ARCHIVED_AT_FIELD}
+        if top_level:
+            batch.set(active_data_ref, top_level, merge=True)
+            op_count += 1
+            commit_batch_if_needed()
+
+    for session in legacy_data_ref.collection("sessions").stream():
+        active_session_ref = active_data_ref.collection("sessions").document(session.id)
+        batch.set(active_session_ref, session.to_dict())
+        op_count += 1
+        commit_batch_if_needed()
+        for response in session.reference.collection("responses").stream():
+            batch.set(active_session_ref.collection("responses").document(response.id), response.to_dict())
+            op_count += 1
+            commit_batch_if_needed()
+            batch.delete(response.reference)
+            op_count += 1
+            commit_batch_if_needed()
+        batch.delete(session.reference)
+        op_count += 1
+        commit_batch_if_needed()
+
+    if legacy_data_snapshot.exists:
+        batch.delete(legacy_data_ref)
+        op_count += 1
+        commit_batch_if_needed()
+
+    # The legacy user document goes last so an interrupted fold can be re-run.
+    batch.delete(legacy_user_ref)
+    batch.commit()
+    return True
+
+
+def migrate(db, dry_run=False):
+    """
+    Fold every legacy archived client back into the active tree and stamp
+    `is_archived: False` on users that predate the flag.
+    """
+    folded = 0
+    for snapshot in db.collection(LEGACY_USERS_COLLECTION).stream():
+        if dry_run:
+            print(f"Would fold archived client {snapshot.id}")
+        else:
+            fold_legacy_user(db, snapshot.id)
+            print(f"Folded archived client {snapshot.id}")
+        folded += 1
+
+    ops = [
+        update_op(snapshot.reference, {ARCHIVED_FIELD: False})
+        for snapshot in db.collection("users").stream()
+        if ARCHIVED_FIELD not in snapshot.to_dict()
+    ]
+    if not dry_run:
+        result = bulk_mutate(db, ops)
+        for failure in result["failed"]:
+            print(f"Failed to stamp {failure['path']}: {failure['error']}")
+
+    return folded, len(ops)
+
+
+if __name__ == "__main__":
+    from app import db
+
+    dry_run = "--dry-run" in sys.argv[1:]
+    folded, stamped = migrate(db, dry_run=dry_run)
+    print(f"Folded {folded} archived clients, stamped {stamped} users with {ARCHIVED_FIELD}=False."
+          + (" (dry run)" if dry_run else ""))
+    print("Set LEGACY_ARCHIVE_READS=false once every worker is running this version.")
@@ -0,0 +1,419 @@
+"""
+ASGI entry point.
+
+    uvicorn app.asgi:application --workers 4
+    gunicorn app.asgi:application -k uvicorn.workers.UvicornWorker
+
+The hot read endpoints in ASYNC_ROUTES are served natively on the event loop
+with Firestore's async client (app/async_datastore.py), so a worker waiting on
+Firestore can keep serving other requests. Independent reads inside one
+request are awaited concurrently: the ``users`` and ``archived_users`` probes,
+the session lookup and the clinician's assignment check, and the active and
+legacy session queries. Responses are byte-for-byte what the Flask views
+return (same JSON encoder and CORS headers).
+
+Every other request - writes, auth, admin analytics, CORS preflights - is
+handed to the Flask app unchanged, which stays the compatibility path
+(``gunicorn app:app`` still serves everything). The Flask requests run on two
+thread pools: the admin analytics (``admission.ANALYTICS_ROUTES``) get
+``ASGI_ANALYTICS_THREADS`` (default 2) and everything else
+``ASGI_WSGI_THREADS`` (default 8), so a burst of slow
+analytics requests cannot use up the threads check-ins need. The reference
+lists (``/questions`` and friends) also go to Flask: they are answered from
+the in-memory reference cache with ETags (app/reference_cache.py).
+
+Needs ``a2wsgi`` (the WSGI bridge) and an ASGI server such as uvicorn.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+from . import get_app
+from .admission import ANALYTICS_ROUTES
+from .archive import VALID_SOURCES, get_user_async, normalize_source, session_collections, stream_users_async
+from .async_datastore import get_async_client
+from .datastore import ASCENDING
+from .instrumentation import add_request_totals, count_operations
+from .metrics import REQUEST_LATENCY, REQUESTS
+from .routes import CORS_RESPONSE_HEADERS, decode_token
+from .warmup import run_warmups
+
+logger = logging.getLogger(__name__)
+
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "8"))
+ASGI_ANALYTICS_THREADS = int(os.getenv("ASGI_ANALYTICS_THREADS", "2"))
+
+
+class AsyncRequest:
+    def __init__(self, scope, params):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.params = params
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+        self.args = {key: values[0] for key, values in query.items()}
+
+
+async def validate_token_async(db, request):
+    """`validate_token` for the async path: returns (decoded_token, None) or (None, (body, status))."""
+    decoded_token, error = decode_token(request.headers.get("authorization"))
+    if error:
+        return None, ({'message': error}, 401)
+    session = await (db.collection('users').document(decoded_token['id'])
+                     .collection('sessions').document(decoded_token['device_token']).get())
+    if not session.exists:
+        return None, ({'message': 'Session expired or revoked'}, 401)
+    return decoded_token, None
+
+
+# --- Endpoints (mirror the Flask views in app/routes.py) ---
+
+async def past_responses(db, request):
+    decoded_token, error = await validate_token_async(db, request)
+    if error:
+        return error
+
+    user_role = decoded_token.get('role')
+    user_id = decoded_token.get('id')
+    query_user_id = request.args.get('user_id')
+    questionnaire_id = request.args.get('questionnaire_id')
+    source = normalize_source(request.args.get('source'))
+    if source not in VALID_SOURCES:
+        return {'message': 'Invalid source parameter'}, 400
+
+    try:
+        client_archived = False
+        if user_role in ['admin', 'clinician']:
+            if not query_user_id:
+                return {'message': 'Must specify a user_id'}, 400
+            client_doc, client_archived = await get_user_async(db, query_user_id)
+            if user_role == 'clinician':
+                if not client_doc or client_doc.to_dict().get('assigned_clinician_id') != user_id:
+                    return {'message': 'Unauthorized'}, 403
+        elif user_role == 'client':
+            if query_user_id and query_user_id != user_id:
+                return {'message': 'Unauthorized'}, 403
+            query_user_id = user_id
+        else:
+            return {'message': 'Unauthorized'}, 403
+
+        if (source == 'active' and client_archived) or (source == 'archived' and not client_archived):
+            return [], 200
+
+        def sessions_query(collection_name):
+            sessions_ref = db.collection(collection_name).document(query_user_id).collection('sessions')
+            if questionnaire_id:
+                sessions_ref = sessions_ref.where("questionnaire_id", "==", questionnaire_id)
+            return sessions_ref.order_by("timestamp", direction=ASCENDING).get()
+
+        parent_collections = session_collections(source)
+        results = await asyncio.gather(*(sessions_query(name) for name in parent_collections))
+        sessions_list = [session for sessions in results for session in sessions]
+        if len(parent_collections) > 1:
+            sessions_list.sort(key=lambda s: s.to_dict().get("timestamp"))
+
+        return [
+            {
+                "session_id": session.id,
+                "timestamp": session.to_dict().get("timestamp"),
+                "questionnaire_id": session.to_dict().get("questionnaire_id"),
+                "summary_responses": session.to_dict().get("summary_responses", [])
+            }
+            for session in sessions_list
+        ], 200
+
+    except Exception:
+        logger.exception("Error fetching past responses")
+        return {'message': 'Error retrieving past responses'}, 500
+
+
+async def get_session_responses(db, request):
+    user_id = request.params['user_id']
+    session_id = request.params['session_id']
+    try:
+        decoded_token, error = await validate_token_async(db, request)
+        if error:
+            return error
+
+        requestor_role = decoded_token.get('role')
+        requestor_id = decoded_token.get('id')
+        source = normalize_source(request.args.get('source'))
+
+        # The candidate session documents and the clinician's assignment check are independent reads.
+        reads = [
+            db.collection(name).document(user_id).collection("sessions").document(session_id).get()
+            for name in session_collections(source)
+        ]
+        if requestor_role == "clinician":
+            reads.append(get_user_async(db, user_id))
+        results = await asyncio.gather(*reads)
+        client_doc = results.pop()[0] if requestor_role == "clinician" else None
+
+        session_snapshot = next((snapshot for snapshot in results if snapshot.exists), None)
+        if session_snapshot is None:
+            return {'message': 'Session not found'}, 404
+
+        if requestor_role == "client" and user_id != requestor_id:
+            logger.warning("Client attempted to access another client's session",
+                           extra={"requestor_id": requestor_id, "session_id": session_id, "user_id": user_id})
+            return {'message': 'Unauthorized: Clients can only access their own sessions.'}, 403
+
+        if client_doc and client_doc.to_dict().get('assigned_clinician_id') != requestor_id:
+            logger.warning("Clinician is not assigned to client", extra={"requestor_id": requestor_id, "user_id": user_id})
+            return {'message': 'Unauthorized access to session'}, 403
+
+        session_data = session_snapshot.to_dict()
+        if not session_data:
+            return {'message': 'Session data not found'}, 404
+
+        summary_responses = session_data.get('summary_responses', [])
+        if not summary_responses:
+            return {'message': 'No responses found for this session'}, 404
+
+        return {
+            "questionnaire_id": session_data.get('questionnaire_id', "default_questionnaire"),
+            "timestamp": session_data.get('timestamp'),
+            "summary_responses": summary_responses
+        }, 200
+
+    except Exception:
+        logger.exception("Error fetching session responses")
+        return {'message': 'Error retrieving session responses'}, 500
+
+
+async def get_user_info(db, request):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return {'message': 'User ID is required'}, 400
+
+    source = normalize_source(request.args.get('source'))
+    user_doc, client_archived = await get_user_async(db, user_id)
+    if not user_doc or (source == 'archived' and not client_archived):
+        return {'message': 'User not found'}, 404
+
+    user_data = user_doc.to_dict()
+    return {
+        'first_name': user_data.get('first_name', ''),
+        'last_name': user_data.get('last_name', ''),
+        'email': user_data.get('email', ''),
+        'is_archived': client_archived
+    }, 200
+
+
+def _name_matches(data, query):
+    return query in data.get('first_name', '').lower() or query in data.get('last_name', '').lower()
+
+
+async def search_users(db, request):
+    decoded_token, error = await validate_token_async(db, request)
+    if error:
+        return error
+
+    user_role = decoded_token.get('role')
+    user_id = decoded_token.get('id')
+    query = request.args.get('query', '').strip().lower()
+    if not query:
+        return {'message': 'Query parameter is required'}, 400
+
+    filter_param = normalize_source(request.args.get('filter'), 'non_archived')
+    try:
+        if filter_param not in VALID_SOURCES:
+            return {'message': 'Invalid filter parameter'}, 400
+
+        if user_role == 'admin':
+            filters = []
+        elif user_role == 'clinician':
+            filters = [('assigned_clinician_id', '==', user_id)]
+        else:
+            return {'message': 'Unauthorized: Clients cannot search for other users'}, 403
+
+        matching_users = []
+        for user, archived in await stream_users_async(db, filter_param, filters):
+            data = user.to_dict()
+            if _name_matches(data, query):
+                matching_users.append({
+                    'id': user.id,
+                    'first_name': data.get('first_name', ''),
+                    'last_name': data.get('last_name', ''),
+                    'role': data.get('role', ''),
+                    'is_archived': archived
+                })
+        return {'users': matching_users}, 200
+
+    except Exception:
+        logger.exception("Error searching users")
+        return {'message': 'Error retrieving user search results'}, 500
+
+
+async def search_clients(db, request):
+    decoded_token, error = await validate_token_async(db, request)
+    if error:
+        return error
+
+    user_role = decoded_token.get('role')
+    user_id = decoded_token.get('id')
+    query = request.args.get('query', '').strip().lower()
+    if not query:
+        return {'message': 'Query parameter is required'}, 400
+
+    filter_param = normalize_source(request.args.get('filter'), 'non_archived')
+    try:
+        if filter_param not in VALID_SOURCES:
+            return {'message': 'Invalid filter parameter'}, 400
+
+        if user_role == 'admin':
+            filters = [('role', '==', 'client')]
+        elif user_role == 'clinician':
+            filters = [('assigned_clinician_id', '==', user_id)]
+        else:
+            return {'message': 'Unauthorized: Clients cannot search for other users'}, 403
+
+        matching_clients = []
+        for client, archived in await stream_users_async(db, filter_param, filters):
+            data = client.to_dict()
+            if _name_matches(data, query):
+                matching_clients.append({
+                    'id': client.id,
+                    'first_name': data.get('first_name', ''),
+                    'last_name': data.get('last_name', ''),
+                    'is_archived': archived
+                })
+        return {'clients': matching_clients}, 200
+
+    except Exception:
+        logger.exception("Error searching clients")
+        return {'message': 'Error retrieving client search results'}, 500
+
+
+async def search_all_clients(db, request):
+    decoded_token, error = await validate_token_async(db, request)
+    if error:
+        return error
+
+    if decoded_token.get('role') != "admin":
+        return {'message': 'Unauthorized: Only admins can search all clients'}, 403
+
+    query = request.args.get('query', '').strip().lower()
+    if not query:
+        return {'message': 'Query parameter is required'}, 400
+
+    filter_param = normalize_source(request.args.get('filter'), 'non_archived')
+    tokens = query.split()
+    try:
+        if filter_param not in VALID_SOURCES:
+            return {'message': 'Invalid filter parameter'}, 400
+
+        matching_clients = []
+        for user, archived in await stream_users_async(db, filter_param, [('role', '==', 'client')]):
+            data = user.to_dict()
+            combined = (data.get('first_name', '') + " " + data.get('last_name', '')).lower()
+            if all(token in combined for token in tokens):
+                matching_clients.append({
+                    'id': user.id,
+                    'first_name': data.get('first_name', ''),
+                    'last_name': data.get('last_name', ''),
+                    'is_archived': archived
+                })
+        return {'clients': matching_clients}, 200
+
+    except Exception:
+        logger.exception("Error searching all clients")
+        return {'message': 'Error retrieving all client search results'}, 500
+
+
+# (method, Flask-style route, handler)
+ASYNC_ROUTES = [
+    ("GET", "/past-responses", past_responses),
+    ("GET", "/user-data/<user_id>/sessions/<session_id>", get_session_responses),
+    ("GET", "/user-info", get_user_info),
+    ("GET", "/search-users", search_users),
+    ("GET", "/search-clients", search_clients),
+    ("GET", "/search-all-clients", search_all_clients),
+]
+
+_compiled_routes = [
+    (method, re.compile("^" + re.sub(r"<(\w+)>", r"(?P<\1>[^/]+)", rule) + "$"), rule, handler)
+    for method, rule, handler in ASYNC_ROUTES
+]
+
+
+def _match(method, path):
+    for route_method, pattern, rule, handler in _compiled_routes:
+        if route_method == method:
+            match = pattern.match(path)
+            if match:
+                return rule, handler, match.groupdict()
+    return None, None, None
+
+
+async def _send_json(send, data, status):
+    # The same encoder settings (key order, indentation, date format) as jsonify in the Flask views
+    body = get_app().json.response(data).get_data()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    headers += [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in CORS_RESPONSE_HEADERS.items()]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _serve_async(scope, send, rule, handler, params):
+    request = AsyncRequest(scope, params)
+    route = f"{request.method} {rule}"
+    started = time.perf_counter()
+    with count_operations(route) as counter:
+        try:
+            data, status = await handler(get_async_client(), request)
+        except Exception as e:
+            logger.exception("Unhandled error in async endpoint", extra={"route": route})
+            data, status = {'message': 'Internal server error', 'error': str(e)}, 500
+        await _send_json(send, data, status)
+    add_request_totals(route, counter)
+    REQUEST_LATENCY.labels(method=request.method, route=rule).observe(time.perf_counter() - started)
+    REQUESTS.labels(method=request.method, route=rule, status=str(status)).inc()
+
+
+_wsgi = {}
+
+
+def _flask_pool(path):
+    """The WSGI bridge (and thread pool) a Flask-served request runs on."""
+    pool = "analytics" if path in ANALYTICS_ROUTES else "default"
+    if pool not in _wsgi:
+        threads = ASGI_ANALYTICS_THREADS if pool == "analytics" else ASGI_WSGI_THREADS
+        _wsgi[pool] = WSGIMiddleware(get_app(), workers=threads)
+    return _wsgi[pool]
+
+
+async def _warm_up():
+    await asyncio.to_thread(get_app)
+    await asyncio.to_thread(run_warmups)
+    await get_async_client().collection("questionnaires").limit(1).get()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await _warm_up()
+            except Exception:
+                logger.exception("ASGI warm-up failed")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "http":
+        rule, handler, params = _match(scope["method"], scope["path"])
+        if handler is not None:
+            return await _serve_async(scope, send, rule, handler, params)
+        return await _flask_pool(scope["path"])(scope, receive, send)
+    raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
@@ -0,0 +1,102 @@
+"""
+Async data access for the ASGI entry point (app/asgi.py).
+
+``get_async_client()`` returns, for the current event loop:
+
+* ``firestore`` backend - a google.cloud.firestore.AsyncClient sharing the
+  sync client's credentials and FIRESTORE_GRPC_OPTIONS
+* ``memory`` backend - an async view of the shared in-memory store, so the
+  async and Flask paths see the same data (each call runs in a worker thread
+  so simulated latency does not block the loop)
+
+Both follow the AsyncClient API: references and queries are built
+synchronously, ``await ref.get()`` / ``await query.get()`` read, and
+``query.stream()`` is an async iterator. Async Firestore reads are not
+counted by app/instrumentation.py; the memory view goes through the
+instrumented sync client, so they are counted there.
+"""
+import asyncio
+import logging
+import os
+import threading
+
+from .datastore import DATASTORE_BACKEND, FIRESTORE_GRPC_OPTIONS, get_client, load_credentials
+
+logger = logging.getLogger(__name__)
+
+_clients = {}  # event loop -> client
+_clients_lock = threading.Lock()
+
+_BUILDERS = frozenset({
+    "collection", "document", "where", "order_by", "limit", "limit_to_last", "offset", "select",
+    "start_at", "start_after", "end_at", "end_before", "count",
+})
+
+
+class AsyncMemoryView:
+    """AsyncClient-style view of a memory-store client, reference or query."""
+
+    __slots__ = ("_wrapped",)
+
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if name in _BUILDERS:
+            return lambda *args, **kwargs: AsyncMemoryView(attr(*args, **kwargs))
+        return attr
+
+    async def get(self, *args, **kwargs):
+        return await asyncio.to_thread(self._wrapped.get, *args, **kwargs)
+
+    async def stream(self, *args, **kwargs):
+        snapshots = await asyncio.to_thread(lambda: list(self._wrapped.stream(*args, **kwargs)))
+        for snapshot in snapshots:
+            yield snapshot
+
+    async def get_all(self, references, *args, **kwargs):
+        references = [r._wrapped if isinstance(r, AsyncMemoryView) else r for r in references]
+        snapshots = await asyncio.to_thread(lambda: list(self._wrapped.get_all(references, *args, **kwargs)))
+        for snapshot in snapshots:
+            yield snapshot
+
+
+def _create_async_firestore_client():
+    from google.cloud import firestore
+
+    cred = load_credentials()
+    client = firestore.AsyncClient(credentials=cred, project=cred.project_id)
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        return client
+    try:
+        from google.cloud.firestore_v1.services.firestore import async_client as firestore_async_client
+        from google.cloud.firestore_v1.services.firestore.transports import grpc_asyncio
+
+        transport_class = grpc_asyncio.FirestoreGrpcAsyncIOTransport
+        channel = transport_class.create_channel(
+            client._target, credentials=cred, options=list(FIRESTORE_GRPC_OPTIONS.items()))
+        client._firestore_api_internal = firestore_async_client.FirestoreAsyncClient(
+            transport=transport_class(host=client._target, channel=channel),
+            client_options=client._client_options,
+        )
+    except Exception:
+        # Relies on SDK internals (see datastore._tune_channels); keep the SDK's default channel.
+        logger.exception("Could not apply Firestore channel options to the async client; using the SDK defaults")
+    return client
+
+
+def get_async_client():
+    """The async client for the running event loop, created on first use (gRPC aio channels are loop-bound)."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(loop)
+            if client is None:
+                if DATASTORE_BACKEND == "memory":
+                    client = AsyncMemoryView(get_client())
+                else:
+                    client = _create_async_firestore_client()
+                _clients[loop] = client
+    return client
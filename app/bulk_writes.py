@@ -0,0 +1,228 @@
+"""
+Shared helper for fan-out mutations.
+
+Routes that touch many documents at once (revoking device sessions,
+reassigning a clinician's clients, ...) build a list of operations and hand
+them to `bulk_mutate`. Operations are packed into WriteBatch commits of at most
+500 writes and the batches are committed in parallel. A failed batch is
+retried one operation at a time so the caller gets per-item errors.
+
+`bulk_mutate_groups` does the same for groups of operations that must land
+together (e.g. a session and its responses): a group is never split across
+batches, and errors are reported per group. `BulkWriter` is its streaming
+form for pipelines too large to hold in memory: groups are added one at a
+time and `add_group` blocks while too many batches are in flight.
+
+Each operation is a tuple of (kind, document_reference, data), where kind is
+"set", "merge", "update" or "delete" and data is None for deletes.
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import record_bulk_writes
+from .tracing import span
+
+BATCH_LIMIT = 500
+MAX_WORKERS = int(os.getenv("BULK_WRITE_WORKERS", "8"))
+
+
+def _record(ops=0, batches=0, failed_ops=0):
+    """Count operations, batch commits and failed operations (``firestore_bulk_writes_total``)."""
+    record_bulk_writes(ops=ops, batches=batches, failed_ops=failed_ops)
+
+
+def delete_op(ref):
+    return ("delete", ref, None)
+
+
+def update_op(ref, data):
+    return ("update", ref, data)
+
+
+def set_op(ref, data, merge=False):
+    return ("merge" if merge else "set", ref, data)
+
+
+def _apply(writer, op):
+    kind, ref, data = op
+    if kind == "delete":
+        writer.delete(ref)
+    elif kind == "update":
+        writer.update(ref, data)
+    elif kind == "set":
+        writer.set(ref, data)
+    elif kind == "merge":
+        writer.set(ref, data, merge=True)
+    else:
+        raise ValueError(f"Unknown bulk operation: {kind}")
+
+
+def _commit_groups(db, groups):
+    """
+    Commit a list of (tag, ops) groups as one batch. If the batch fails, retry
+    each group on its own so one bad group does not fail the others.
+    Returns a list of (tag, error or None).
+    """
+    batch = db.batch()
+    for _, ops in groups:
+        for op in ops:
+            _apply(batch, op)
+    op_count = sum(len(ops) for _, ops in groups)
+    try:
+        batch.commit()
+        _record(ops=op_count, batches=1)
+        return [(index, None) for index, _ in groups]
+    except Exception as e:
+        if len(groups) == 1:
+            _record(ops=op_count, batches=1, failed_ops=op_count)
+            return [(groups[0][0], str(e))]
+
+    outcomes = []
+    failed_ops = 0
+    for index, ops in groups:
+        single = db.batch()
+        for op in ops:
+            _apply(single, op)
+        try:
+            single.commit()
+            outcomes.append((index, None))
+        except Exception as e:
+            outcomes.append((index, str(e)))
+            failed_ops += len(ops)
+    _record(ops=op_count, batches=1 + len(groups), failed_ops=failed_ops)
+    return outcomes
+
+
+def _pack(groups, batch_size):
+    """Pack (index, ops) groups into batches of at most `batch_size` ops without splitting a group."""
+    batches, current, current_size = [], [], 0
+    for index, ops in groups:
+        if len(ops) > batch_size:
+            raise ValueError(f"Group {index} has {len(ops)} operations; the limit is {batch_size}.")
+        if current and current_size + len(ops) > batch_size:
+            batches.append(current)
+            current, current_size = [], 0
+        current.append((index, ops))
+        current_size += len(ops)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def bulk_mutate_groups(db, groups, batch_size=BATCH_LIMIT, max_workers=MAX_WORKERS):
+    """
+    Apply groups of operations, where each group is committed atomically in a single batch.
+
+    Groups are packed into as few batches as possible and the batches are
+    committed concurrently. Returns a list with one entry per group: None if
+    it was written, or the error message if it failed.
+    """
+    batches = _pack(list(enumerate(groups)), batch_size)
+    errors = [None] * len(groups)
+    if not batches:
+        return errors
+
+    with span("bulk_write", groups=len(groups), batches=len(batches)):
+        if len(batches) == 1 or max_workers <= 1:
+            outcomes = [_commit_groups(db, batch) for batch in batches]
+        else:
+            # Each worker runs in a copy of the caller's context so per-request accounting (and tracing) follows the writes.
+            contexts = [contextvars.copy_context() for _ in batches]
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+                outcomes = list(executor.map(lambda ctx, batch: ctx.run(_commit_groups, db, batch), contexts, batches))
+
+    for batch_outcomes in outcomes:
+        for index, error in batch_outcomes:
+            errors[index] = error
+    return errors
+
+
+def bulk_mutate(db, ops, batch_size=BATCH_LIMIT, max_workers=MAX_WORKERS):
+    """
+    Apply `ops` in batches of `batch_size`, committing up to `max_workers` batches concurrently.
+
+    Returns a dict with the paths that were written (`succeeded`), the per-item
+    errors (`failed`), and the number of operations and batches attempted.
+    Batches are independent: a failure in one does not roll back the others.
+    """
+    ops = list(ops)
+    errors = bulk_mutate_groups(db, [[op] for op in ops], batch_size, max_workers)
+    result = {
+        "succeeded": [],
+        "failed": [],
+        "op_count": len(ops),
+        "batch_count": (len(ops) + batch_size - 1) // batch_size,
+    }
+    for op, error in zip(ops, errors):
+        if error is None:
+            result["succeeded"].append(op[1].path)
+        else:
+            result["failed"].append({"path": op[1].path, "op": op[0], "error": error})
+    return result
+
+
+def delete_collection_ops(collection_ref):
+    """Build delete ops for every document in a collection without reading their contents."""
+    return [delete_op(ref) for ref in collection_ref.list_documents()]
+
+
+class BulkWriter:
+    """
+    Streaming bulk writer with backpressure.
+
+    Groups added with `add_group(tag, ops)` are packed into batches of at most
+    `batch_size` operations and committed on a pool of `max_workers` threads.
+    Once `max_pending_batches` batches are queued or in flight, `add_group`
+    blocks until one finishes. `on_batch_done(outcomes)` is called from a
+    worker thread with the list of (tag, error or None) for each finished batch.
+    """
+
+    def __init__(self, db, batch_size=BATCH_LIMIT, max_workers=MAX_WORKERS,
+                 max_pending_batches=None, on_batch_done=None):
+        self._db = db
+        self._batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending_batches or max_workers * 2)
+        self._on_batch_done = on_batch_done
+        self._current = []
+        self._current_size = 0
+
+    def add_group(self, tag, ops):
+        ops = list(ops)
+        if len(ops) > self._batch_size:
+            raise ValueError(f"Group {tag} has {len(ops)} operations; the limit is {self._batch_size}.")
+        if self._current and self._current_size + len(ops) > self._batch_size:
+            self.flush()
+        self._current.append((tag, ops))
+        self._current_size += len(ops)
+
+    def flush(self):
+        """Submit the partially filled batch, blocking if too many batches are in flight."""
+        if not self._current:
+            return
+        groups, self._current, self._current_size = self._current, [], 0
+        self._slots.acquire()
+        future = self._executor.submit(contextvars.copy_context().run, _commit_groups, self._db, groups)
+        future.add_done_callback(lambda f: self._finish(groups, f))
+
+    def _finish(self, groups, future):
+        try:
+            error = future.exception()
+            outcomes = future.result() if error is None else [(tag, str(error)) for tag, _ in groups]
+            if self._on_batch_done:
+                self._on_batch_done(outcomes)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Flush remaining groups and wait for every batch to finish."""
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
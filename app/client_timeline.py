@@ -0,0 +1,148 @@
+"""
+Per-client score timeline.
+
+Each client's ``user_data/{user_id}`` document carries a derived
+``score_timeline``: one ``{session_id, timestamp, score}`` entry per scored
+session, kept sorted by timestamp, plus ``session_count``, so analytics can
+read one document per client instead of streaming every session. A single
+check-in updates it in the same transaction as the session. A bulk submission
+commits its sessions first and then updates the timeline (with the clinician
+rollup and monthly trends) in one follow-up transaction. If that fails, the
+sessions are stored without their timeline entries; retrying the batch merges
+the already stored sessions in again, and the rebuild below repairs any client.
+
+Timelines for existing data are rebuilt from the sessions with
+
+    python -m app.client_timeline [user_id ...]
+
+followed by ``python -m app.rollups`` and ``python -m app.trends`` to refresh
+the clinician rollups and monthly trends. Until
+every client has one, ``load_timelines`` computes missing timelines from the
+sessions; set ``TIMELINES_BACKFILLED=true`` afterwards to skip that.
+"""
+import os
+import sys
+
+TIMELINE_FIELD = "score_timeline"
+SESSION_COUNT_FIELD = "session_count"
+
+TIMELINES_BACKFILLED = os.getenv("TIMELINES_BACKFILLED", "false").strip().lower() in ("1", "true", "yes")
+
+
+def score_responses(responses):
+    """Total score for a session's summary_responses, or None if it has no usable values."""
+    try:
+        values = [float(r.get("response_value", 0)) for r in responses or []]
+    except (TypeError, ValueError):
+        return None
+    if not values:
+        return None
+    return sum(values) - 10
+
+
+def timeline_entry(session_id, timestamp, summary_responses):
+    """Build a timeline entry for a session, or None if the session cannot be scored."""
+    score = score_responses(summary_responses)
+    if score is None or timestamp is None:
+        return None
+    return {"session_id": session_id, "timestamp": timestamp, "score": score}
+
+
+def read_timeline(snapshot):
+    """Return the timeline stored on a user_data snapshot (empty if missing)."""
+    if snapshot is None or not snapshot.exists:
+        return []
+    return list((snapshot.to_dict() or {}).get(TIMELINE_FIELD, []))
+
+
+def merge_entries(timeline, entries):
+    """Return `timeline` with `entries` added (replacing entries with the same session_id), sorted by timestamp."""
+    by_session = {entry["session_id"]: entry for entry in timeline}
+    for entry in entries:
+        if entry is not None:
+            by_session[entry["session_id"]] = entry
+    return sorted(by_session.values(), key=lambda entry: entry["timestamp"])
+
+
+def timeline_fields(timeline):
+    """Fields to merge into user_data/{user_id} for a timeline."""
+    return {TIMELINE_FIELD: timeline, SESSION_COUNT_FIELD: len(timeline)}
+
+
+def sessions_timeline(db, user_id, collection="user_data"):
+    """Compute a client's timeline from their sessions, without storing it."""
+    entries = []
+    for session in db.collection(collection).document(user_id).collection("sessions").stream():
+        data = session.to_dict()
+        entries.append(timeline_entry(session.id, data.get("timestamp"), data.get("summary_responses")))
+    return merge_entries([], entries)
+
+
+def load_timelines(db, clients):
+    """
+    {user_id: timeline} for `clients`, a sequence of (user_id, collection) pairs,
+    with one get_all for all of them.
+    """
+    clients = list(clients)
+    if not clients:
+        return {}
+    parents = {}
+    for user_id, collection in clients:
+        ref = db.collection(collection).document(user_id)
+        parents[ref.path] = (user_id, collection, ref)
+    timelines = {}
+    missing = {}
+    # get_all yields in no particular order, so match snapshots up by path.
+    for snapshot in db.get_all([ref for _, _, ref in parents.values()]):
+        user_id, collection, _ = parents[snapshot.reference.path]
+        data = snapshot.to_dict() if snapshot.exists else None
+        if data and SESSION_COUNT_FIELD in data:
+            timelines[user_id] = list(data.get(TIMELINE_FIELD, []))
+        elif TIMELINES_BACKFILLED:
+            timelines[user_id] = []
+        else:
+            missing[user_id] = collection
+    for user_id, collection in missing.items():
+        timelines[user_id] = sessions_timeline(db, user_id, collection)
+    return timelines
+
+
+def update_client_timeline(db, user_id, entries, clinician_id=None):
+    """
+    Merge `entries` into a client's timeline in one transaction, updating the
+    client's entry in `clinician_id`'s rollup and the monthly trends in the same
+    commit. Writes nothing if the timeline already holds `entries`. Returns the new timeline.
+    """
+    from .rollups import client_state, queue_client_state
+    from .transactions import run_transaction
+    from .trends import queue_trend_delta
+
+    parent_ref = db.collection("user_data").document(user_id)
+
+    def apply(transaction):
+        previous = read_timeline(parent_ref.get(transaction=transaction))
+        timeline = merge_entries(previous, entries)
+        if timeline == previous:
+            return timeline
+        transaction.set(parent_ref, timeline_fields(timeline), merge=True)
+        queue_client_state(transaction, db, clinician_id, user_id, client_state(timeline))
+        queue_trend_delta(transaction, db, user_id, previous, timeline)
+        return timeline
+
+    return run_transaction(db, apply)
+
+
+def rebuild_client_timeline(db, user_id, collection="user_data"):
+    """Recompute a client's timeline from their sessions and store it."""
+    timeline = sessions_timeline(db, user_id, collection)
+    db.collection(collection).document(user_id).set(timeline_fields(timeline), merge=True)
+    return timeline
+
+
+if __name__ == "__main__":
+    from app import db
+
+    user_ids = sys.argv[1:] or [ref.id for ref in db.collection("user_data").list_documents()]
+    for user_id in user_ids:
+        timeline = rebuild_client_timeline(db, user_id)
+        print(f"Rebuilt timeline for {user_id}: {len(timeline)} scored sessions")
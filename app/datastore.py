@@ -0,0 +1,243 @@
+"""
+Data-access backend selection.
+
+``DATASTORE_BACKEND`` picks what ``get_client()`` returns:
+
+* ``firestore`` (default) - a google.cloud.firestore.Client using the service
+  account in secret_key.json (/etc/secrets/secret_key.json on Render).
+* ``memory`` - an in-memory stand-in (app/memory_store.py) that needs no
+  credentials or network. ``MEMORY_STORE_LATENCY_MS`` and
+  ``MEMORY_STORE_JITTER_MS`` add a delay to every simulated round trip.
+
+Unless ``FIRESTORE_INSTRUMENTATION=false``, the client is wrapped by
+app/instrumentation.py so reads, writes and RPCs are counted per request.
+
+There is one client per process, shared by every module through ``db`` (a
+lazy handle that builds it on first use) or ``get_client()``. Nothing
+connects at import time, so the gunicorn master never opens a gRPC channel;
+if a client does exist when the process forks, the child discards its copy
+and builds its own, because gRPC channels do not survive a fork.
+
+Channel tuning for the Firestore backend:
+
+* ``FIRESTORE_GRPC_OPTIONS`` - JSON object of gRPC channel arguments merged
+  over DEFAULT_GRPC_OPTIONS, e.g. ``{"grpc.keepalive_time_ms": 60000}``
+* ``FIRESTORE_CHANNEL_POOL_SIZE`` (default 1) - number of channels; calls are
+  spread round-robin across them. One HTTP/2 channel multiplexes up to ~100
+  concurrent streams, so only raise this for heavily threaded workers.
+
+Modules import the field transforms (SERVER_TIMESTAMP, DELETE_FIELD, ...) and
+the ordering constants from here so they work with either backend.
+"""
+import itertools
+import json
+import logging
+import os
+import threading
+
+from .instrumentation import instrument, unwrap
+from .warmup import register_warmup, timed
+
+# The SDK's own transform sentinels when google-cloud-firestore is installed.
+from .memory_store import (
+    ASCENDING, DESCENDING, DELETE_FIELD, SERVER_TIMESTAMP, ArrayRemove, ArrayUnion, Increment, MemoryClient,
+)
+
+DATASTORE_BACKEND = os.getenv("DATASTORE_BACKEND", "firestore").strip().lower()
+VALID_BACKENDS = ("firestore", "memory")
+
+MEMORY_STORE_LATENCY_MS = float(os.getenv("MEMORY_STORE_LATENCY_MS", "0"))
+MEMORY_STORE_JITTER_MS = float(os.getenv("MEMORY_STORE_JITTER_MS", "0"))
+
+FIRESTORE_INSTRUMENTATION = os.getenv("FIRESTORE_INSTRUMENTATION", "true").strip().lower() in ("1", "true", "yes")
+
+DEFAULT_GRPC_OPTIONS = {
+    "grpc.keepalive_time_ms": 30000,
+    "grpc.keepalive_timeout_ms": 10000,
+    "grpc.http2.max_pings_without_data": 0,
+    "grpc.max_receive_message_length": -1,
+}
+FIRESTORE_GRPC_OPTIONS = {**DEFAULT_GRPC_OPTIONS, **json.loads(os.getenv("FIRESTORE_GRPC_OPTIONS") or "{}")}
+FIRESTORE_CHANNEL_POOL_SIZE = max(1, int(os.getenv("FIRESTORE_CHANNEL_POOL_SIZE", "1")))
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def credentials_path():
+    if os.getenv("RENDER"):
+        return "/etc/secrets/secret_key.json"
+    return os.path.join(os.getcwd(), "secret_key.json")
+
+
+def _channel_pool(channels):
+    """A grpc.Channel that hands each call to the next of `channels`."""
+    import grpc
+
+    class RoundRobinCallable:
+        def __init__(self, callables):
+            self._next = itertools.cycle(callables)
+
+        def __call__(self, *args, **kwargs):
+            return next(self._next)(*args, **kwargs)
+
+        def __getattr__(self, name):
+            # with_call / future on unary requests
+            return getattr(next(self._next), name)
+
+    class ChannelPool(grpc.Channel):
+        def subscribe(self, callback, try_to_connect=False):
+            for channel in channels:
+                channel.subscribe(callback, try_to_connect)
+
+        def unsubscribe(self, callback):
+            for channel in channels:
+                channel.unsubscribe(callback)
+
+        def unary_unary(self, *args, **kwargs):
+            return RoundRobinCallable([c.unary_unary(*args, **kwargs) for c in channels])
+
+        def unary_stream(self, *args, **kwargs):
+            return RoundRobinCallable([c.unary_stream(*args, **kwargs) for c in channels])
+
+        def stream_unary(self, *args, **kwargs):
+            return RoundRobinCallable([c.stream_unary(*args, **kwargs) for c in channels])
+
+        def stream_stream(self, *args, **kwargs):
+            return RoundRobinCallable([c.stream_stream(*args, **kwargs) for c in channels])
+
+        def close(self):
+            for channel in channels:
+                channel.close()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            self.close()
+            return False
+
+    return ChannelPool()
+
+
+def _tune_channels(client, cred):
+    """
+    Replace the client's default gRPC channel with FIRESTORE_GRPC_OPTIONS / FIRESTORE_CHANNEL_POOL_SIZE ones.
+    firestore.Client takes no channel or transport arguments, so this relies on private attributes.
+    """
+    from google.cloud.firestore_v1.services.firestore import client as firestore_client
+    from google.cloud.firestore_v1.services.firestore.transports import grpc as firestore_grpc
+
+    transport_class = firestore_grpc.FirestoreGrpcTransport
+    options = list(FIRESTORE_GRPC_OPTIONS.items())
+    channels = [transport_class.create_channel(client._target, credentials=cred, options=options)
+                for _ in range(FIRESTORE_CHANNEL_POOL_SIZE)]
+    channel = channels[0] if len(channels) == 1 else _channel_pool(channels)
+    # Populates the slot the SDK otherwise fills lazily with its own channel on first RPC.
+    client._firestore_api_internal = firestore_client.FirestoreClient(
+        transport=transport_class(host=client._target, channel=channel),
+        client_options=client._client_options,
+    )
+
+
+_credentials = None
+
+
+def load_credentials():
+    """The service account credentials, loaded once per process and shared by every client and channel."""
+    global _credentials
+    if _credentials is None:
+        from google.oauth2 import service_account
+
+        path = credentials_path()
+        if not os.path.exists(path):
+            raise RuntimeError(f"Missing Firebase credentials file at {path}")
+        _credentials = service_account.Credentials.from_service_account_file(path)
+    return _credentials
+
+
+def _create_firestore_client():
+    from google.cloud import firestore
+
+    cred = load_credentials()
+    client = firestore.Client(credentials=cred, project=cred.project_id)
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        # The channel can only be swapped through SDK internals, which change between releases; any
+        # failure leaves the client on its default channel (the assignment is _tune_channels' last step).
+        try:
+            _tune_channels(client, cred)
+        except Exception:
+            logger.exception("Could not apply Firestore channel options; using the SDK defaults")
+    return client
+
+
+def create_client(backend=None):
+    """Build a new client for `backend` (defaults to DATASTORE_BACKEND)."""
+    backend = backend or DATASTORE_BACKEND
+    if backend == "memory":
+        return MemoryClient(latency_ms=MEMORY_STORE_LATENCY_MS, jitter_ms=MEMORY_STORE_JITTER_MS)
+    if backend == "firestore":
+        return _create_firestore_client()
+    raise RuntimeError(f"Unknown DATASTORE_BACKEND {backend!r}; expected one of {', '.join(VALID_BACKENDS)}.")
+
+
+def get_client():
+    """Return the process-wide client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                with timed("datastore_client"):
+                    client = create_client()
+                _client = instrument(client) if FIRESTORE_INSTRUMENTATION else client
+    return _client
+
+
+@register_warmup("datastore_channel")
+def _open_channel():
+    # One cheap read builds the client, loads credentials and connects the gRPC channel.
+    get_client().collection("questionnaires").limit(1).get()
+
+
+def _after_fork_in_child():
+    global _client, _client_lock
+    # The parent's lock may have been held mid-fork, and its gRPC channels are unusable here;
+    # the in-memory store has no connections and keeps its (copied) data.
+    _client_lock = threading.Lock()
+    if _client is not None and not is_memory_client(_client):
+        _client = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class LazyClient:
+    """
+    Handle on the shared client that modules can bind at import time: the
+    client is only built when the handle is first used.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_client(), name, value)
+
+    def __repr__(self):
+        return f"<lazy {get_client()!r}>" if _client is not None else "<lazy client (not created yet)>"
+
+
+db = LazyClient()
+
+
+def resolve(client):
+    """The shared client behind a LazyClient handle; anything else is returned unchanged."""
+    return get_client() if isinstance(client, LazyClient) else client
+
+
+def is_memory_client(db):
+    return isinstance(unwrap(resolve(db)), MemoryClient)
@@ -0,0 +1,105 @@
+"""
+Email lookup index.
+
+Every registered email owns one document in ``email_keys``, keyed by a hash of
+the normalised address (emails may contain characters that are not valid in a
+document ID). The document records which user owns the email and where their
+user document lives:
+
+    {"email": ..., "user_id": ..., "collection": "users", "is_archived": False}
+
+Creating it inside the registration transaction is what makes email addresses
+unique, and login resolves an email with one direct get() instead of querying
+``users`` and ``archived_users``. Register, archive, unarchive and remove-user
+keep it up to date.
+
+Users created before the index existed are picked up by
+
+    python -m app.email_keys
+
+Until that backfill has run, login and register also fall back to the old
+``where('email', '==', ...)`` queries. Set ``EMAIL_KEYS_BACKFILLED=true``
+afterwards to drop them.
+"""
+import hashlib
+import os
+
+EMAIL_KEYS_COLLECTION = "email_keys"
+
+EMAIL_KEYS_BACKFILLED = os.getenv("EMAIL_KEYS_BACKFILLED", "false").strip().lower() in ("1", "true", "yes")
+
+
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+
+def email_key(email):
+    """Return the document ID for an email address."""
+    return hashlib.sha256(normalize_email(email).encode("utf-8")).hexdigest()
+
+
+def email_key_ref(db, email):
+    return db.collection(EMAIL_KEYS_COLLECTION).document(email_key(email))
+
+
+def email_key_data(email, user_id, collection="users", archived=False):
+    """Build the contents of an email-key document."""
+    return {
+        "email": normalize_email(email),
+        "user_id": user_id,
+        "collection": collection,
+        "is_archived": archived,
+    }
+
+
+def lookup_email(db, email):
+    """Return the email-key document for `email` as a dict, or None if it is not indexed."""
+    snapshot = email_key_ref(db, email).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def backfill(db):
+    """
+    Write email keys for every user in `users` and the legacy `archived_users` collection.
+    Existing keys are left alone. Returns (written, conflicts).
+    """
+    from .archive import LEGACY_USERS_COLLECTION, is_archived
+    from .bulk_writes import bulk_mutate, set_op
+
+    existing = {ref.id for ref in db.collection(EMAIL_KEYS_COLLECTION).list_documents()}
+    seen = {}
+    conflicts = []
+    ops = []
+    for collection in ("users", LEGACY_USERS_COLLECTION):
+        for snapshot in db.collection(collection).stream():
+            data = snapshot.to_dict()
+            email = normalize_email(data.get("email"))
+            if not email:
+                continue
+            key = email_key(email)
+            if key in seen:
+                conflicts.append((email, seen[key], snapshot.id))
+                continue
+            seen[key] = snapshot.id
+            if key in existing:
+                continue
+            archived = collection == LEGACY_USERS_COLLECTION or is_archived(data)
+            ops.append(set_op(
+                db.collection(EMAIL_KEYS_COLLECTION).document(key),
+                email_key_data(email, snapshot.id, collection, archived),
+            ))
+
+    result = bulk_mutate(db, ops)
+    for failure in result["failed"]:
+        print(f"Failed to write {failure['path']}: {failure['error']}")
+    return len(result["succeeded"]), conflicts
+
+
+if __name__ == "__main__":
+    from app import db
+
+    written, conflicts = backfill(db)
+    for email, first_id, other_id in conflicts:
+        print(f"Duplicate email {email}: kept {first_id}, skipped {other_id}")
+    print(f"Wrote {written} email keys.")
+    print("Set EMAIL_KEYS_BACKFILLED=true once every worker is running this version.")
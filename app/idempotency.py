@@ -0,0 +1,192 @@
+"""
+Request-key deduplication for retried writes.
+
+A client that sends an ``Idempotency-Key`` header claims a record in
+``idempotency_keys`` before doing any work. The route's writes and the
+completed record (status code and response body) are committed in the same
+transaction, so a retry with the same key replays the stored response without
+writing anything.
+
+Concurrent duplicates coalesce: inside one worker they wait on the first
+request's in-flight event, across workers they see the pending record and
+poll until it completes.
+
+Each claim records an owner token. The completed record is only stored, and
+a failed request's claim only released, while the claim still belongs to the
+request: one that outlived ``PENDING_TIMEOUT`` and was taken over leaves the
+key to its new owner.
+
+Records carry an ``expires_at`` timestamp. Configure a Firestore TTL policy on
+``idempotency_keys.expires_at`` so they are eventually removed; until then,
+expired records are ignored.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from .transactions import run_transaction
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+RECORD_TTL = timedelta(hours=int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+# A pending claim older than this is assumed abandoned (worker crashed) and may be taken over.
+PENDING_TIMEOUT = timedelta(seconds=int(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "30")))
+WAIT_TIMEOUT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "10"))
+POLL_INTERVAL_SECONDS = 0.25
+
+_inflight_lock = threading.Lock()
+_inflight = {}  # record id -> threading.Event set when the owning request finishes
+
+
+def fingerprint_request(*parts):
+    """Hash the parts of a request that must match for a key to be reused."""
+    canonical = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def record_ref(db, scope, key):
+    record_id = hashlib.sha256(f"{scope}:{key}".encode("utf-8")).hexdigest()
+    return db.collection(IDEMPOTENCY_COLLECTION).document(record_id)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _claim(transaction, ref, scope, fingerprint, owner):
+    """Return ('claimed' | 'pending' | 'completed' | 'conflict', record)."""
+    snapshot = ref.get(transaction=transaction)
+    now = _now()
+    if snapshot.exists:
+        record = snapshot.to_dict()
+        expired = record.get("expires_at") and record["expires_at"] <= now
+        if not expired:
+            if record.get("fingerprint") != fingerprint:
+                return "conflict", record
+            if record.get("status") == "completed":
+                return "completed", record
+            claimed_at = record.get("claimed_at")
+            if claimed_at and now - claimed_at < PENDING_TIMEOUT:
+                return "pending", record
+
+    transaction.set(ref, {
+        "scope": scope,
+        "status": "pending",
+        "fingerprint": fingerprint,
+        "owner": owner,
+        "claimed_at": now,
+        "expires_at": now + RECORD_TTL,
+    })
+    return "claimed", None
+
+
+def _owns(transaction, ref, fingerprint, owner):
+    """Whether the claim on `ref` is still this request's (read through `transaction`)."""
+    snapshot = ref.get(transaction=transaction)
+    record = snapshot.to_dict() if snapshot.exists else {}
+    return record.get("fingerprint") == fingerprint and record.get("owner") == owner
+
+
+def _release(transaction, ref, fingerprint, owner):
+    if _owns(transaction, ref, fingerprint, owner):
+        transaction.delete(ref)
+
+
+def _wait_for_completion(ref, timeout=WAIT_TIMEOUT_SECONDS):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        snapshot = ref.get()
+        if snapshot.exists and snapshot.to_dict().get("status") == "completed":
+            return snapshot.to_dict()
+        time.sleep(POLL_INTERVAL_SECONDS)
+    return None
+
+
+def _replay(record):
+    return record.get("response_body"), record.get("response_status", 200), True
+
+
+def _in_progress():
+    return {'message': 'A request with this Idempotency-Key is still being processed. Retry shortly.'}, 409, False
+
+
+def run_idempotent(db, scope, key, fingerprint, handler):
+    """
+    Run `handler(transaction)` at most once per (scope, key).
+
+    `handler` does its reads through the transaction it is given, queues its
+    writes on it and returns (body, status_code). On success the completed
+    record is written in the same transaction; on an error status the handler
+    must not have queued writes, and the claim is released so the client can
+    retry.
+
+    Returns (body, status_code, replayed).
+    """
+    ref = record_ref(db, scope, key)
+    owner = uuid.uuid4().hex
+
+    with _inflight_lock:
+        event = _inflight.get(ref.id)
+        is_owner = event is None
+        if is_owner:
+            event = _inflight[ref.id] = threading.Event()
+
+    if not is_owner:
+        # Another thread in this worker is handling the same key; wait for it instead of claiming.
+        event.wait(WAIT_TIMEOUT_SECONDS)
+        snapshot = ref.get()
+        if snapshot.exists:
+            record = snapshot.to_dict()
+            if record.get("fingerprint") != fingerprint:
+                return {'message': 'Idempotency-Key was already used for a different request.'}, 422, False
+            if record.get("status") == "completed":
+                return _replay(record)
+        return _in_progress()
+
+    try:
+        state, record = run_transaction(db, _claim, ref, scope, fingerprint, owner)
+        if state == "conflict":
+            return {'message': 'Idempotency-Key was already used for a different request.'}, 422, False
+        if state == "completed":
+            return _replay(record)
+        if state == "pending":
+            record = _wait_for_completion(ref)
+            return _replay(record) if record else _in_progress()
+
+        def write(transaction):
+            # Read before the handler so the claim is part of the transaction's read set.
+            if not _owns(transaction, ref, fingerprint, owner):
+                return None
+            body, status_code = handler(transaction)
+            if status_code < 400:
+                transaction.set(ref, {
+                    "status": "completed",
+                    "response_status": status_code,
+                    "response_body": body,
+                    "completed_at": _now(),
+                }, merge=True)
+            return body, status_code
+
+        try:
+            result = run_transaction(db, write)
+        except Exception:
+            run_transaction(db, _release, ref, fingerprint, owner)
+            raise
+
+        if result is None:
+            # The claim expired and another request took the key over; its response is the one to return.
+            record = _wait_for_completion(ref)
+            return _replay(record) if record else _in_progress()
+        body, status_code = result
+        if status_code >= 400:
+            run_transaction(db, _release, ref, fingerprint, owner)
+        return body, status_code, False
+    finally:
+        with _inflight_lock:
+            _inflight.pop(ref.id, None)
+        event.set()
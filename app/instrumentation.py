@@ -0,0 +1,461 @@
+"""
+Firestore operation accounting.
+
+`instrument(client)` wraps a Firestore (or in-memory) client so that every
+document read, document write and RPC is counted. References, queries,
+snapshots, batches and transactions handed out by the wrapper are wrapped as
+well, so a route never needs to know it is being measured.
+
+Counts go to the `OperationCounter` active in the current context - one per
+request, installed by `init_app` - and to process-wide totals per route
+(`get_operation_totals()`). Operations outside a request (CLI tools,
+background threads) are totalled under "<none>". Reads are counted the way
+Firestore bills them: one per document returned, and one for a query that
+returns nothing.
+
+Observers registered with `add_operation_observer` are told the operation
+name, start time and duration of every RPC (metrics and tracing use this).
+
+With ``FIRESTORE_OPS_HEADER=true`` every response carries the request's counts
+in an ``X-Firestore-Ops`` header (off by default: they describe the data
+behind a response). `count_operations()` and `assert_budget()` let
+scripts and benchmarks pin down how many operations an endpoint may cost.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+OPS_HEADER = "X-Firestore-Ops"
+FIRESTORE_OPS_HEADER = os.getenv("FIRESTORE_OPS_HEADER", "false").strip().lower() in ("1", "true", "yes")
+UNATTRIBUTED = "<none>"
+
+_current = contextvars.ContextVar("firestore_operation_counter", default=None)
+
+_totals_lock = threading.Lock()
+_totals = {}  # route -> {"requests", "reads", "writes", "rpcs"}
+
+_observers = []  # callables(operation, started_at, duration_seconds)
+
+
+class OperationBudgetExceeded(AssertionError):
+    pass
+
+
+class OperationCounter:
+    """Reads, writes and RPCs for one request (or one `count_operations` block)."""
+
+    def __init__(self, route=UNATTRIBUTED):
+        self.route = route
+        self.reads = 0
+        self.writes = 0
+        self.rpcs = 0
+        self.by_operation = {}  # operation name -> number of RPCs
+        self._lock = threading.Lock()
+
+    def add(self, operation, reads=0, writes=0, rpcs=1):
+        with self._lock:
+            self.reads += reads
+            self.writes += writes
+            self.rpcs += rpcs
+            self.by_operation[operation] = self.by_operation.get(operation, 0) + rpcs
+
+    def as_dict(self):
+        with self._lock:
+            return {"reads": self.reads, "writes": self.writes, "rpcs": self.rpcs}
+
+    def header_value(self):
+        counts = self.as_dict()
+        return f"reads={counts['reads']}; writes={counts['writes']}; rpcs={counts['rpcs']}"
+
+
+def current_counter():
+    return _current.get()
+
+
+def _record(operation, reads=0, writes=0, rpcs=1):
+    counter = _current.get()
+    if counter is not None:
+        counter.add(operation, reads, writes, rpcs)
+        return
+    _add_to_totals(UNATTRIBUTED, reads, writes, rpcs, requests=0)
+
+
+def _add_to_totals(route, reads, writes, rpcs, requests=1):
+    with _totals_lock:
+        totals = _totals.setdefault(route, {"requests": 0, "reads": 0, "writes": 0, "rpcs": 0})
+        totals["requests"] += requests
+        totals["reads"] += reads
+        totals["writes"] += writes
+        totals["rpcs"] += rpcs
+
+
+def add_operation_observer(observer):
+    """Call `observer(operation, started_at, duration)` after every RPC; started_at is epoch seconds."""
+    _observers.append(observer)
+
+
+@contextmanager
+def _timed(operation):
+    started_at, started = time.time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        if _observers:
+            duration = time.perf_counter() - started
+            for observer in _observers:
+                observer(operation, started_at, duration)
+
+
+def add_request_totals(route, counter):
+    """Fold one request's counter into the per-route totals."""
+    counts = counter.as_dict()
+    _add_to_totals(route, counts["reads"], counts["writes"], counts["rpcs"])
+
+
+def get_operation_totals():
+    """Process-wide {route: {requests, reads, writes, rpcs}}."""
+    with _totals_lock:
+        return {route: dict(totals) for route, totals in _totals.items()}
+
+
+def reset_operation_totals():
+    with _totals_lock:
+        _totals.clear()
+
+
+@contextmanager
+def count_operations(route=UNATTRIBUTED):
+    """Count the operations made inside the block (in this context) on a fresh counter."""
+    counter = OperationCounter(route)
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
+
+
+def assert_budget(counter, name="", reads=None, writes=None, rpcs=None):
+    """Raise OperationBudgetExceeded if `counter` (an OperationCounter or dict) is over any given limit."""
+    counts = counter.as_dict() if isinstance(counter, OperationCounter) else counter
+    over = [
+        f"{metric} {counts[metric]} > {limit}"
+        for metric, limit in (("reads", reads), ("writes", writes), ("rpcs", rpcs))
+        if limit is not None and counts[metric] > limit
+    ]
+    if over:
+        raise OperationBudgetExceeded(f"{name or 'operation'} over budget: {', '.join(over)}")
+
+
+# --- Flask integration ---
+
+def init_app(app):
+    """Give every request its own counter and fold it into the per-route totals."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_counting():
+        g.firestore_ops = OperationCounter()
+        g.firestore_ops_token = _current.set(g.firestore_ops)
+
+    @app.after_request
+    def _ops_header(response):
+        counter = g.get("firestore_ops")
+        if counter is not None and FIRESTORE_OPS_HEADER:
+            response.headers[OPS_HEADER] = counter.header_value()
+        return response
+
+    @app.teardown_request
+    def _stop_counting(exc):
+        counter = g.pop("firestore_ops", None)
+        token = g.pop("firestore_ops_token", None)
+        if counter is None:
+            return
+        if token is not None:
+            _current.reset(token)
+        rule = request.url_rule
+        add_request_totals(f"{request.method} {rule.rule}" if rule is not None else f"{request.method} <unmatched>", counter)
+
+
+# --- Client wrappers ---
+
+def _unwrap(value):
+    return value._wrapped if isinstance(value, _Proxy) else value
+
+
+class _Proxy:
+    """Forward everything not overridden to the wrapped object."""
+
+    def __init__(self, wrapped):
+        object.__setattr__(self, "_wrapped", wrapped)
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._wrapped, name, value)
+
+    def __eq__(self, other):
+        return self._wrapped == _unwrap(other)
+
+    def __hash__(self):
+        return hash(self._wrapped)
+
+    def __repr__(self):
+        return f"<instrumented {self._wrapped!r}>"
+
+
+class InstrumentedSnapshot(_Proxy):
+    @property
+    def reference(self):
+        return InstrumentedDocument(self._wrapped.reference)
+
+
+def _count_stream(operation, snapshots):
+    _record(operation, rpcs=1)
+    started_at, busy, returned = time.time(), 0.0, 0
+    iterator = iter(snapshots)
+    try:
+        while True:
+            # Only time spent inside the client counts, not the caller's work between documents.
+            started = time.perf_counter()
+            try:
+                snapshot = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                busy += time.perf_counter() - started
+            returned += 1
+            _record(operation, reads=1, rpcs=0)
+            yield InstrumentedSnapshot(snapshot)
+    finally:
+        if returned == 0:
+            _record(operation, reads=1, rpcs=0)
+        for observer in _observers:
+            observer(operation, started_at, busy)
+
+
+class InstrumentedQuery(_Proxy):
+    def _derive(self, method, *args, **kwargs):
+        return InstrumentedQuery(getattr(self._wrapped, method)(*args, **kwargs))
+
+    def where(self, *args, **kwargs):
+        return self._derive("where", *args, **kwargs)
+
+    def order_by(self, *args, **kwargs):
+        return self._derive("order_by", *args, **kwargs)
+
+    def limit(self, *args, **kwargs):
+        return self._derive("limit", *args, **kwargs)
+
+    def limit_to_last(self, *args, **kwargs):
+        return self._derive("limit_to_last", *args, **kwargs)
+
+    def offset(self, *args, **kwargs):
+        return self._derive("offset", *args, **kwargs)
+
+    def select(self, *args, **kwargs):
+        return self._derive("select", *args, **kwargs)
+
+    def start_at(self, *args, **kwargs):
+        return self._derive("start_at", *args, **kwargs)
+
+    def start_after(self, *args, **kwargs):
+        return self._derive("start_after", *args, **kwargs)
+
+    def end_at(self, *args, **kwargs):
+        return self._derive("end_at", *args, **kwargs)
+
+    def end_before(self, *args, **kwargs):
+        return self._derive("end_before", *args, **kwargs)
+
+    def stream(self, transaction=None, **kwargs):
+        return _count_stream("query", self._wrapped.stream(transaction=_unwrap(transaction), **kwargs))
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction=transaction, **kwargs))
+
+    def count(self, *args, **kwargs):
+        return InstrumentedAggregation(self._wrapped.count(*args, **kwargs))
+
+
+class InstrumentedAggregation(_Proxy):
+    def get(self, transaction=None, **kwargs):
+        _record("aggregation", reads=1)
+        with _timed("aggregation"):
+            return self._wrapped.get(transaction=_unwrap(transaction), **kwargs)
+
+
+class InstrumentedCollection(InstrumentedQuery):
+    @property
+    def parent(self):
+        parent = self._wrapped.parent
+        return InstrumentedDocument(parent) if parent is not None else None
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def add(self, *args, **kwargs):
+        _record("add", writes=1)
+        with _timed("add"):
+            timestamp, ref = self._wrapped.add(*args, **kwargs)
+        return timestamp, InstrumentedDocument(ref)
+
+    def list_documents(self, *args, **kwargs):
+        with _timed("list_documents"):
+            refs = list(self._wrapped.list_documents(*args, **kwargs))
+        _record("list_documents", reads=max(len(refs), 1))
+        return [InstrumentedDocument(ref) for ref in refs]
+
+
+class InstrumentedDocument(_Proxy):
+    @property
+    def parent(self):
+        return InstrumentedCollection(self._wrapped.parent)
+
+    def collection(self, *args, **kwargs):
+        return InstrumentedCollection(self._wrapped.collection(*args, **kwargs))
+
+    def collections(self, *args, **kwargs):
+        _record("list_collections")
+        with _timed("list_collections"):
+            return [InstrumentedCollection(c) for c in self._wrapped.collections(*args, **kwargs)]
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        _record("get", reads=1)
+        with _timed("get"):
+            snapshot = self._wrapped.get(field_paths=field_paths, transaction=_unwrap(transaction), **kwargs)
+        return InstrumentedSnapshot(snapshot)
+
+    def set(self, *args, **kwargs):
+        _record("set", writes=1)
+        with _timed("set"):
+            return self._wrapped.set(*args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        _record("create", writes=1)
+        with _timed("create"):
+            return self._wrapped.create(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        _record("update", writes=1)
+        with _timed("update"):
+            return self._wrapped.update(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        _record("delete", writes=1)
+        with _timed("delete"):
+            return self._wrapped.delete(*args, **kwargs)
+
+
+class InstrumentedBatch(_Proxy):
+    """Counts queued writes and charges them when the batch commits."""
+
+    def __init__(self, wrapped):
+        super().__init__(wrapped)
+        object.__setattr__(self, "pending_writes", 0)
+
+    def _queue(self):
+        object.__setattr__(self, "pending_writes", self.pending_writes + 1)
+
+    def set(self, reference, *args, **kwargs):
+        self._queue()
+        return self._wrapped.set(_unwrap(reference), *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        self._queue()
+        return self._wrapped.create(_unwrap(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        self._queue()
+        return self._wrapped.update(_unwrap(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        self._queue()
+        return self._wrapped.delete(_unwrap(reference), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        _record("commit", writes=self.pending_writes)
+        object.__setattr__(self, "pending_writes", 0)
+        with _timed("commit"):
+            return self._wrapped.commit(*args, **kwargs)
+
+
+class InstrumentedTransaction(InstrumentedBatch):
+    """
+    Transactions are driven by google.cloud.firestore's `transactional`, which
+    calls the private `_begin` / `_commit` / `_clean_up` hooks; they are
+    forwarded here so each attempt is counted.
+    """
+
+    def _begin(self, *args, **kwargs):
+        _record("begin_transaction")
+        with _timed("begin_transaction"):
+            return self._wrapped._begin(*args, **kwargs)
+
+    def _clean_up(self, *args, **kwargs):
+        object.__setattr__(self, "pending_writes", 0)
+        return self._wrapped._clean_up(*args, **kwargs)
+
+    def _rollback(self, *args, **kwargs):
+        _record("rollback")
+        with _timed("rollback"):
+            return self._wrapped._rollback(*args, **kwargs)
+
+    def _commit(self, *args, **kwargs):
+        _record("commit", writes=self.pending_writes)
+        object.__setattr__(self, "pending_writes", 0)
+        with _timed("commit"):
+            return self._wrapped._commit(*args, **kwargs)
+
+
+class InstrumentedClient(_Proxy):
+    def collection(self, *args, **kwargs):
+        return InstrumentedCollection(self._wrapped.collection(*args, **kwargs))
+
+    def collection_group(self, *args, **kwargs):
+        return InstrumentedQuery(self._wrapped.collection_group(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def collections(self, *args, **kwargs):
+        _record("list_collections")
+        with _timed("list_collections"):
+            return [InstrumentedCollection(c) for c in self._wrapped.collections(*args, **kwargs)]
+
+    def batch(self, *args, **kwargs):
+        return InstrumentedBatch(self._wrapped.batch(*args, **kwargs))
+
+    def transaction(self, *args, **kwargs):
+        return InstrumentedTransaction(self._wrapped.transaction(*args, **kwargs))
+
+    def get_all(self, references, *args, transaction=None, **kwargs):
+        references = [_unwrap(ref) for ref in references]
+        _record("get_all", reads=len(references))
+        with _timed("get_all"):
+            snapshots = list(self._wrapped.get_all(references, *args, transaction=_unwrap(transaction), **kwargs))
+        return [InstrumentedSnapshot(snapshot) for snapshot in snapshots]
+
+    def run_transaction(self, fn, *args, **kwargs):
+        """In-memory client only: run `fn` with an instrumented transaction, counting each attempt's commit."""
+        def attempt(transaction, *fn_args, **fn_kwargs):
+            wrapped = InstrumentedTransaction(transaction)
+            result = fn(wrapped, *fn_args, **fn_kwargs)
+            _record("commit", writes=wrapped.pending_writes)
+            return result
+
+        return self._wrapped.run_transaction(attempt, *args, **kwargs)
+
+
+def instrument(client):
+    """Wrap `client` so its operations are counted. Wrapping twice is a no-op."""
+    if isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client)
+
+
+def unwrap(client):
+    """Return the client underneath any instrumentation."""
+    return _unwrap(client)
@@ -0,0 +1,78 @@
+"""
+Structured, leveled and sampled logging.
+
+Modules log through ``logging.getLogger(__name__)``; everything under the
+``app`` logger is written to stderr as one JSON object per line:
+
+    {"ts": "...", "level": "INFO", "logger": "app.routes", "msg": "Archived client", "user_id": "..."}
+
+Keyword fields are passed with ``extra={...}``. Exceptions logged with
+``logger.exception`` carry the traceback in ``exc``.
+
+``LOG_LEVEL`` (default INFO) sets the threshold. ``LOG_SAMPLE_RATE`` (default
+1.0) keeps that fraction of DEBUG and INFO records so busy routes do not pay
+for a write per request; WARNING and above are never sampled. A record can
+override the rate with ``extra={"sample_rate": 0.01}``. ``LOG_FORMAT=text``
+switches to plain lines for local development.
+"""
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").strip().lower()
+
+# Attributes every LogRecord has; anything else was passed through `extra`.
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_rate"}
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = getattr(record, "sample_rate", self.rate)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    """Attach the structured handler to the ``app`` logger (once per process)."""
+    logger = logging.getLogger("app")
+    if getattr(logger, "_structured", False):
+        return logger
+
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    logger._structured = True
+    return logger
@@ -0,0 +1,662 @@
+"""
+In-memory stand-in for the Firestore client.
+
+Implements the part of the google-cloud-firestore API the app uses:
+collection and document references (get / set / update / create / delete),
+queries with ``where`` / ``order_by`` / ``limit`` / ``offset`` / ``stream`` /
+``count``, ``list_documents``, ``get_all``, collection-group queries, write
+batches and transactions, and the SERVER_TIMESTAMP / DELETE_FIELD / Increment /
+ArrayUnion / ArrayRemove transforms.
+
+The client counts the document reads, writes and round trips it serves, the
+way Firestore bills them (a query that matches nothing still costs one read);
+see ``stats()``.
+
+Every call that would be a round trip to Firestore (a document get, a query,
+a get_all, a commit) sleeps for ``latency_ms`` (plus up to ``jitter_ms``), so
+endpoint behaviour can be measured at realistic latencies without a project.
+Select it with ``DATASTORE_BACKEND=memory``; see app/datastore.py.
+
+Transactions are optimistic: documents read through a transaction must be
+unchanged at commit, otherwise the function is re-run, like the real client.
+Queries inside transactions only guard the documents they returned.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    from google.cloud.firestore import DELETE_FIELD, SERVER_TIMESTAMP, ArrayRemove, ArrayUnion, Increment
+except ImportError:
+    class _Sentinel:
+        def __init__(self, description):
+            self.description = description
+
+        def __repr__(self):
+            return f"Sentinel: {self.description}"
+
+    class _ValueList:
+        def __init__(self, values):
+            self.values = list(values)
+
+    class ArrayUnion(_ValueList):
+        pass
+
+    class ArrayRemove(_ValueList):
+        pass
+
+    class Increment:
+        def __init__(self, value):
+            self.value = value
+
+    DELETE_FIELD = _Sentinel("Value used to delete a field in a document.")
+    SERVER_TIMESTAMP = _Sentinel("Value used to set a document field to the server timestamp.")
+
+try:
+    from google.api_core.exceptions import Aborted, AlreadyExists, InvalidArgument, NotFound
+except ImportError:
+    class Aborted(Exception):
+        pass
+
+    class AlreadyExists(Exception):
+        pass
+
+    class InvalidArgument(Exception):
+        pass
+
+    class NotFound(Exception):
+        pass
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+MAX_WRITES_PER_COMMIT = 500
+MAX_TRANSACTION_ATTEMPTS = 5
+
+_ID_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+
+def _auto_id():
+    return "".join(random.choice(_ID_ALPHABET) for _ in range(20))
+
+
+def _copy(value):
+    """Copy nested dicts and lists; leaf values are immutable or treated as such."""
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, datetime) and value.tzinfo is None:
+        # Firestore stores naive datetimes as UTC and returns them timezone-aware.
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _get_field(data, field_path):
+    """Return (found, value) for a dotted field path."""
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _type_rank(value):
+    # Firestore's cross-type ordering: null < bool < number < timestamp < string < bytes < reference < ...
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, list):
+        return 8
+    if isinstance(value, dict):
+        return 9
+    return 7
+
+
+def _sort_key(value):
+    rank = _type_rank(value)
+    if rank in (7, 8, 9):
+        return rank, repr(value)
+    return rank, value
+
+
+def _compare(left, op, right):
+    if op == "==":
+        return _type_rank(left) == _type_rank(right) and left == right
+    if op == "!=":
+        return not (_type_rank(left) == _type_rank(right) and left == right)
+    if op == "in":
+        return any(_compare(left, "==", candidate) for candidate in right)
+    if op == "not-in":
+        return not any(_compare(left, "==", candidate) for candidate in right)
+    if op == "array-contains":
+        return isinstance(left, list) and any(_compare(item, "==", right) for item in left)
+    if op == "array-contains-any":
+        return isinstance(left, list) and any(_compare(item, "==", candidate) for item in left for candidate in right)
+    if _type_rank(left) != _type_rank(right):
+        # Range filters only match values of the same type.
+        return False
+    if op == "<":
+        return left < right
+    if op == "<=":
+        return left <= right
+    if op == ">":
+        return left > right
+    if op == ">=":
+        return left >= right
+    raise InvalidArgument(f"Unsupported filter operator: {op}")
+
+
+class _StoredDocument:
+    __slots__ = ("data", "version", "create_time", "update_time")
+
+    def __init__(self, data, version, now):
+        self.data = data
+        self.version = version
+        self.create_time = now
+        self.update_time = now
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return _copy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        found, value = _get_field(self._data, field_path)
+        if not found:
+            raise KeyError(field_path)
+        return _copy(value)
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, collection_id):
+        return CollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def collections(self):
+        return self._client._child_collections(self.path)
+
+    def get(self, field_paths=None, transaction=None):
+        self._client._round_trip()
+        return self._client._snapshot(self, transaction)
+
+    def set(self, document_data, merge=False):
+        batch = self._client.batch()
+        batch.set(self, document_data, merge=merge)
+        batch.commit()
+
+    def create(self, document_data):
+        batch = self._client.batch()
+        batch.create(self, document_data)
+        batch.commit()
+
+    def update(self, field_updates):
+        batch = self._client.batch()
+        batch.update(self, field_updates)
+        batch.commit()
+
+    def delete(self):
+        batch = self._client.batch()
+        batch.delete(self)
+        batch.commit()
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"<DocumentReference {self.path}>"
+
+
+class FieldFilter:
+    def __init__(self, field_path, op_string, value):
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+
+class AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class AggregationQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        self._query._client._round_trip()
+        with self._query._client._lock:
+            count = len(self._query._run(transaction, count_reads=False))
+        # Billed as one read per batch of up to 1000 index entries.
+        self._query._client._count(reads=1 + count // 1000)
+        return [[AggregationResult(self._alias, count)]]
+
+
+class Query:
+    def __init__(self, client, path, all_descendants=False, filters=(), orders=(), limit=None, offset=0):
+        self._client = client
+        self._path = path
+        self._all_descendants = all_descendants
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+
+    def _copy_with(self, **changes):
+        state = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "offset": self._offset,
+        }
+        state.update(changes)
+        return Query(self._client, self._path, self._all_descendants, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy_with(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy_with(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy_with(limit=count)
+
+    def offset(self, num_to_skip):
+        return self._copy_with(offset=num_to_skip)
+
+    def select(self, field_paths):
+        # Projections only save bandwidth; full documents are returned.
+        return self
+
+    def count(self, alias=None):
+        return AggregationQuery(self, alias or "field_1")
+
+    def _matches(self, data):
+        for field_path, op, value in self._filters:
+            found, field_value = _get_field(data, field_path)
+            if not found:
+                return False
+            if not _compare(field_value, op, value):
+                return False
+        # Ordering on a field excludes documents that do not have it.
+        return all(_get_field(data, field_path)[0] for field_path, _ in self._orders)
+
+    def _run(self, transaction=None, count_reads=True):
+        documents = self._client._scan(self._path, self._all_descendants)
+        matched = [(path, stored) for path, stored in documents if self._matches(stored.data)]
+
+        # Stable sorts applied from the last order to the first give a multi-key sort.
+        matched.sort(key=lambda item: item[0])
+        for field_path, direction in reversed(self._orders):
+            matched.sort(
+                key=lambda item: _sort_key(_get_field(item[1].data, field_path)[1]),
+                reverse=direction == DESCENDING,
+            )
+
+        matched = matched[self._offset:]
+        if self._limit is not None:
+            matched = matched[:self._limit]
+
+        if count_reads:
+            self._client._count(reads=max(len(matched), 1))
+        snapshots = []
+        for path, stored in matched:
+            if transaction is not None:
+                transaction._record_read(path, stored.version)
+            snapshots.append(DocumentSnapshot(
+                DocumentReference(self._client, path), stored.data, stored.create_time, stored.update_time))
+        return snapshots
+
+    def stream(self, transaction=None):
+        self._client._round_trip()
+        with self._client._lock:
+            snapshots = self._run(transaction)
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._path.rsplit("/", 1)[-1]
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def parent(self):
+        if "/" not in self._path:
+            return None
+        return DocumentReference(self._client, self._path.rsplit("/", 1)[0])
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, f"{self._path}/{document_id or _auto_id()}")
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return datetime.now(timezone.utc), ref
+
+    def list_documents(self, page_size=None):
+        """Documents that exist or have subcollections, like the real list_documents."""
+        self._client._round_trip()
+        document_ids = self._client._child_document_ids(self._path)
+        self._client._count(reads=max(len(document_ids), 1))
+        return [self.document(document_id) for document_id in document_ids]
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("merge" if merge else "set", reference.path, _copy(document_data)))
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference.path, _copy(document_data)))
+
+    def update(self, reference, field_updates):
+        self._writes.append(("update", reference.path, _copy(field_updates)))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference.path, None))
+
+    def commit(self):
+        self._client._round_trip()
+        self._client._commit(self._writes)
+        self._writes = []
+
+
+class Transaction(WriteBatch):
+    def __init__(self, client):
+        super().__init__(client)
+        self._reads = {}
+
+    def _record_read(self, path, version):
+        if self._writes:
+            raise ValueError("Attempted read after write in a transaction.")
+        self._reads.setdefault(path, version)
+
+    def _reset(self):
+        self._writes = []
+        self._reads = {}
+
+    def commit(self):
+        self._client._round_trip()
+        self._client._commit(self._writes, self._reads)
+        self._reset()
+
+
+class MemoryClient:
+    """Thread-safe in-memory replacement for google.cloud.firestore.Client."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._lock = threading.RLock()
+        self._collections = {}  # collection path -> {document id: _StoredDocument}
+        self._version = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {"reads": 0, "writes": 0, "round_trips": 0}
+
+    # --- Public API ---
+
+    def collection(self, collection_id):
+        return CollectionReference(self, collection_id)
+
+    def document(self, document_path):
+        return DocumentReference(self, document_path)
+
+    def collection_group(self, collection_id):
+        return Query(self, collection_id, all_descendants=True)
+
+    def collections(self):
+        return self._child_collections("")
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._round_trip()
+        return iter([self._snapshot(reference, transaction) for reference in references])
+
+    def run_transaction(self, fn, *args, **kwargs):
+        """Run `fn(transaction, *args, **kwargs)`, retrying if a document it read changed before commit."""
+        for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+            transaction = self.transaction()
+            result = fn(transaction, *args, **kwargs)
+            try:
+                transaction.commit()
+                return result
+            except Aborted:
+                if attempt == MAX_TRANSACTION_ATTEMPTS - 1:
+                    raise
+
+    def reset(self):
+        """Drop every document."""
+        with self._lock:
+            self._collections.clear()
+
+    def stats(self):
+        """Reads, writes and round trips served since creation or the last reset_stats()."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._stats_lock:
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def document_count(self):
+        with self._lock:
+            return sum(len(documents) for documents in self._collections.values())
+
+    # --- Internals ---
+
+    def _count(self, reads=0, writes=0):
+        with self._stats_lock:
+            self._stats["reads"] += reads
+            self._stats["writes"] += writes
+
+    def _round_trip(self):
+        with self._stats_lock:
+            self._stats["round_trips"] += 1
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _snapshot(self, reference, transaction=None):
+        collection_path, document_id = reference.path.rsplit("/", 1)
+        with self._lock:
+            stored = self._collections.get(collection_path, {}).get(document_id)
+            self._count(reads=1)
+            if transaction is not None:
+                transaction._record_read(reference.path, stored.version if stored else None)
+            if stored is None:
+                return DocumentSnapshot(reference, None)
+            return DocumentSnapshot(reference, stored.data, stored.create_time, stored.update_time)
+
+    def _scan(self, path, all_descendants):
+        if not all_descendants:
+            return [(f"{path}/{doc_id}", stored) for doc_id, stored in self._collections.get(path, {}).items()]
+        documents = []
+        for collection_path, collection in self._collections.items():
+            if collection_path.rsplit("/", 1)[-1] == path:
+                documents.extend((f"{collection_path}/{doc_id}", stored) for doc_id, stored in collection.items())
+        return documents
+
+    def _child_document_ids(self, collection_path):
+        with self._lock:
+            ids = set(self._collections.get(collection_path, {}))
+            prefix = collection_path + "/"
+            for path, documents in self._collections.items():
+                if path.startswith(prefix) and documents:
+                    ids.add(path[len(prefix):].split("/", 1)[0])
+        return sorted(ids)
+
+    def _child_collections(self, document_path):
+        prefix = document_path + "/" if document_path else ""
+        with self._lock:
+            ids = {
+                path[len(prefix):].split("/", 1)[0]
+                for path, documents in self._collections.items()
+                if path.startswith(prefix) and documents
+            }
+        if document_path:
+            return [CollectionReference(self, f"{document_path}/{collection_id}") for collection_id in sorted(ids)]
+        return [CollectionReference(self, collection_id) for collection_id in sorted(ids)]
+
+    def _commit(self, writes, reads=None):
+        if len(writes) > MAX_WRITES_PER_COMMIT:
+            raise InvalidArgument(f"A commit may contain at most {MAX_WRITES_PER_COMMIT} writes.")
+        now = datetime.now(timezone.utc)
+        self._count(writes=len(writes))
+        with self._lock:
+            for path, version in (reads or {}).items():
+                collection_path, document_id = path.rsplit("/", 1)
+                stored = self._collections.get(collection_path, {}).get(document_id)
+                if (stored.version if stored else None) != version:
+                    raise Aborted(f"Document {path} changed during the transaction.")
+
+            # Validate everything first so a failing commit applies nothing.
+            staged = {}
+            for kind, path, data in writes:
+                collection_path, document_id = path.rsplit("/", 1)
+                current = staged[path] if path in staged else self._collections.get(collection_path, {}).get(document_id)
+                current_data = current.data if isinstance(current, _StoredDocument) else current
+                if kind == "create" and current_data is not None:
+                    raise AlreadyExists(f"Document already exists: {path}")
+                if kind == "update" and current_data is None:
+                    raise NotFound(f"No document to update: {path}")
+                staged[path] = _apply_write(kind, current_data, data, now)
+
+            for path, data in staged.items():
+                collection_path, document_id = path.rsplit("/", 1)
+                collection = self._collections.setdefault(collection_path, {})
+                if data is None:
+                    collection.pop(document_id, None)
+                    continue
+                self._version += 1
+                stored = collection.get(document_id)
+                if stored is None:
+                    collection[document_id] = _StoredDocument(data, self._version, now)
+                else:
+                    stored.data = data
+                    stored.version = self._version
+                    stored.update_time = now
+
+
+def _set_path(data, field_path, value):
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    if value is DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = value
+
+
+def _resolve(value, current, now):
+    """Resolve a write value against the field's current value, applying transforms."""
+    if value is SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if isinstance(value, ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        result.extend(item for item in value.values if item not in result)
+        return result
+    if isinstance(value, ArrayRemove):
+        return [item for item in current if item not in value.values] if isinstance(current, list) else []
+    if isinstance(value, dict):
+        return {k: _resolve(v, None, now) for k, v in value.items() if v is not DELETE_FIELD}
+    return value
+
+
+def _merge(target, updates, now):
+    for key, value in updates.items():
+        if value is DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value, now)
+        else:
+            target[key] = _resolve(value, target.get(key), now)
+
+
+def _apply_write(kind, current, data, now):
+    """Return the document contents after one write (None for a delete)."""
+    if kind == "delete":
+        return None
+    if kind in ("set", "create"):
+        return _resolve(data, None, now)
+    result = _copy(current) if current else {}
+    if kind == "merge":
+        _merge(result, data, now)
+        return result
+    for field_path, value in data.items():
+        found, existing = _get_field(result, field_path)
+        _set_path(result, field_path, value if value is DELETE_FIELD else _resolve(value, existing if found else None, now))
+    return result
@@ -0,0 +1,171 @@
+"""
+Prometheus metrics.
+
+Recorded per request, labelled by HTTP method and route template (e.g.
+``/user-data/<user_id>/sessions/<session_id>``), so label cardinality stays
+bounded:
+
+* ``http_request_duration_seconds`` - latency histogram
+* ``http_requests_total`` - responses by status code
+* ``http_requests_in_flight`` - requests currently being handled
+
+Plus ``firestore_operation_duration_seconds`` by operation (fed by
+app/instrumentation.py), ``firestore_documents_total`` by reads / writes,
+``cache_requests_total`` by cache and hit / miss (see `record_cache`),
+``firestore_bulk_writes_total`` by ops / batches / failed_ops
+(app/bulk_writes.py), and ``admission_wait_seconds`` /
+``admission_rejected_total`` by priority class (app/admission.py).
+
+``GET /metrics`` serves them in the Prometheus text format. Under gunicorn each
+worker writes its samples to ``PROMETHEUS_MULTIPROC_DIR`` (set up by
+gunicorn.conf.py) and the endpoint aggregates all workers, so it is correct
+whichever worker answers the scrape. Set ``METRICS_TOKEN`` to require
+``Authorization: Bearer <token>`` on the endpoint.
+
+prometheus_client is optional: without it every metric is a no-op and
+``/metrics`` answers 503.
+"""
+import logging
+import os
+import time
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+    )
+except ImportError:
+    CollectorRegistry = None
+
+from .instrumentation import add_operation_observer, current_counter
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = "/metrics"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FIRESTORE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Sample rate of the per-request access log line.
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "0.1"))
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def dec(self, *args, **kwargs):
+        pass
+
+
+if CollectorRegistry is not None:
+    REQUEST_LATENCY = Histogram(
+        "http_request_duration_seconds", "Request latency by route.", ["method", "route"], buckets=REQUEST_BUCKETS)
+    REQUESTS = Counter("http_requests_total", "Responses by route and status code.", ["method", "route", "status"])
+    IN_FLIGHT = Gauge(
+        "http_requests_in_flight", "Requests being handled.", ["method", "route"], multiprocess_mode="livesum")
+    FIRESTORE_LATENCY = Histogram(
+        "firestore_operation_duration_seconds", "Firestore RPC latency by operation.", ["operation"],
+        buckets=FIRESTORE_BUCKETS)
+    FIRESTORE_DOCUMENTS = Counter("firestore_documents_total", "Firestore documents read or written.", ["kind"])
+    CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and result.", ["cache", "result"])
+    ADMISSION_WAIT = Histogram(
+        "admission_wait_seconds", "Time spent queueing for an admission slot.", ["priority"], buckets=REQUEST_BUCKETS)
+    ADMISSION_REJECTED = Counter("admission_rejected_total", "Requests shed with 503 by priority class.", ["priority"])
+    BULK_WRITES = Counter(
+        "firestore_bulk_writes_total", "Bulk write operations, batch commits and failed operations.", ["kind"])
+else:
+    REQUEST_LATENCY = REQUESTS = IN_FLIGHT = FIRESTORE_LATENCY = FIRESTORE_DOCUMENTS = CACHE_REQUESTS = _NoopMetric()
+    ADMISSION_WAIT = ADMISSION_REJECTED = BULK_WRITES = _NoopMetric()
+
+
+def record_cache(cache, hit):
+    """Count a lookup in `cache`; hit rate is hits / (hits + misses)."""
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_bulk_writes(ops=0, batches=0, failed_ops=0):
+    for kind, count in (("ops", ops), ("batches", batches), ("failed_ops", failed_ops)):
+        if count:
+            BULK_WRITES.labels(kind=kind).inc(count)
+
+
+def _observe_firestore(operation, started_at, duration):
+    FIRESTORE_LATENCY.labels(operation=operation).observe(duration)
+
+
+def _route_label(request):
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+def render_metrics():
+    """Return (body, content_type) for the current metrics, aggregated across workers if multiprocess."""
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def init_app(app):
+    """Record request metrics for `app` and serve them on METRICS_PATH."""
+    from flask import Response, g, request
+
+    add_operation_observer(_observe_firestore)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_route = _route_label(request)
+        IN_FLIGHT.labels(method=request.method, route=g.metrics_route).inc()
+
+    @app.after_request
+    def _record_response(response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        route = g.metrics_route
+        duration = time.perf_counter() - started
+        REQUEST_LATENCY.labels(method=request.method, route=route).observe(duration)
+        REQUESTS.labels(method=request.method, route=route, status=str(response.status_code)).inc()
+
+        counter = current_counter()
+        counts = counter.as_dict() if counter is not None else {"reads": 0, "writes": 0, "rpcs": 0}
+        FIRESTORE_DOCUMENTS.labels(kind="read").inc(counts["reads"])
+        FIRESTORE_DOCUMENTS.labels(kind="write").inc(counts["writes"])
+
+        logger.info("request", extra={
+            "method": request.method,
+            "route": route,
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 2),
+            "firestore_reads": counts["reads"],
+            "firestore_writes": counts["writes"],
+            "firestore_rpcs": counts["rpcs"],
+            "sample_rate": ACCESS_LOG_SAMPLE_RATE,
+        })
+        return response
+
+    @app.teardown_request
+    def _finish(exc):
+        route = g.pop("metrics_route", None)
+        if route is not None:
+            IN_FLIGHT.labels(method=request.method, route=route).dec()
+
+    def metrics_endpoint():
+        if CollectorRegistry is None:
+            return Response("prometheus_client is not installed\n", status=503, mimetype="text/plain")
+        if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+            return Response("Unauthorized\n", status=401, mimetype="text/plain")
+        body, content_type = render_metrics()
+        return Response(body, status=200, headers={"Content-Type": content_type})
+
+    app.add_url_rule(METRICS_PATH, "metrics", metrics_endpoint, methods=["GET"])
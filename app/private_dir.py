@@ -0,0 +1,63 @@
+"""
+Private per-host state directories.
+
+The single-flight cache, admission slots, roster change log and reference
+cache generations share state between the workers on a host through files
+under /tmp. ``private_directory`` creates such a directory 0700 and reports
+whether it can be trusted: the directory must be owned by this user and closed
+to everyone else, and every directory above it must be owned by root or this
+user and not writable by others (unless sticky, like /tmp). A directory this
+user owns but left open is closed to 0700. ``open_private`` opens a file in
+it without following symlinks, creating it 0600.
+
+Callers fall back to per-process state when the directory is not private, so
+another local user can neither read nor forge what the workers share.
+"""
+import os
+import stat
+
+
+def _trusted_ancestor(path):
+    info = os.stat(path)
+    mode = stat.S_IMODE(info.st_mode)
+    return (stat.S_ISDIR(info.st_mode) and info.st_uid in (0, os.geteuid())
+            and (not mode & 0o022 or mode & stat.S_ISVTX))
+
+
+def private_directory(path):
+    """Create `path` (and missing parents) 0700 if needed; True if it is private to this user."""
+    path = os.path.abspath(path)
+    missing = []
+    directory = path
+    while not os.path.lexists(directory):
+        missing.append(directory)
+        directory = os.path.dirname(directory)
+    for directory in reversed(missing):
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.geteuid():
+        return False
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        # Left open by an older release; files other users created in it are refused by open_private.
+        os.chmod(path, 0o700)
+    parent = os.path.dirname(path)
+    while True:
+        if not _trusted_ancestor(parent):
+            return False
+        if parent == os.path.dirname(parent):
+            return True
+        parent = os.path.dirname(parent)
+
+
+def open_private(path, flags):
+    """os.open `path` without following symlinks (created 0600); raises PermissionError if another user owns it."""
+    fd = os.open(path, flags | os.O_NOFOLLOW, 0o600)
+    info = os.fstat(fd)
+    if not stat.S_ISREG(info.st_mode) or info.st_uid != os.geteuid():
+        os.close(fd)
+        raise PermissionError(f"{path} is not a regular file owned by this user")
+    return fd
@@ -0,0 +1,339 @@
+"""
+Opt-in request profiler.
+
+A request is profiled when it is picked by ``PROFILE_SAMPLE_RATE`` (fraction
+of requests, default 0) or when it takes longer than ``PROFILE_SLOW_MS``
+(default 0 = off). With both unset no hooks are registered, so a disabled
+profiler costs nothing.
+
+While enabled, one background thread samples the stack of every in-flight
+request thread every ``PROFILE_INTERVAL_MS`` (default 5). That is cheap
+enough to run on all requests, which is what lets a slow request be profiled
+after the fact; the samples of fast, unsampled requests are thrown away.
+
+A captured profile is one JSON file in ``PROFILE_DIR`` (default
+/tmp/headway-profiles) holding:
+
+* the route, method, query parameters, status and duration
+* ``stacks`` - folded stacks with sample counts (flamegraph.pl / speedscope
+  "collapsed" format) and ``top_functions`` by self samples
+* ``firestore`` - time spent waiting on Firestore RPCs, by operation, and the
+  request's read / write / RPC counts
+* ``memory`` - the top allocation sites from a tracemalloc snapshot
+
+Only the newest ``PROFILE_MAX_FILES`` (default 200) are kept. Allocation
+tracing is expensive, so by default it only runs for sampled requests; set
+``PROFILE_TRACEMALLOC=true`` to trace continuously and get a snapshot for slow
+requests too. tracemalloc is process-wide, so concurrent requests show up in
+each other's snapshots. Threads started by a request (bulk write workers) are
+not stack-sampled; their Firestore time is still counted.
+
+Admins list captured profiles with ``GET /admin/profiles`` and fetch one with
+``GET /admin/profiles/<name>``.
+"""
+import collections
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from .instrumentation import add_operation_observer, current_counter
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/headway-profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_TRACEMALLOC = os.getenv("PROFILE_TRACEMALLOC", "false").strip().lower() in ("1", "true", "yes")
+
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 25
+
+# <captured at>_<trigger>_<duration>ms_<route slug>.json
+_NAME_RE = re.compile(r"^(\d{8}T\d{12})_(sample|slow)_(\d+)ms_([A-Za-z0-9_.-]+)\.json$")
+
+_active = contextvars.ContextVar("request_profile", default=None)
+
+
+def profiling_enabled():
+    return PROFILE_SAMPLE_RATE > 0 or PROFILE_SLOW_MS > 0
+
+
+class _Sampler:
+    """Background thread folding the stacks of the watched threads into per-thread counters."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._targets = {}  # thread ident -> Counter(folded stack -> samples)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def watch(self, ident):
+        stacks = collections.Counter()
+        with self._lock:
+            self._targets[ident] = stacks
+            # A thread started before a fork does not exist in the child
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return stacks
+
+    def unwatch(self, ident):
+        with self._lock:
+            self._targets.pop(ident, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                targets = list(self._targets.items())
+            if not targets:
+                self._wake.clear()
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            for ident, stacks in targets:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[_fold(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def _fold(frame):
+    names = []
+    leaf = True
+    while frame is not None:
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        names.append(f"{module}:{code.co_name}:{frame.f_lineno}" if leaf else f"{module}:{code.co_name}")
+        leaf = False
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+_sampler = _Sampler(PROFILE_INTERVAL_MS / 1000.0)
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and not PROFILE_TRACEMALLOC:
+            tracemalloc.stop()
+
+
+class RequestProfile:
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.thread = threading.get_ident()
+        self.stacks = _sampler.watch(self.thread)
+        self.firestore = []  # (operation, seconds); appended from any thread in the request's context
+        self.snapshot = None
+        if sampled:
+            _start_tracing()
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def finish(self):
+        _sampler.unwatch(self.thread)
+        duration = time.perf_counter() - self.started
+        trigger = "sample" if self.sampled else "slow" if PROFILE_SLOW_MS and duration * 1000 >= PROFILE_SLOW_MS else None
+        memory = None
+        if trigger and tracemalloc.is_tracing():
+            memory = _memory_stats(tracemalloc.take_snapshot(), self.snapshot)
+        if self.sampled:
+            _stop_tracing()
+        return trigger, duration, memory
+
+
+def _memory_stats(snapshot, baseline=None):
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    if baseline is not None:
+        stats = snapshot.compare_to(baseline, "lineno")
+        top = [{"site": str(s.traceback), "size_kb": round(s.size_diff / 1024, 1), "count": s.count_diff}
+               for s in stats[:TOP_ALLOCATIONS]]
+        return {"mode": "diff", "top": top}
+    stats = snapshot.statistics("lineno")
+    top = [{"site": str(s.traceback), "size_kb": round(s.size / 1024, 1), "count": s.count}
+           for s in stats[:TOP_ALLOCATIONS]]
+    return {"mode": "live", "top": top}
+
+
+def _observe_firestore(operation, started_at, duration):
+    profile = _active.get()
+    if profile is not None:
+        profile.firestore.append((operation, duration))
+
+
+def _firestore_summary(profile):
+    by_operation = {}
+    for operation, duration in profile.firestore:
+        entry = by_operation.setdefault(operation, {"calls": 0, "ms": 0.0})
+        entry["calls"] += 1
+        entry["ms"] += duration * 1000
+    for entry in by_operation.values():
+        entry["ms"] = round(entry["ms"], 2)
+    summary = {
+        "wait_ms": round(sum(d for _, d in profile.firestore) * 1000, 2),
+        "by_operation": by_operation,
+    }
+    counter = current_counter()
+    if counter is not None:
+        summary.update(counter.as_dict())
+    return summary
+
+
+def _stack_summary(stacks):
+    self_samples = collections.Counter()
+    for stack, count in stacks.items():
+        self_samples[stack.rsplit(";", 1)[-1]] += count
+    return {
+        "interval_ms": PROFILE_INTERVAL_MS,
+        "samples": sum(stacks.values()),
+        "top_functions": [{"function": f, "samples": n} for f, n in self_samples.most_common(TOP_FUNCTIONS)],
+        "folded": [f"{stack} {count}" for stack, count in stacks.most_common()],
+    }
+
+
+def _slug(method, route):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", f"{method}{route}").strip("-")[:80] or "root"
+
+
+def _write_profile(entry, trigger, duration, slug):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    name = f"{stamp}_{trigger}_{int(duration * 1000)}ms_{slug}.json"
+    path = os.path.join(PROFILE_DIR, name)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entry, f, default=str)
+    os.replace(tmp, path)
+    _rotate()
+    return name
+
+
+def _rotate():
+    names = sorted(n for n in os.listdir(PROFILE_DIR) if _NAME_RE.match(n))
+    for name in names[:max(0, len(names) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass  # another worker rotated it first
+
+
+def list_profiles():
+    """Metadata of the captured profiles, newest first (parsed from the file names)."""
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in sorted(names, reverse=True):
+        match = _NAME_RE.match(name)
+        if not match:
+            continue
+        stamp, trigger, duration_ms, slug = match.groups()
+        try:
+            size = os.path.getsize(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            continue
+        profiles.append({
+            "name": name,
+            "captured_at": datetime.strptime(stamp, "%Y%m%dT%H%M%S%f").replace(tzinfo=timezone.utc).isoformat(),
+            "trigger": trigger,
+            "duration_ms": int(duration_ms),
+            "route": slug,
+            "size_kb": round(size / 1024, 1),
+        })
+    return profiles
+
+
+def load_profile(name):
+    """Return a captured profile by file name, or None if there is no such profile."""
+    if not _NAME_RE.match(name):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def init_app(app):
+    """Profile sampled and slow requests of `app`; a no-op unless PROFILE_SAMPLE_RATE or PROFILE_SLOW_MS is set."""
+    if not profiling_enabled():
+        return
+
+    from flask import g, request
+
+    add_operation_observer(_observe_firestore)
+    if PROFILE_TRACEMALLOC:
+        _start_tracing()
+
+    @app.before_request
+    def _start_profile():
+        sampled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+        g.request_profile = RequestProfile(sampled)
+        g.request_profile_token = _active.set(g.request_profile)
+
+    @app.after_request
+    def _profile_status(response):
+        g.request_profile_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        profile = g.pop("request_profile", None)
+        token = g.pop("request_profile_token", None)
+        if profile is None:
+            return
+        trigger, duration, memory = profile.finish()
+        try:
+            if trigger:
+                rule = request.url_rule
+                route = rule.rule if rule is not None else request.path
+                entry = {
+                    "captured_at": datetime.now(timezone.utc).isoformat(),
+                    "trigger": trigger,
+                    "method": request.method,
+                    "route": route,
+                    "path": request.path,
+                    "query": request.args.to_dict(flat=False),
+                    "status": g.pop("request_profile_status", 500 if exc else None),
+                    "error": repr(exc) if exc else None,
+                    "duration_ms": round(duration * 1000, 2),
+                    "firestore": _firestore_summary(profile),
+                    "stacks": _stack_summary(profile.stacks),
+                    "memory": memory,
+                }
+                name = _write_profile(entry, trigger, duration, _slug(request.method, route))
+                logger.info("Captured request profile", extra={"profile": name, "route": route, "trigger": trigger})
+        except OSError:
+            logger.exception("Could not write request profile")
+        finally:
+            if token is not None:
+                _active.reset(token)
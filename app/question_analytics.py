@@ -0,0 +1,259 @@
+"""
+Per-question outcome analytics.
+
+The other metrics reduce a session to its total score. These look at the
+answers: for every client with at least ``min_sessions`` (default 2) scored
+sessions, each question's change from the client's first to latest session,
+summarised per question, overall and per clinician:
+
+* ``mean_change`` - mean of latest minus first answer (negative is improvement,
+  as with the total score)
+* ``responder_rate`` - % of those clients whose answer improved by at least
+  ``threshold`` points (default 1)
+* ``total_correlation`` - Pearson correlation between the question's
+  improvement and the client's total-score improvement
+
+Sessions are read with one collection-group query over ``sessions``, ordered
+by timestamp (which needs the collection-group index on ``timestamp`` in
+firestore.indexes.json), and packed into a NumPy session x question matrix
+(NaN for unanswered questions) with a client index per row. Sorting the rows by client and timestamp lays out
+the client x session x question data as one contiguous run per client, so
+first and latest answers are picked with index arrays and every statistic
+comes from per-group sums (``np.add.at``) instead of Python loops over
+clients; the Firestore read dominates the run time.
+
+The batch job
+
+    python -m app.question_analytics [--status all|active|archived] [--threshold 1]
+
+stores the result in ``question_analytics/{status}``. ``GET /question-analytics``
+serves that document while it is younger than
+``QUESTION_ANALYTICS_MAX_AGE_SECONDS`` (default 86400) and was computed with
+the requested threshold. Otherwise it computes the result live. Both cover
+active and archived clients unless a status is given.
+
+NumPy is optional. Without it ``available()`` is false and the endpoint can
+only serve stored results; it answers 503 when there is none.
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .archive import data_collection_for, stream_users
+from .client_timeline import score_responses
+
+logger = logging.getLogger(__name__)
+
+QUESTION_ANALYTICS_COLLECTION = "question_analytics"
+DEFAULT_THRESHOLD = 1.0
+DEFAULT_MIN_SESSIONS = 2
+QUESTION_ANALYTICS_MAX_AGE_SECONDS = float(os.getenv("QUESTION_ANALYTICS_MAX_AGE_SECONDS", "86400"))
+
+
+def available():
+    return np is not None
+
+
+class ResponseMatrix:
+    """Scored sessions as rows of a (sessions x questions) array, sorted by client, then timestamp."""
+
+    __slots__ = ("question_ids", "client_ids", "clinician_ids", "values", "totals", "clients")
+
+    def __init__(self, question_ids, client_ids, clinician_ids, values, totals, clients):
+        self.question_ids = question_ids    # column -> question ID
+        self.client_ids = client_ids        # client number -> user ID
+        self.clinician_ids = clinician_ids  # client number -> assigned clinician ID (or None)
+        self.values = values                # answers, NaN where a question was not answered
+        self.totals = totals                # total score per session
+        self.clients = clients              # client number per session
+
+
+def _epoch(timestamp):
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def load_response_matrix(db, status="all"):
+    """Build the response matrix for clients with `status` ("active", "archived" or "all")."""
+    clients = {}  # user_id -> (collection holding their sessions, assigned clinician)
+    for client, _ in stream_users(db, status, [('role', '==', 'client')]):
+        clients[client.id] = (data_collection_for(client), client.to_dict().get('assigned_clinician_id'))
+
+    question_columns = {}
+    client_numbers = {}
+    rows, columns, answers = [], [], []
+    session_clients, session_times, session_totals = [], [], []
+    # Login sessions (users/{user_id}/sessions) have no timestamp, so ordering by it leaves
+    # them out of the query instead of reading and discarding them.
+    query = db.collection_group("sessions").order_by("timestamp").select(["timestamp", "summary_responses"])
+    for session in query.stream():
+        user_ref = session.reference.parent.parent
+        client = clients.get(user_ref.id)
+        # Skips clients out of scope and sessions left in a collection the client no longer reads from.
+        if client is None or user_ref.parent.id != client[0]:
+            continue
+        data = session.to_dict()
+        responses = data.get("summary_responses") or []
+        total = score_responses(responses)
+        timestamp = data.get("timestamp")
+        if total is None or timestamp is None:
+            continue
+        row = len(session_totals)
+        for response in responses:
+            question_id = response.get("question_id")
+            if question_id is None:
+                continue
+            rows.append(row)
+            columns.append(question_columns.setdefault(question_id, len(question_columns)))
+            answers.append(float(response.get("response_value", 0)))
+        session_clients.append(client_numbers.setdefault(user_ref.id, len(client_numbers)))
+        session_times.append(_epoch(timestamp))
+        session_totals.append(total)
+
+    values = np.full((len(session_totals), len(question_columns)), np.nan)
+    values[np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)] = answers
+    session_clients = np.asarray(session_clients, dtype=np.intp)
+    order = np.lexsort((np.asarray(session_times), session_clients))
+    client_ids = list(client_numbers)
+    return ResponseMatrix(
+        question_ids=list(question_columns),
+        client_ids=client_ids,
+        clinician_ids=[clients[user_id][1] for user_id in client_ids],
+        values=values[order],
+        totals=np.asarray(session_totals)[order],
+        clients=session_clients[order],
+    )
+
+
+def _group_stats(improvement, total_improvement, groups, group_count, threshold):
+    """Per group and question: (clients, mean change, responder rate, correlation with the total)."""
+    answered = ~np.isnan(improvement)
+    x = np.where(answered, improvement, 0.0)
+    y = np.where(answered, total_improvement[:, None], 0.0)
+
+    def sums(a):
+        out = np.zeros((group_count, a.shape[1]))
+        np.add.at(out, groups, a)
+        return out
+
+    n = sums(answered.astype(float))
+    sx, sy = sums(x), sums(y)
+    sxx, syy, sxy = sums(x * x), sums(y * y), sums(x * y)
+    responders = sums((answered & (x >= threshold)).astype(float))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_change = -sx / n
+        responder_rate = responders / n * 100
+        correlation = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+    return n, mean_change, responder_rate, correlation
+
+
+def _number(value):
+    """A float for JSON and Firestore, or None for NaN / infinity (no data, or no variance)."""
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def analyze(matrix, threshold=DEFAULT_THRESHOLD, min_sessions=DEFAULT_MIN_SESSIONS):
+    """Per-question statistics, overall and per clinician, for a `ResponseMatrix`."""
+    result = {"threshold": threshold, "min_sessions": min_sessions, "sessions": len(matrix.totals),
+              "clients": 0, "questions": [], "clinicians": []}
+    if not len(matrix.totals):
+        return result
+
+    # Each client's sessions are one run of rows: first and latest are the run's ends.
+    starts = np.flatnonzero(np.r_[True, matrix.clients[1:] != matrix.clients[:-1]])
+    ends = np.r_[starts[1:], len(matrix.clients)] - 1
+    evaluated = (ends - starts + 1) >= min_sessions
+    starts, ends = starts[evaluated], ends[evaluated]
+    improvement = matrix.values[starts] - matrix.values[ends]
+    total_improvement = matrix.totals[starts] - matrix.totals[ends]
+    client_numbers = matrix.clients[starts]
+    result["clients"] = len(starts)
+
+    def question_rows(n, mean_change, responder_rate, correlation):
+        return [{
+            "question_id": question_id,
+            "clients": int(n[column]),
+            "mean_change": _number(mean_change[column]),
+            "responder_rate": _number(responder_rate[column]),
+            "total_correlation": _number(correlation[column]),
+        } for column, question_id in enumerate(matrix.question_ids)]
+
+    overall = _group_stats(improvement, total_improvement, np.zeros(len(starts), dtype=np.intp), 1, threshold)
+    result["questions"] = question_rows(*(stat[0] for stat in overall))
+
+    clinician_numbers = {}
+    groups = np.asarray([
+        clinician_numbers.setdefault(matrix.clinician_ids[client], len(clinician_numbers))
+        for client in client_numbers
+    ], dtype=np.intp)
+    per_clinician = _group_stats(improvement, total_improvement, groups, len(clinician_numbers), threshold)
+    client_counts = np.bincount(groups, minlength=len(clinician_numbers))
+    for clinician_id, group in clinician_numbers.items():
+        result["clinicians"].append({
+            "clinician_id": clinician_id,
+            "clients": int(client_counts[group]),
+            "questions": question_rows(*(stat[group] for stat in per_clinician)),
+        })
+    return result
+
+
+def compute_question_analytics(db, status="all", threshold=DEFAULT_THRESHOLD, min_sessions=DEFAULT_MIN_SESSIONS):
+    """Load the response matrix and analyse it; the result records its status and computed_at."""
+    started = time.monotonic()
+    matrix = load_response_matrix(db, status)
+    loaded = time.monotonic()
+    result = analyze(matrix, threshold, min_sessions)
+    logger.info("Computed question analytics", extra={
+        "status": status, "sessions": result["sessions"],
+        "load_seconds": round(loaded - started, 3), "analyze_seconds": round(time.monotonic() - loaded, 3),
+    })
+    result["status"] = status
+    result["computed_at"] = datetime.now(timezone.utc).isoformat()
+    return result
+
+
+def stored_ref(db, status):
+    return db.collection(QUESTION_ANALYTICS_COLLECTION).document(status)
+
+
+def load_stored(db, status, threshold=DEFAULT_THRESHOLD, min_sessions=DEFAULT_MIN_SESSIONS):
+    """The batch job's result for these parameters, or None if it is missing or too old."""
+    snapshot = stored_ref(db, status).get()
+    result = snapshot.to_dict() if snapshot.exists else None
+    if not result or result.get("threshold") != threshold or result.get("min_sessions") != min_sessions:
+        return None
+    try:
+        computed_at = datetime.fromisoformat(result["computed_at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if (datetime.now(timezone.utc) - computed_at).total_seconds() > QUESTION_ANALYTICS_MAX_AGE_SECONDS:
+        return None
+    return result
+
+
+if __name__ == "__main__":
+    from app import db
+
+    parser = argparse.ArgumentParser(description="Compute per-question analytics and store them in Firestore.")
+    parser.add_argument("--status", choices=("all", "active", "archived"), default="all")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="points of improvement on a question that count as a response")
+    parser.add_argument("--min-sessions", type=int, default=DEFAULT_MIN_SESSIONS)
+    args = parser.parse_args()
+    if not available():
+        raise SystemExit("Per-question analytics need NumPy (pip install numpy).")
+
+    started = time.monotonic()
+    result = compute_question_analytics(db, args.status, args.threshold, args.min_sessions)
+    stored_ref(db, args.status).set(result)
+    print(f"Analysed {result['sessions']} sessions from {result['clients']} clients "
+          f"in {time.monotonic() - started:.1f}s; stored in {QUESTION_ANALYTICS_COLLECTION}/{args.status}")
@@ -0,0 +1,193 @@
+"""
+Server-side cache for the near-static reference lists (questions and
+questionnaires) with conditional-GET support.
+
+Each cached response body is stored with a strong ETag (a hash of its JSON),
+so ``reference_response`` answers ``If-None-Match`` with 304 and no Firestore
+read, and every response carries ``ETag`` and ``Cache-Control``
+(``REFERENCE_CACHE_CONTROL``, default ``no-cache``: browsers keep the body
+but revalidate, which costs a 304).
+
+Entries are invalidated per collection:
+
+* by the write paths that change a collection (``invalidate(collection)``),
+  which also bumps a generation file in ``REFERENCE_CACHE_DIR`` so the other
+  workers on the host drop their copies on their next lookup (only while
+  the directory is private to this user, see app/private_dir.py)
+* on Firestore, by a snapshot listener per collection started in each worker
+  (``REFERENCE_CACHE_LISTENERS``, default true), which catches writes made by
+  other hosts, scripts or the console
+* after ``REFERENCE_CACHE_TTL_SECONDS`` (default 300) as a safety net
+
+The clinician and admin lists come from the roster (app/roster.py) and use
+``conditional_response`` for the same ETag handling.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .datastore import db, is_memory_client
+from .metrics import record_cache
+from .private_dir import open_private, private_directory
+from .warmup import register_warmup
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_CACHE_TTL_SECONDS = float(os.getenv("REFERENCE_CACHE_TTL_SECONDS", "300"))
+REFERENCE_CACHE_CONTROL = os.getenv("REFERENCE_CACHE_CONTROL", "no-cache")
+REFERENCE_CACHE_DIR = os.getenv("REFERENCE_CACHE_DIR", "/tmp/headway-reference")
+REFERENCE_CACHE_LISTENERS = os.getenv("REFERENCE_CACHE_LISTENERS", "true").strip().lower() in ("1", "true", "yes")
+
+REFERENCE_COLLECTIONS = ("questions", "questionnaires")
+# Bounds the per-questionnaire entries a client can create with arbitrary questionnaire_id values.
+MAX_ENTRIES = 256
+
+
+def load_questions(questionnaire_id):
+    questions_ref = db.collection('questions').where('questionnaire_id', '==', questionnaire_id).stream()
+    return [{"id": q.id, "text": q.to_dict().get("text", "")} for q in questions_ref]
+
+
+def load_questionnaires():
+    questionnaires_ref = db.collection('questionnaires').stream()
+    return [{"id": q.id, "name": q.to_dict().get("name", "Unnamed Questionnaire")} for q in questionnaires_ref]
+
+
+class _Entry:
+    __slots__ = ("data", "etag", "loaded_at", "generation")
+
+    def __init__(self, data, etag, loaded_at, generation):
+        self.data = data
+        self.etag = etag
+        self.loaded_at = loaded_at
+        self.generation = generation
+
+
+_lock = threading.Lock()
+_entries = {}  # (collection, key) -> _Entry
+_local_generation = {name: 0 for name in REFERENCE_COLLECTIONS}
+_listeners = {}
+_listeners_pid = None
+
+
+def _generation_path(collection):
+    return os.path.join(REFERENCE_CACHE_DIR, f"{collection}.generation")
+
+
+def _generation(collection):
+    """Changes whenever `collection` is invalidated in this process or by another worker on the host."""
+    try:
+        shared = os.lstat(_generation_path(collection)).st_mtime_ns if private_directory(REFERENCE_CACHE_DIR) else 0
+    except OSError:
+        shared = 0
+    return (_local_generation[collection], shared)
+
+
+def invalidate(collection):
+    """Drop cached responses built from `collection` here and in the other workers on this host."""
+    with _lock:
+        _local_generation[collection] += 1
+        for cache_key in [k for k in _entries if k[0] == collection]:
+            del _entries[cache_key]
+    try:
+        if not private_directory(REFERENCE_CACHE_DIR):
+            logger.warning("Reference cache directory is not private; other workers keep their copies until the TTL",
+                           extra={"directory": REFERENCE_CACHE_DIR})
+            return
+        fd = open_private(_generation_path(collection), os.O_WRONLY | os.O_CREAT)
+        try:
+            os.utime(fd, ns=(time.time_ns(), time.time_ns()))
+        finally:
+            os.close(fd)
+    except OSError:
+        logger.exception("Could not publish reference cache invalidation", extra={"collection": collection})
+
+
+def etag_for(data):
+    body = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]
+
+
+def get(collection, key, loader):
+    """Return (data, etag) for `key` in `collection`, loading it with `loader()` on a miss."""
+    _ensure_listeners()
+    generation = _generation(collection)
+    entry = _entries.get((collection, key))
+    if (entry is not None and entry.generation == generation
+            and time.monotonic() - entry.loaded_at < REFERENCE_CACHE_TTL_SECONDS):
+        record_cache(f"reference:{collection}", True)
+        return entry.data, entry.etag
+
+    record_cache(f"reference:{collection}", False)
+    data = loader()
+    entry = _Entry(data, etag_for(data), time.monotonic(), generation)
+    with _lock:
+        # Skip storing if an invalidation raced with the load.
+        if _generation(collection) == generation and len(_entries) < MAX_ENTRIES:
+            _entries[(collection, key)] = entry
+    return entry.data, entry.etag
+
+
+def _on_snapshot(collection):
+    initial = [True]
+
+    def callback(docs, changes, read_time):
+        # The first snapshot is the current contents, not a change.
+        if initial[0]:
+            initial[0] = False
+            return
+        with _lock:
+            _local_generation[collection] += 1
+    return callback
+
+
+def _ensure_listeners():
+    """Start one snapshot listener per reference collection in this process (Firestore only)."""
+    global _listeners_pid
+    if _listeners_pid == os.getpid() or not REFERENCE_CACHE_LISTENERS:
+        return
+    with _lock:
+        if _listeners_pid == os.getpid():
+            return
+        _listeners_pid = os.getpid()
+        _listeners.clear()  # watches inherited across a fork are not running here
+        if is_memory_client(db):
+            return
+        for collection in REFERENCE_COLLECTIONS:
+            try:
+                _listeners[collection] = db.collection(collection).on_snapshot(_on_snapshot(collection))
+            except Exception:
+                logger.exception("Could not start reference cache listener", extra={"collection": collection})
+
+
+@register_warmup("reference_data")
+def _preload():
+    get("questionnaires", None, load_questionnaires)
+    get("questions", "default_questionnaire", lambda: load_questions("default_questionnaire"))
+
+
+def reference_response(collection, key, loader, make_response):
+    """Serve a cached reference list with `conditional_response`."""
+    data, etag = get(collection, key, loader)
+    return conditional_response(data, make_response, etag)
+
+
+def conditional_response(data, make_response, etag=None):
+    """
+    304 when the request's If-None-Match has `data`'s ETag, otherwise
+    `make_response(data, 200)`; both carry ETag and Cache-Control.
+    """
+    from flask import request
+
+    etag = etag or etag_for(data)
+    if request.if_none_match.contains(etag):
+        response = make_response(None, 304)
+        response.set_data(b"")
+    else:
+        response = make_response(data, 200)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = REFERENCE_CACHE_CONTROL
+    return response
@@ -0,0 +1,178 @@
+"""
+Per-clinician metric rollups.
+
+``clinician_rollups/{clinician_id}`` holds a ``clients`` map with one small
+state per active client, derived from the client's score timeline (see
+app/client_timeline.py):
+
+    {"sessions": 5, "initial": 21.0, "first_two_lowest": 19.0,
+     "latest": 12.0, "latest_at": <timestamp>}
+
+(only ``sessions`` for clients with fewer than 3 scored sessions). The state
+is written in the same commit as the change it follows: a check-in updates
+its client's entry, registering a client adds one, archiving or removing a
+client deletes it, and removing a clinician deletes their rollup. The
+clinician metrics (improved, clinically significant, not improving, and the
+6-month variants, which depend on the current date) are then counted from the
+map with ``summarize``, so one clinician costs one document read.
+
+A rollup that has never been built (``built_at`` unset) is built from the
+clinician's clients on first use. Rollups for existing data are rebuilt with
+
+    python -m app.rollups [clinician_id ...]
+"""
+import sys
+
+from .archive import stream_users
+from .client_timeline import read_timeline
+from .datastore import DELETE_FIELD, SERVER_TIMESTAMP
+from .windows import entries_in, recent_window
+
+ROLLUPS_COLLECTION = "clinician_rollups"
+CLIENTS_FIELD = "clients"
+# Set when a rollup is built from all of the clinician's clients; entries merged into a
+# rollup that was never built do not make it complete.
+BUILT_FIELD = "built_at"
+
+# A client needs this many scored sessions to count towards the improvement metrics.
+MIN_SESSIONS = 3
+
+# Metrics reported by `summarize`, as (count key, percentage key).
+METRICS = (
+    ("improved", "percent_improved"),
+    ("clinically_significant", "percent_clinically_significant"),
+    ("not_improving", "percent_not_improving"),
+    ("improved_last_6_months", "percent_improved_last_6_months"),
+    ("clinically_significant_last_6_months", "percent_clinically_significant_last_6_months"),
+    ("not_improving_last_6_months", "percent_not_improving_last_6_months"),
+)
+
+
+def rollup_ref(db, clinician_id):
+    return db.collection(ROLLUPS_COLLECTION).document(clinician_id)
+
+
+def client_state(timeline):
+    """The rollup state for a client with score timeline `timeline`."""
+    state = {"sessions": len(timeline)}
+    if len(timeline) >= MIN_SESSIONS:
+        state.update(
+            initial=timeline[0]["score"],
+            first_two_lowest=min(timeline[0]["score"], timeline[1]["score"]),
+            latest=timeline[-1]["score"],
+            latest_at=timeline[-1]["timestamp"],
+        )
+    return state
+
+
+def client_fields(user_id, state):
+    """Fields to merge into a rollup to set a client's state (None removes the client)."""
+    return {CLIENTS_FIELD: {user_id: DELETE_FIELD if state is None else state}}
+
+
+def queue_client_state(writer, db, clinician_id, user_id, state):
+    """Queue a client's rollup update on `writer` (a transaction or batch)."""
+    if clinician_id:
+        writer.set(rollup_ref(db, clinician_id), client_fields(user_id, state), merge=True)
+
+
+def build_rollup(db, clinician_id):
+    """Recompute a clinician's rollup from their active clients' timelines and store it. Returns the states."""
+    client_ids = [client.id for client, _ in stream_users(db, 'active', [('assigned_clinician_id', '==', clinician_id)])]
+    parents = [db.collection("user_data").document(user_id) for user_id in client_ids]
+    timelines = {snap.id: read_timeline(snap) for snap in db.get_all(parents)} if parents else {}
+    states = {user_id: client_state(timelines.get(user_id, [])) for user_id in client_ids}
+    rollup_ref(db, clinician_id).set({CLIENTS_FIELD: states, BUILT_FIELD: SERVER_TIMESTAMP})
+    return states
+
+
+def load_rollups(db, clinician_ids):
+    """{clinician_id: {user_id: state}} in one read per clinician; missing rollups are built."""
+    clinician_ids = list(clinician_ids)
+    if not clinician_ids:
+        return {}
+    stored = {}
+    for snap in db.get_all([rollup_ref(db, clinician_id) for clinician_id in clinician_ids]):
+        data = snap.to_dict() if snap.exists else None
+        if data and data.get(BUILT_FIELD):
+            stored[snap.id] = data.get(CLIENTS_FIELD, {})
+    return {
+        clinician_id: stored[clinician_id] if clinician_id in stored else build_rollup(db, clinician_id)
+        for clinician_id in clinician_ids
+    }
+
+
+def is_clinically_significant(initial, latest):
+    # Initial score above 18 and an improvement of at least 12.
+    return initial > 18 and (initial - latest) >= 12
+
+
+def outcomes(initial, first_two_lowest, latest):
+    """(metric, achieved) for a client's first and last scores."""
+    return (
+        ("improved", latest < initial),
+        ("clinically_significant", is_clinically_significant(initial, latest)),
+        ("not_improving", latest <= first_two_lowest),
+    )
+
+
+def summarize(states, recent=None):
+    """
+    Counts and percentages (of all active clients) for one clinician's client states.
+    `recent` is the window for the *_last_6_months metrics (default: the last 182 days).
+    """
+    recent = recent or recent_window()
+    counts = {count_key: 0 for count_key, _ in METRICS}
+    for state in states.values():
+        if state.get("sessions", 0) < MIN_SESSIONS:
+            continue
+        is_recent = recent.contains(state.get("latest_at"))
+        for count_key, hit in outcomes(state["initial"], state["first_two_lowest"], state["latest"]):
+            if hit:
+                counts[count_key] += 1
+                if is_recent:
+                    counts[f"{count_key}_last_6_months"] += 1
+
+    total_clients = len(states)
+    summary = {"total_clients": total_clients}
+    for count_key, percent_key in METRICS:
+        summary[percent_key] = (counts[count_key] / total_clients) * 100 if total_clients else 0
+    summary["counts"] = counts
+    return summary
+
+
+def window_summary(timelines, window, total_clients=None, min_sessions=MIN_SESSIONS):
+    """
+    Metrics within `window` for clients with `timelines` ({user_id: timeline}):
+    a client counts when they have at least `min_sessions` scored sessions in the
+    window, comparing the first and last of those. Percentages are of
+    `total_clients` (default: all of `timelines`).
+    """
+    counts = {"clients_in_window": 0, "improved": 0, "clinically_significant": 0, "not_improving": 0}
+    for timeline in timelines.values():
+        entries = entries_in(timeline, window)
+        if not entries:
+            continue
+        counts["clients_in_window"] += 1
+        if len(entries) < max(min_sessions, 2):
+            continue
+        first_two_lowest = min(entries[0]["score"], entries[1]["score"])
+        for count_key, hit in outcomes(entries[0]["score"], first_two_lowest, entries[-1]["score"]):
+            counts[count_key] += hit
+
+    total_clients = len(timelines) if total_clients is None else total_clients
+    summary = window.to_dict()
+    summary["total_clients"] = total_clients
+    for count_key in ("improved", "clinically_significant", "not_improving"):
+        summary[f"percent_{count_key}"] = (counts[count_key] / total_clients) * 100 if total_clients else 0
+    summary["counts"] = counts
+    return summary
+
+
+if __name__ == "__main__":
+    from app import db
+
+    clinician_ids = sys.argv[1:] or [ref.id for ref in db.collection("clinicians").list_documents()]
+    for clinician_id in clinician_ids:
+        states = build_rollup(db, clinician_id)
+        print(f"Rebuilt rollup for {clinician_id}: {len(states)} active clients")
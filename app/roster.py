@@ -0,0 +1,272 @@
+"""
+In-memory clinician roster shared by the roster endpoints.
+
+One snapshot per worker holds every clinician and admin as
+``{"id", "name", "is_admin", "client_count"}`` (``client_count`` counts
+active clients). It is loaded once - the ``clinicians`` and ``admins``
+collections plus one projected query over the clients - and then kept up to
+date incrementally:
+
+* write paths publish changes (``clinician_saved``, ``clinician_removed``,
+  ``clients_moved``) to a change log in ``ROSTER_DIR`` (default
+  /tmp/headway-roster); every worker on the host applies new entries before
+  it next reads the roster, its own included. The log is only written and
+  read while the directory is private to this user (app/private_dir.py);
+  otherwise each worker relies on the listeners and refreshes below
+* on Firestore, ``on_snapshot`` listeners on ``clinicians`` and ``admins``
+  apply name and role changes made elsewhere (``ROSTER_LISTENERS``)
+* a full reload every ``ROSTER_REFRESH_SECONDS`` (default 3600) corrects any
+  drift, e.g. client counts changed by another host
+
+``/get-clinicians``, ``/get-only-clinicians`` and ``/get-admins`` are served
+from it, and admin search results take clinician names from it.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from .archive import ARCHIVED_FIELD, is_archived
+from .datastore import db, is_memory_client
+from .private_dir import open_private, private_directory
+from .warmup import register_warmup
+
+logger = logging.getLogger(__name__)
+
+ROSTER_DIR = os.getenv("ROSTER_DIR", "/tmp/headway-roster")
+ROSTER_REFRESH_SECONDS = float(os.getenv("ROSTER_REFRESH_SECONDS", "3600"))
+ROSTER_LISTENERS = os.getenv("ROSTER_LISTENERS", "true").strip().lower() in ("1", "true", "yes")
+# The change log is started afresh past this size; workers notice and reload.
+ROSTER_LOG_MAX_BYTES = 1024 * 1024
+
+CHANGE_LOG = os.path.join(ROSTER_DIR, "changes.jsonl")
+
+
+class _Member:
+    __slots__ = ("id", "name", "is_admin", "is_clinician", "client_count")
+
+    def __init__(self, member_id, name=""):
+        self.id = member_id
+        self.name = name
+        self.is_admin = False
+        self.is_clinician = False  # listed in `clinicians` (admins only in `admins` are not)
+        self.client_count = 0
+
+    def to_dict(self):
+        return {"id": self.id, "name": self.name, "is_admin": self.is_admin, "client_count": self.client_count}
+
+
+class Roster:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._members = {}  # id -> _Member
+        self._loaded_at = None
+        self._pid = None
+        self._log_inode = None
+        self._log_offset = 0
+        self._listeners = []
+
+    # --- Loading ---
+
+    def _load(self):
+        """Rebuild the snapshot from Firestore. Called with the lock held."""
+        inode, offset = self._log_position()
+        members = {}
+        for doc in db.collection('clinicians').stream():
+            data = doc.to_dict()
+            member = members[doc.id] = _Member(doc.id, data.get("name", ""))
+            member.is_clinician = True
+            member.is_admin = bool(data.get("is_admin", False))
+        for doc in db.collection('admins').stream():
+            member = members.get(doc.id) or members.setdefault(doc.id, _Member(doc.id, doc.to_dict().get("name", "")))
+            member.is_admin = True
+        clients = db.collection('users').where('role', '==', 'client').select(['assigned_clinician_id', ARCHIVED_FIELD])
+        for doc in clients.stream():
+            data = doc.to_dict()
+            member = members.get(data.get('assigned_clinician_id'))
+            if member is not None and not is_archived(data):
+                member.client_count += 1
+
+        self._members = members
+        self._loaded_at = time.monotonic()
+        # Changes logged while loading may already be in the snapshot; the next refresh evens that out.
+        self._log_inode, self._log_offset = inode, offset
+        logger.info("Loaded clinician roster", extra={"members": len(members)})
+
+    def _current(self):
+        """Load, reload or catch up with the change log as needed. Called with the lock held."""
+        if self._pid != os.getpid():
+            # A forked worker keeps the parent's snapshot but needs its own listeners.
+            self._pid = os.getpid()
+            self._listeners = []
+            self._start_listeners()
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= ROSTER_REFRESH_SECONDS:
+            self._load()
+            return
+        inode, size = self._log_position()
+        if self._log_inode is None and inode is not None:
+            # First log since the snapshot was loaded: everything in it is new.
+            self._log_inode, self._log_offset = inode, 0
+        if inode != self._log_inode or size < self._log_offset:
+            # The log was started afresh, so changes may have been dropped.
+            self._load()
+        elif size > self._log_offset:
+            self._apply_log()
+            if self._loaded_at is None:  # a "reload" change
+                self._load()
+
+    # --- Change log ---
+
+    def _log_position(self):
+        """(inode, size) of the change log; (None, 0) if there is none or it cannot be trusted."""
+        try:
+            if not private_directory(ROSTER_DIR):
+                logger.warning("Roster directory is not private; ignoring the change log",
+                               extra={"directory": ROSTER_DIR})
+                return None, 0
+            stat = os.lstat(CHANGE_LOG)
+        except OSError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def _apply_log(self):
+        try:
+            with open(open_private(CHANGE_LOG, os.O_RDONLY), "rb") as f:
+                f.seek(self._log_offset)
+                chunk = f.read()
+        except OSError:
+            logger.exception("Could not read the roster change log; reloading")
+            self._loaded_at = None
+            return
+        # Only complete lines; a writer may be halfway through one.
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            try:
+                self._apply(json.loads(line))
+            except ValueError:
+                logger.warning("Skipping malformed roster change", extra={"line": line[:200]})
+        self._log_offset += end
+
+    def _apply(self, change):
+        kind = change.get("kind")
+        if kind == "reload":
+            self._loaded_at = None
+            return
+        member_id = change.get("id")
+        if kind == "saved":
+            member = self._members.setdefault(member_id, _Member(member_id))
+            member.name = change.get("name", member.name)
+            member.is_admin = bool(change.get("is_admin", member.is_admin))
+            member.is_clinician = True
+        elif kind == "removed":
+            self._members.pop(member_id, None)
+        elif kind == "clients":
+            member = self._members.get(member_id)
+            if member is not None:
+                member.client_count = max(0, member.client_count + change.get("delta", 0))
+
+    def publish(self, change):
+        """Append `change` to the host's change log; every worker (this one included) applies it on its next read."""
+        try:
+            if not private_directory(ROSTER_DIR):
+                raise PermissionError(f"{ROSTER_DIR} is not private to this user")
+            line = (json.dumps(change, separators=(",", ":")) + "\n").encode("utf-8")
+            fd = open_private(CHANGE_LOG, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_size > ROSTER_LOG_MAX_BYTES:
+                    # Start a new log; readers see the new inode and reload.
+                    os.unlink(CHANGE_LOG)
+                else:
+                    os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError:
+            logger.exception("Could not publish roster change", extra={"change": change})
+            with self._lock:
+                self._loaded_at = None
+
+    # --- Firestore listeners ---
+
+    def _start_listeners(self):
+        if not ROSTER_LISTENERS or is_memory_client(db):
+            return
+        for collection in ('clinicians', 'admins'):
+            try:
+                self._listeners.append(db.collection(collection).on_snapshot(self._on_snapshot(collection)))
+            except Exception:
+                logger.exception("Could not start roster listener", extra={"collection": collection})
+
+    def _on_snapshot(self, collection):
+        def callback(docs, changes, read_time):
+            with self._lock:
+                if self._loaded_at is None:
+                    return
+                for change in changes:
+                    doc = change.document
+                    removed = change.type.name == "REMOVED"
+                    if collection == 'clinicians':
+                        if removed:
+                            self._members.pop(doc.id, None)
+                        else:
+                            data = doc.to_dict()
+                            self._apply({"kind": "saved", "id": doc.id, "name": data.get("name", ""),
+                                         "is_admin": data.get("is_admin", False)})
+                    elif doc.id in self._members:
+                        self._members[doc.id].is_admin = not removed
+        return callback
+
+    # --- Reads ---
+
+    def members(self):
+        """Every member in document ID order, the order the collections stream in."""
+        with self._lock:
+            self._current()
+            return sorted(self._members.values(), key=lambda m: m.id)
+
+    def clinicians(self, query=None, is_admin=None):
+        """Clinicians (admins included unless is_admin=False) as dicts, optionally filtered by name."""
+        query = (query or "").strip().lower()
+        return [
+            m.to_dict() for m in self.members()
+            if m.is_clinician
+            and (is_admin is None or m.is_admin == is_admin)
+            and (not query or query in m.name.lower())
+        ]
+
+    def admins(self, query=None):
+        query = (query or "").strip().lower()
+        return [m.to_dict() for m in self.members() if m.is_admin and (not query or query in m.name.lower())]
+
+    def names(self):
+        """id -> name for every member."""
+        return {m.id: m.name for m in self.members()}
+
+
+roster = Roster()
+
+
+def clinician_saved(clinician_id, name, is_admin=False):
+    roster.publish({"kind": "saved", "id": clinician_id, "name": name, "is_admin": is_admin})
+
+
+def clinician_removed(clinician_id):
+    roster.publish({"kind": "removed", "id": clinician_id})
+
+
+def clients_moved(clinician_id, delta):
+    """Adjust `clinician_id`'s active client count by `delta`."""
+    if clinician_id:
+        roster.publish({"kind": "clients", "id": clinician_id, "delta": delta})
+
+
+def reload_roster():
+    """Make every worker on the host reload the roster, e.g. after a bulk import."""
+    roster.publish({"kind": "reload"})
+
+
+@register_warmup("clinician_roster")
+def _preload():
+    roster.members()
@@ -1,15 +1,46 @@
 import os
 import jwt
+import logging
+import math
 import uuid
 from flask import Blueprint, request, jsonify, make_response, redirect
-from google.cloud import firestore
 from datetime import datetime, timedelta, timezone
-from firebase_admin import firestore
-from google.cloud.firestore import SERVER_TIMESTAMP
 from werkzeug.security import generate_password_hash, check_password_hash
+from .archive import (
+    VALID_SOURCES, ARCHIVED_FIELD, LEGACY_ARCHIVE_READS, LEGACY_USERS_COLLECTION,
+    normalize_source, is_archived, get_user, stream_users, session_collections,
+    data_collection_for, archive_user, unarchive_user,
+)
+from .bulk_writes import bulk_mutate, bulk_mutate_groups, delete_collection_ops, delete_op, set_op, update_op
+from .datastore import ASCENDING, SERVER_TIMESTAMP, db
+from .client_timeline import timeline_entry, read_timeline, merge_entries, timeline_fields, update_client_timeline, load_timelines
+from .email_keys import EMAIL_KEYS_BACKFILLED, email_key_ref, email_key_data, lookup_email
+from .idempotency import IDEMPOTENCY_HEADER, fingerprint_request, run_idempotent
+from . import reference_cache
+from .roster import roster, clinician_saved, clinician_removed, clients_moved
+from .rollups import (
+    METRICS, client_state, is_clinically_significant, load_rollups, queue_client_state, rollup_ref,
+    summarize, window_summary,
+)
+from . import question_analytics
+from .trends import (
+    cohort_series, load_trends, month_key, month_range, monthly_series, queue_trend_delta,
+)
+from .windows import entries_in, parse_window, preset_window, recent_window
+from .profiling import list_profiles, load_profile, profiling_enabled
+from .tracing import span, traced
+from .singleflight import SingleFlight
+from .transactions import run_transaction
 
 main_bp = Blueprint('main', __name__)
-db = firestore.Client()
+logger = logging.getLogger(__name__)
+
+# Admin analytics are recomputed from every client's sessions; identical concurrent or
+# recent requests share one computation (see app/singleflight.py).
+overall_data_flight = SingleFlight("overall-data")
+clinician_data_flight = SingleFlight("clinician-data")
+admin_search_clients_flight = SingleFlight("admin-search-clients")
+question_analytics_flight = SingleFlight("question-analytics")
 
 # Dynamically set the frontend URL based on the environment
 ENVIRONMENT = os.getenv("ENVIRONMENT", "production")
@@ -26,42 +57,57 @@ API_PREFIXES = ("/api/", "/register", "/login", "/questions", "/past-responses")
 
 SECRET_KEY = "Headway50!"  # Replace with a strong, unique key
 
+CORS_RESPONSE_HEADERS = {
+    "Access-Control-Allow-Origin": FRONTEND_URL,
+    "Access-Control-Allow-Headers": "Content-Type, Authorization, device-token, Idempotency-Key",
+    "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
+}
+
 def cors_enabled_response(data, status=200):
     """Wraps responses with proper CORS headers"""
-    response = make_response(jsonify(data), status)
-    response.headers["Access-Control-Allow-Origin"] = FRONTEND_URL
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, device-token"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+    with span("serialize"):
+        response = make_response(jsonify(data), status)
+    for header, value in CORS_RESPONSE_HEADERS.items():
+        response.headers[header] = value
     return response
 
-def validate_token():
-    """Validate JWT token and ensure session exists in Firestore."""
-    auth_header = request.headers.get('Authorization')
+def decode_token(auth_header):
+    """
+    Decode a `Bearer` Authorization header without touching Firestore.
+    Returns (decoded_token, None), or (None, error message) if it is unusable.
+    """
     if not auth_header or not auth_header.startswith('Bearer '):
-        return None, cors_enabled_response({'message': 'Missing or invalid token'}, 401), 401
+        return None, 'Missing or invalid token'
 
     token = auth_header.split(' ')[1]
-    
+
     try:
         decoded_token = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        user_id = decoded_token.get('id')
-        device_token = decoded_token.get('device_token')  # 🔥 Extract device token
+    except jwt.ExpiredSignatureError:
+        return None, 'Token expired'
+    except jwt.InvalidTokenError:
+        return None, 'Invalid token'
 
-        if not user_id or not device_token:
-            return None, cors_enabled_response({'message': 'Invalid token payload'}, 401), 401
+    # 🔥 Both the user and the device token are needed to find the login session
+    if not decoded_token.get('id') or not decoded_token.get('device_token'):
+        return None, 'Invalid token payload'
+    return decoded_token, None
 
-        # 🔥 Check if this device_token exists in Firestore under user's sessions
-        session_ref = db.collection('users').document(user_id).collection('sessions').document(device_token).get()
 
-        if not session_ref.exists:
-            return None, cors_enabled_response({'message': 'Session expired or revoked'}, 401), 401
+@traced("validate_token")
+def validate_token():
+    """Validate JWT token and ensure session exists in Firestore."""
+    decoded_token, error = decode_token(request.headers.get('Authorization'))
+    if error:
+        return None, cors_enabled_response({'message': error}, 401), 401
 
-        return decoded_token, None, None
+    # 🔥 Check if this device_token exists in Firestore under user's sessions
+    session_ref = db.collection('users').document(decoded_token['id']).collection('sessions').document(decoded_token['device_token']).get()
 
-    except jwt.ExpiredSignatureError:
-        return None, cors_enabled_response({'message': 'Token expired'}, 401), 401
-    except jwt.InvalidTokenError:
-        return None, cors_enabled_response({'message': 'Invalid token'}, 401), 401
+    if not session_ref.exists:
+        return None, cors_enabled_response({'message': 'Session expired or revoked'}, 401), 401
+
+    return decoded_token, None, None
 
 
 @main_bp.route("/", defaults={"path": ""})
@@ -74,6 +120,12 @@ def catch_all(path):
     # Redirect all other routes to React
     return redirect(FRONTEND_URL)
 
+
+def is_document_id(value):
+    """Whether `value` can be used as a Firestore document ID as-is (the SDK raises on reserved IDs)."""
+    return (0 < len(value.encode('utf-8')) <= 1500 and '/' not in value and value not in ('.', '..')
+            and not (value.startswith('__') and value.endswith('__')))
+
 @main_bp.route('/register', methods=['POST'])
 def register():
     """Register a new user."""
@@ -103,55 +155,88 @@ def register():
     if errors:
         return cors_enabled_response({'message': " ".join(errors)}, 400)
 
-    users_ref = db.collection('users')
-    if users_ref.where('email', '==', email).get():
-        return cors_enabled_response({'message': 'Email already registered'}, 400)
-
-    if role in ['clinician', 'admin']:
-        if not invite_code:
-            return cors_enabled_response({'message': 'Invite code is required for this role.'}, 400)
-        try:
-            invites_ref = db.collection('invites').where('invite_code', '==', invite_code).where('role', '==', role).stream()
-            invite = next(invites_ref)
-            invite_data = invite.to_dict()
-            if invite_data.get('used', False):
-                return cors_enabled_response({'message': 'This invite code has already been used.'}, 400)
-            db.collection('invites').document(invite.id).update({'used': True})
-        except StopIteration:
-            return cors_enabled_response({'message': 'Invalid or expired invite code.'}, 400)
+    if role in ['clinician', 'admin'] and not invite_code:
+        return cors_enabled_response({'message': 'Invite code is required for this role.'}, 400)
 
     if role == 'client' and not assigned_clinician_id:
         return cors_enabled_response({'message': 'Assigned clinician ID is required for clients.'}, 400)
 
-    # Use Werkzeug’s generate_password_hash with method='scrypt'
+    # Use Werkzeug’s generate_password_hash with method='scrypt'.
+    # Hash outside the transaction so a contention retry does not pay for it twice.
     hashed_password = generate_password_hash(password, method='scrypt')
-    user_ref = users_ref.add({
-        'first_name': first_name,
-        'last_name': last_name,
-        'email': email,
-        'password': hashed_password,
-        'role': role,
-        'assigned_clinician_id': assigned_clinician_id if role == 'client' else None,
-        'created_at': datetime.utcnow()
-    })
 
-    user_id = user_ref[1].id
-
-    # For both clinicians and admins, add them to the clinicians collection.
-    if role in ['clinician', 'admin']:
-        db.collection('clinicians').document(user_id).set({
-            'id': user_id,
-            'name': f"{first_name} {last_name}",
-            'is_admin': True if role == 'admin' else False,
-            'assigned_clinician_id': assigned_clinician_id if role == 'admin' else None,
+    users_ref = db.collection('users')
+    user_ref = users_ref.document()
+    key_ref = email_key_ref(db, email)
+
+    def create_user(transaction):
+        """
+        Reserve the email, consume the invite and create the user in one commit.
+        Returns an error message, or None on success.
+        """
+        # --- Reads ---
+        if key_ref.get(transaction=transaction).exists:
+            return 'Email already registered'
+        # Until the index is backfilled, older users are only found by querying.
+        if not EMAIL_KEYS_BACKFILLED and list(users_ref.where('email', '==', email).limit(1).stream(transaction=transaction)):
+            return 'Email already registered'
+
+        invite = None
+        if role in ['clinician', 'admin']:
+            # Invites are keyed by their code; older ones are only found by querying.
+            if is_document_id(invite_code):
+                invite = db.collection('invites').document(invite_code).get(transaction=transaction)
+            if not invite or not invite.exists or invite.to_dict().get('role') != role:
+                invites_query = db.collection('invites').where('invite_code', '==', invite_code).where('role', '==', role).limit(1)
+                invite = next(iter(invites_query.stream(transaction=transaction)), None)
+            if not invite:
+                return 'Invalid or expired invite code.'
+            if invite.to_dict().get('used', False):
+                return 'This invite code has already been used.'
+
+        # --- Writes ---
+        if invite:
+            transaction.update(invite.reference, {'used': True})
+        transaction.create(key_ref, email_key_data(email, user_ref.id))
+        transaction.set(user_ref, {
+            'first_name': first_name,
+            'last_name': last_name,
+            'email': email,
+            'password': hashed_password,
+            'role': role,
+            'assigned_clinician_id': assigned_clinician_id if role == 'client' else None,
+            ARCHIVED_FIELD: False,
+            'created_at': datetime.utcnow()
         })
 
-    # Ensure admins are also added to the admins collection.
-    if role == 'admin':
-        db.collection('admins').document(user_id).set({
-            'id': user_id,
-            'name': f"{first_name} {last_name}"
-        })
+        # For both clinicians and admins, add them to the clinicians collection.
+        if role in ['clinician', 'admin']:
+            transaction.set(db.collection('clinicians').document(user_ref.id), {
+                'id': user_ref.id,
+                'name': f"{first_name} {last_name}",
+                'is_admin': True if role == 'admin' else False,
+                'assigned_clinician_id': assigned_clinician_id if role == 'admin' else None,
+            })
+
+        # Ensure admins are also added to the admins collection.
+        if role == 'admin':
+            transaction.set(db.collection('admins').document(user_ref.id), {
+                'id': user_ref.id,
+                'name': f"{first_name} {last_name}"
+            })
+
+        # New clients start out in their clinician's metric rollup.
+        if role == 'client':
+            queue_client_state(transaction, db, assigned_clinician_id, user_ref.id, client_state([]))
+        return None
+
+    error_message = run_transaction(db, create_user)
+    if error_message:
+        return cors_enabled_response({'message': error_message}, 400)
+    if role in ['clinician', 'admin']:
+        clinician_saved(user_ref.id, f"{first_name} {last_name}", is_admin=role == 'admin')
+    else:
+        clients_moved(assigned_clinician_id, 1)
 
     auth_header = request.headers.get('Authorization')
     extra_data = {}
@@ -179,22 +264,31 @@ def login():
         if not email or not password:
             return cors_enabled_response({'message': 'Email and password are required.'}, 400)
 
-        # Search for the user in the active users collection.
-        users_ref = db.collection('users')
-        user_docs = list(users_ref.where('email', '==', email).stream())
-        
-        if not user_docs:
-            # If no active user is found, check in the archived users collection.
-            archived_ref = db.collection('archived_users')
-            archived_docs = list(archived_ref.where('email', '==', email).stream())
-            if archived_docs:
+        # Resolve the email through the email_keys index.
+        email_entry = lookup_email(db, email)
+        if email_entry:
+            if email_entry.get('is_archived') or email_entry.get('collection') == LEGACY_USERS_COLLECTION:
                 return cors_enabled_response({'message': 'Unable to login due to not being an active client.'}, 401)
-            else:
-                return cors_enabled_response({'message': 'Invalid credentials'}, 401)
+            user_doc = db.collection(email_entry.get('collection', 'users')).document(email_entry['user_id']).get()
+            user_docs = [user_doc] if user_doc.exists else []
+        elif not EMAIL_KEYS_BACKFILLED:
+            # Users that predate the index are only found by querying.
+            user_docs = list(db.collection('users').where('email', '==', email).stream())
+            if not user_docs and LEGACY_ARCHIVE_READS:
+                # Clients archived before the flag migration still live in the legacy collection.
+                archived_ref = db.collection(LEGACY_USERS_COLLECTION)
+                if list(archived_ref.where('email', '==', email).stream()):
+                    return cors_enabled_response({'message': 'Unable to login due to not being an active client.'}, 401)
+        else:
+            user_docs = []
+
+        if not user_docs:
+            return cors_enabled_response({'message': 'Invalid credentials'}, 401)
         
         user_doc = user_docs[0]
         user_data = user_doc.to_dict()
-        print("User data found for login:", user_data)
+        if is_archived(user_data):
+            return cors_enabled_response({'message': 'Unable to login due to not being an active client.'}, 401)
 
         if 'password' not in user_data:
             raise Exception("User document is missing the 'password' field.")
@@ -226,7 +320,7 @@ def login():
             return cors_enabled_response({'message': 'Invalid credentials'}, 401)
 
     except Exception as e:
-        print("Exception in /login:", e)
+        logger.exception("Exception in /login")
         return cors_enabled_response({'message': 'Internal server error', 'error': str(e)}, 500)
 
 
@@ -236,13 +330,11 @@ def get_questions():
     questionnaire_id = request.args.get('questionnaire_id', 'default_questionnaire') # Hard coded fixed ID for the primary questionnaire, update if going to multiple questionnaires.
 
     try:
-        # ✅ Fetch questions linked to this questionnaire
-        questions_ref = db.collection('questions').where('questionnaire_id', '==', questionnaire_id).stream()
-        questions = [{"id": q.id, "text": q.to_dict().get("text", "")} for q in questions_ref]
-
-        return cors_enabled_response(questions, 200)
+        # ✅ Served from the reference cache; 304 when the client's copy is current
+        return reference_cache.reference_response(
+            'questions', questionnaire_id, lambda: reference_cache.load_questions(questionnaire_id), cors_enabled_response)
     except Exception as e:
-        print(f"Error fetching questions: {e}")
+        logger.exception("Error fetching questions")
         return cors_enabled_response({'message': 'Failed to fetch questions', 'error': str(e)}, 500)
 
   
@@ -250,12 +342,10 @@ def get_questions():
 def get_questionnaires():
     """Fetch all available questionnaires."""
     try:
-        questionnaires_ref = db.collection('questionnaires').stream()
-        questionnaires = [{"id": q.id, "name": q.to_dict().get("name", "Unnamed Questionnaire")} for q in questionnaires_ref]
-
-        return cors_enabled_response(questionnaires, 200)
+        return reference_cache.reference_response(
+            'questionnaires', None, reference_cache.load_questionnaires, cors_enabled_response)
     except Exception as e:
-        print(f"Error fetching questionnaires: {e}")
+        logger.exception("Error fetching questionnaires")
         return cors_enabled_response({'message': 'Failed to fetch questionnaires', 'error': str(e)}, 500)
 
 @main_bp.route('/user-data/<user_id>/sessions/<session_id>/responses', methods=['POST'])
@@ -272,9 +362,10 @@ def store_user_responses(user_id, session_id):
             return cors_enabled_response({'message': 'Unauthorized access'}, 403)
 
         # 🚫 Prevent archived clients from submitting responses.
-        archived_client = db.collection("archived_users").document(user_id).get()
-        if archived_client.exists:
+        client_doc, client_archived = get_user(db, user_id)
+        if client_archived:
             return cors_enabled_response({'message': 'Archived clients cannot submit responses'}, 403)
+        clinician_id = client_doc.to_dict().get('assigned_clinician_id') if client_doc else None
 
         # 📥 Get request data
         data = request.get_json()
@@ -294,37 +385,195 @@ def store_user_responses(user_id, session_id):
                 "response_value": response["response_value"],
             })
 
-        # 🔹 Reference session document
-        session_ref = db.collection("user_data").document(user_id).collection("sessions").document(session_id)
+        # 🔹 Reference session document and the client's user_data document (score timeline)
+        parent_ref = db.collection("user_data").document(user_id)
+        session_ref = parent_ref.collection("sessions").document(session_id)
+
+        def write_session(transaction):
+            """Queue the session summary, per-answer and timeline writes on `transaction`."""
+            snapshots = {snap.reference.path: snap for snap in db.get_all([session_ref, parent_ref], transaction=transaction)}
+            session_snapshot = snapshots.get(session_ref.path)
+            parent_snapshot = snapshots.get(parent_ref.path)
+
+            # ✅ Ensure session document exists and update it with summary responses
+            if not session_snapshot or not session_snapshot.exists:
+                transaction.set(session_ref, {
+                    "questionnaire_id": questionnaire_id,
+                    "timestamp": timestamp,
+                    "summary_responses": summary_responses
+                })
+                session_timestamp = datetime.now(timezone.utc)
+            else:
+                # If the session already exists, update the summary responses field
+                transaction.update(session_ref, {
+                    "summary_responses": summary_responses
+                })
+                session_timestamp = session_snapshot.to_dict().get("timestamp")
+
+            # 🔹 Store each individual response in the responses subcollection
+            responses_ref = session_ref.collection("responses")
+            for response in summary_responses:
+                response_doc_id = f"response_{response['question_id']}"
+                transaction.set(responses_ref.document(response_doc_id), response)
+
+            # 📈 Keep the client's score timeline in step with their sessions
+            previous = read_timeline(parent_snapshot)
+            timeline = merge_entries(previous, [timeline_entry(session_id, session_timestamp, summary_responses)])
+            transaction.set(parent_ref, timeline_fields(timeline), merge=True)
+            queue_client_state(transaction, db, clinician_id, user_id, client_state(timeline))
+            queue_trend_delta(transaction, db, user_id, previous, timeline)
+
+            return {'message': 'Responses stored successfully'}, 201
+
+        # 🔁 Retried submissions with the same Idempotency-Key replay the first result without writing.
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+        if idempotency_key:
+            fingerprint = fingerprint_request(session_id, questionnaire_id, summary_responses)
+            body, status, replayed = run_idempotent(db, f"responses:{user_id}", idempotency_key, fingerprint, write_session)
+            response = cors_enabled_response(body, status)
+            if replayed:
+                response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        body, status = run_transaction(db, write_session)
+        return cors_enabled_response(body, status)
 
-        # ✅ Ensure session document exists and update it with summary responses
-        if not session_ref.get().exists:
-            session_ref.set({
-                "questionnaire_id": questionnaire_id,
-                "timestamp": timestamp,
-                "summary_responses": summary_responses
-            })
-        else:
-            # If the session already exists, update the summary responses field
-            session_ref.update({
-                "summary_responses": summary_responses
-            })
+    except Exception as e:
+        logger.exception("Exception storing responses", extra={"user_id": user_id, "session_id": session_id})
+        return cors_enabled_response({'message': 'Internal server error', 'error': str(e)}, 500)
 
-        # 🔹 Reference responses subcollection
-        responses_ref = session_ref.collection("responses")
 
-        # 🔹 Store each individual response
-        for response in data['responses']:
-            response_doc_id = f"response_{response['question_id']}"
-            responses_ref.document(response_doc_id).set({
-                "question_id": response["question_id"],
-                "response_value": response["response_value"],
-            })
+MAX_BATCH_SESSIONS = 200
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
 
-        return cors_enabled_response({'message': 'Responses stored successfully'}, 201)
+def parse_client_timestamp(value):
+    """Parse an ISO 8601 timestamp supplied by the client; naive values are taken as UTC."""
+    parsed = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+@main_bp.route('/user-data/<user_id>/sessions/batch', methods=['POST'])
+def store_user_sessions_batch(user_id):
+    """
+    Store many check-ins collected offline in one request.
+
+    Body: {"sessions": [{"session_id", "timestamp" (ISO 8601), "questionnaire_id", "responses": [...]}, ...]}
+    Sessions that already exist are reported as duplicates and left untouched, so a replayed
+    batch is safe. Each session is written atomically with its responses; sessions are packed
+    into as few batch commits as possible. The client's score timeline is updated once per batch,
+    after the sessions are committed; it also takes in the stored duplicates, so retrying a batch
+    whose timeline update failed repairs the timeline.
+    Returns a per-session status list in request order.
+    """
+    try:
+        # 🔐 Validate token once for the whole batch
+        decoded_token, error_response, status_code = validate_token()
+        if error_response:
+            return cors_enabled_response(error_response, status_code)
+
+        if decoded_token['id'] != user_id:
+            return cors_enabled_response({'message': 'Unauthorized access'}, 403)
+
+        client_doc, client_archived = get_user(db, user_id)
+        if client_archived:
+            return cors_enabled_response({'message': 'Archived clients cannot submit responses'}, 403)
+        clinician_id = client_doc.to_dict().get('assigned_clinician_id') if client_doc else None
+
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('sessions'), list):
+            return cors_enabled_response({'message': '"sessions" must be a list.'}, 400)
+        if len(data['sessions']) > MAX_BATCH_SESSIONS:
+            return cors_enabled_response({'message': f'At most {MAX_BATCH_SESSIONS} sessions can be submitted at once.'}, 400)
+
+        parent_ref = db.collection("user_data").document(user_id)
+        now = datetime.now(timezone.utc)
+
+        # 🔹 Validate every session before touching Firestore
+        results = []
+        pending = []  # (result index, session_id, session document, summary responses)
+        seen_ids = set()
+        for item in data['sessions']:
+            item = item if isinstance(item, dict) else {}
+            session_id = str(item.get('session_id', '')).strip()
+            result = {'session_id': session_id}
+            results.append(result)
+
+            if not session_id or '/' in session_id or len(session_id) > 200:
+                result.update(status='invalid', message='"session_id" is required and must not contain "/".')
+                continue
+            if session_id in seen_ids:
+                result.update(status='duplicate', message='Session appears more than once in this batch.')
+                continue
+            seen_ids.add(session_id)
+
+            responses = item.get('responses')
+            if not isinstance(responses, list) or not responses or any(
+                not isinstance(r, dict) or 'question_id' not in r or 'response_value' not in r for r in responses
+            ):
+                result.update(status='invalid', message='Each response must have "question_id" and "response_value".')
+                continue
+
+            try:
+                session_timestamp = parse_client_timestamp(item['timestamp']) if item.get('timestamp') else now
+            except ValueError:
+                result.update(status='invalid', message='"timestamp" must be an ISO 8601 date-time.')
+                continue
+            if session_timestamp > now + MAX_CLOCK_SKEW:
+                result.update(status='invalid', message='"timestamp" is in the future.')
+                continue
+
+            summary_responses = [
+                {"question_id": r["question_id"], "response_value": r["response_value"]}
+                for r in responses
+            ]
+            pending.append((len(results) - 1, session_id, {
+                "questionnaire_id": item.get("questionnaire_id", "default_questionnaire"),
+                "timestamp": session_timestamp,
+                "summary_responses": summary_responses
+            }, summary_responses))
+
+        # 🔹 One read for all sessions: anything already stored is a replay
+        session_refs = [parent_ref.collection("sessions").document(session_id) for _, session_id, _, _ in pending]
+        existing = {snap.id: snap.to_dict() for snap in db.get_all(session_refs) if snap.exists} if session_refs else {}
+
+        groups = []
+        group_meta = []
+        timeline_entries = []
+        for (index, session_id, session_doc, summary_responses), session_ref in zip(pending, session_refs):
+            if session_id in existing:
+                results[index].update(status='duplicate', message='Session already stored.')
+                stored = existing[session_id]
+                timeline_entries.append(timeline_entry(session_id, stored.get("timestamp"), stored.get("summary_responses")))
+                continue
+            ops = [set_op(session_ref, session_doc)]
+            for response in summary_responses:
+                ops.append(set_op(session_ref.collection("responses").document(f"response_{response['question_id']}"), response))
+            groups.append(ops)
+            group_meta.append((index, timeline_entry(session_id, session_doc["timestamp"], summary_responses)))
+
+        # 🔹 Write sessions in as few commits as possible, each session atomically
+        for (index, entry), error in zip(group_meta, bulk_mutate_groups(db, groups)):
+            if error:
+                results[index].update(status='failed', message=error)
+            else:
+                results[index]['status'] = 'created'
+                timeline_entries.append(entry)
+
+        # 📈 Update derived per-client data once for the whole batch (a no-op if nothing changed)
+        if any(timeline_entries):
+            update_client_timeline(db, user_id, timeline_entries, clinician_id=clinician_id)
+
+        created = sum(1 for r in results if r['status'] == 'created')
+        return cors_enabled_response({
+            'message': f'Stored {created} of {len(results)} sessions',
+            'results': results
+        }, 200)
 
     except Exception as e:
-        print("Exception in /user-data/{user_id}/sessions/{session_id}/responses:", e)
+        logger.exception("Exception storing session batch", extra={"user_id": user_id})
         return cors_enabled_response({'message': 'Internal server error', 'error': str(e)}, 500)
 
 
@@ -340,20 +589,19 @@ def past_responses():
     query_user_id = request.args.get('user_id')
     questionnaire_id = request.args.get('questionnaire_id', None)  # Optional filter
     # New parameter: source can be 'active' (default), 'archived', or 'all'
-    source = request.args.get('source', 'active').strip().lower()
+    source = normalize_source(request.args.get('source'))
+    if source not in VALID_SOURCES:
+        return cors_enabled_response({'message': 'Invalid source parameter'}, 400)
 
     try:
         # Role-based access control.
+        client_archived = False
         if user_role in ['admin', 'clinician']:
             if not query_user_id:
                 return cors_enabled_response({'message': 'Must specify a user_id'}, 400)
+            client_doc, client_archived = get_user(db, query_user_id)
             if user_role == 'clinician':
-                # Use the appropriate collection based on the source parameter.
-                if source == 'archived':
-                    client_doc = db.collection('archived_users').document(query_user_id).get()
-                else:
-                    client_doc = db.collection('users').document(query_user_id).get()
-                if not client_doc.exists or client_doc.to_dict().get('assigned_clinician_id') != user_id:
+                if not client_doc or client_doc.to_dict().get('assigned_clinician_id') != user_id:
                     return cors_enabled_response({'message': 'Unauthorized'}, 403)
         elif user_role == 'client':
             if query_user_id and query_user_id != user_id:
@@ -362,27 +610,25 @@ def past_responses():
         else:
             return cors_enabled_response({'message': 'Unauthorized'}, 403)
 
+        # Sessions no longer move when a client is archived, so `source` filters on the client's status.
+        if (source == 'active' and client_archived) or (source == 'archived' and not client_archived):
+            return cors_enabled_response([], 200)
+
         # Helper function to get sessions from a specified collection (active or archived).
         def get_sessions_from_collection(collection_name):
             sessions_ref = db.collection(collection_name).document(query_user_id).collection('sessions')
             if questionnaire_id:
-                query_obj = sessions_ref.where("questionnaire_id", "==", questionnaire_id).order_by("timestamp", direction=firestore.Query.ASCENDING)
+                query_obj = sessions_ref.where("questionnaire_id", "==", questionnaire_id).order_by("timestamp", direction=ASCENDING)
             else:
-                query_obj = sessions_ref.order_by("timestamp", direction=firestore.Query.ASCENDING)
+                query_obj = sessions_ref.order_by("timestamp", direction=ASCENDING)
             return list(query_obj.stream())
 
         sessions_list = []
-        if source == 'active':
-            sessions_list = get_sessions_from_collection('user_data')
-        elif source == 'archived':
-            sessions_list = get_sessions_from_collection('archived_user_data')
-        elif source == 'all':
-            active_sessions = get_sessions_from_collection('user_data')
-            archived_sessions = get_sessions_from_collection('archived_user_data')
-            sessions_list = active_sessions + archived_sessions
+        parent_collections = session_collections(source)
+        for collection_name in parent_collections:
+            sessions_list.extend(get_sessions_from_collection(collection_name))
+        if len(parent_collections) > 1:
             sessions_list.sort(key=lambda s: s.to_dict().get("timestamp"))
-        else:
-            return cors_enabled_response({'message': 'Invalid source parameter'}, 400)
 
         responses_list = [
             {
@@ -400,8 +646,8 @@ def past_responses():
 
         return cors_enabled_response(responses_list, 200)
 
-    except Exception as e:
-        print(f"Error fetching past responses: {e}")
+    except Exception:
+        logger.exception("Error fetching past responses")
         return cors_enabled_response({'message': 'Error retrieving past responses'}, 500)
 
 
@@ -416,39 +662,31 @@ def get_session_responses(user_id, session_id):
         requestor_role = decoded_token.get('role')
         requestor_id = decoded_token.get('id')
 
-        # Determine source: "active" (default) or "archived"
-        source = request.args.get('source', 'active').strip().lower()
-        if source == "archived":
-            session_ref = db.collection("archived_user_data").document(user_id).collection("sessions").document(session_id)
-        else:
-            session_ref = db.collection("user_data").document(user_id).collection("sessions").document(session_id)
-
-        session_snapshot = session_ref.get()
-        if not session_snapshot.exists:
+        # Determine source: "active" (default) or "archived". Flag-archived clients keep their
+        # sessions in user_data; clients archived before the migration are found in the legacy tree.
+        source = normalize_source(request.args.get('source'))
+        session_snapshot = None
+        for collection_name in session_collections(source):
+            session_snapshot = db.collection(collection_name).document(user_id).collection("sessions").document(session_id).get()
+            if session_snapshot.exists:
+                break
+        if not session_snapshot or not session_snapshot.exists:
             return cors_enabled_response({'message': 'Session not found'}, 404)
 
         # Enforce Role-Based Access Control
         if requestor_role == "client" and user_id != requestor_id:
-            print(f"Unauthorized: Client {requestor_id} attempted to access session {session_id} (owned by {user_id})")
+            logger.warning("Client attempted to access another client's session",
+                           extra={"requestor_id": requestor_id, "session_id": session_id, "user_id": user_id})
             return cors_enabled_response({'message': 'Unauthorized: Clients can only access their own sessions.'}, 403)
 
         if requestor_role == "clinician":
-            # When searching active sessions, check the active users collection.
-            # For archived sessions, assume clinician can view if the active user was assigned to them.
-            client_doc = db.collection('users').document(user_id).get()
-            if client_doc.exists:
+            # Archived and active clients are checked the same way.
+            client_doc, _ = get_user(db, user_id)
+            if client_doc:
                 assigned_clinician = client_doc.to_dict().get('assigned_clinician_id')
                 if assigned_clinician != requestor_id:
-                    print(f"Unauthorized: Clinician {requestor_id} is not assigned to client {user_id}")
+                    logger.warning("Clinician is not assigned to client", extra={"requestor_id": requestor_id, "user_id": user_id})
                     return cors_enabled_response({'message': 'Unauthorized access to session'}, 403)
-            else:
-                # If not found in active users, try archived_users.
-                client_doc = db.collection('archived_users').document(user_id).get()
-                if client_doc.exists:
-                    assigned_clinician = client_doc.to_dict().get('assigned_clinician_id')
-                    if assigned_clinician != requestor_id:
-                        print(f"Unauthorized: Clinician {requestor_id} is not assigned to archived client {user_id}")
-                        return cors_enabled_response({'message': 'Unauthorized access to session'}, 403)
 
         # Fetch session document data.
         session_data = session_snapshot.to_dict()
@@ -471,8 +709,8 @@ def get_session_responses(user_id, session_id):
 
         return cors_enabled_response(result, 200)
 
-    except Exception as e:
-        print(f"Error fetching session responses: {e}")
+    except Exception:
+        logger.exception("Error fetching session responses")
         return cors_enabled_response({'message': 'Error retrieving session responses'}, 500)
     
 
@@ -490,140 +728,36 @@ def search_users():
         return cors_enabled_response({'message': 'Query parameter is required'}, 400)
 
     # Retrieve filter parameter; default to "non_archived"
-    filter_param = request.args.get('filter', 'non_archived').strip().lower()
+    filter_param = normalize_source(request.args.get('filter'), 'non_archived')
 
     matching_users = []
     try:
-        if user_role == 'admin':
-            if filter_param in ['non_archived', 'active']:
-                # Search active users from the 'users' collection.
-                users_ref = db.collection('users').stream()
-                matching_users = [
-                    {
-                        'id': user.id,
-                        'first_name': user.to_dict().get('first_name', ''),
-                        'last_name': user.to_dict().get('last_name', ''),
-                        'role': user.to_dict().get('role', ''),
-                        'is_archived': False
-                    }
-                    for user in users_ref
-                    if query in user.to_dict().get('first_name', '').lower() or 
-                       query in user.to_dict().get('last_name', '').lower()
-                ]
-            elif filter_param == 'archived':
-                # Search archived users from the 'archived_users' collection.
-                archived_ref = db.collection('archived_users').stream()
-                matching_users = [
-                    {
-                        'id': user.id,
-                        'first_name': user.to_dict().get('first_name', ''),
-                        'last_name': user.to_dict().get('last_name', ''),
-                        'role': user.to_dict().get('role', ''),
-                        'is_archived': True
-                    }
-                    for user in archived_ref
-                    if query in user.to_dict().get('first_name', '').lower() or 
-                       query in user.to_dict().get('last_name', '').lower()
-                ]
-            elif filter_param == 'all':
-                # Search both active and archived users.
-                active_ref = db.collection('users').stream()
-                archived_ref = db.collection('archived_users').stream()
-                active_users = [
-                    {
-                        'id': user.id,
-                        'first_name': user.to_dict().get('first_name', ''),
-                        'last_name': user.to_dict().get('last_name', ''),
-                        'role': user.to_dict().get('role', ''),
-                        'is_archived': False
-                    }
-                    for user in active_ref
-                    if query in user.to_dict().get('first_name', '').lower() or 
-                       query in user.to_dict().get('last_name', '').lower()
-                ]
-                archived_users = [
-                    {
-                        'id': user.id,
-                        'first_name': user.to_dict().get('first_name', ''),
-                        'last_name': user.to_dict().get('last_name', ''),
-                        'role': user.to_dict().get('role', ''),
-                        'is_archived': True
-                    }
-                    for user in archived_ref
-                    if query in user.to_dict().get('first_name', '').lower() or 
-                       query in user.to_dict().get('last_name', '').lower()
-                ]
-                matching_users = active_users + archived_users
-            else:
-                return cors_enabled_response({'message': 'Invalid filter parameter'}, 400)
+        if filter_param not in VALID_SOURCES:
+            return cors_enabled_response({'message': 'Invalid filter parameter'}, 400)
 
+        if user_role == 'admin':
+            filters = []
         elif user_role == 'clinician':
             # Clinicians can only search among their assigned clients.
-            if filter_param in ['non_archived', 'active']:
-                assigned_clients = db.collection('users').where('assigned_clinician_id', '==', user_id).stream()
-                matching_users = [
-                    {
-                        'id': user.id,
-                        'first_name': user.to_dict().get('first_name', ''),
-                        'last_name': user.to_dict().get('last_name', ''),
-                        'role': user.to_dict().get('role', ''),
-                        'is_archived': False
-                    }
-                    for user in assigned_clients
-                    if query in user.to_dict().get('first_name', '').lower() or 
-                       query in user.to_dict().get('last_name', '').lower()
-                ]
-            elif filter_param == 'archived':
-                assigned_clients = db.collection('archived_users').where('assigned_clinician_id', '==', user_id).stream()
-                matching_users = [
-                    {
-                        'id': user.id,
-                        'first_name': user.to_dict().get('first_name', ''),
-                        'last_name': user.to_dict().get('last_name', ''),
-                        'role': user.to_dict().get('role', ''),
-                        'is_archived': True
-                    }
-                    for user in assigned_clients
-                    if query in user.to_dict().get('first_name', '').lower() or 
-                       query in user.to_dict().get('last_name', '').lower()
-                ]
-            elif filter_param == 'all':
-                active_ref = db.collection('users').where('assigned_clinician_id', '==', user_id).stream()
-                archived_ref = db.collection('archived_users').where('assigned_clinician_id', '==', user_id).stream()
-                active_users = [
-                    {
-                        'id': user.id,
-                        'first_name': user.to_dict().get('first_name', ''),
-                        'last_name': user.to_dict().get('last_name', ''),
-                        'role': user.to_dict().get('role', ''),
-                        'is_archived': False
-                    }
-                    for user in active_ref
-                    if query in user.to_dict().get('first_name', '').lower() or 
-                       query in user.to_dict().get('last_name', '').lower()
-                ]
-                archived_users = [
-                    {
-                        'id': user.id,
-                        'first_name': user.to_dict().get('first_name', ''),
-                        'last_name': user.to_dict().get('last_name', ''),
-                        'role': user.to_dict().get('role', ''),
-                        'is_archived': True
-                    }
-                    for user in archived_ref
-                    if query in user.to_dict().get('first_name', '').lower() or 
-                       query in user.to_dict().get('last_name', '').lower()
-                ]
-                matching_users = active_users + archived_users
-            else:
-                return cors_enabled_response({'message': 'Invalid filter parameter'}, 400)
+            filters = [('assigned_clinician_id', '==', user_id)]
         else:
             return cors_enabled_response({'message': 'Unauthorized: Clients cannot search for other users'}, 403)
 
+        for user, archived in stream_users(db, filter_param, filters):
+            data = user.to_dict()
+            if query in data.get('first_name', '').lower() or query in data.get('last_name', '').lower():
+                matching_users.append({
+                    'id': user.id,
+                    'first_name': data.get('first_name', ''),
+                    'last_name': data.get('last_name', ''),
+                    'role': data.get('role', ''),
+                    'is_archived': archived
+                })
+
         return cors_enabled_response({'users': matching_users}, 200)
 
-    except Exception as e:
-        print(f"Error searching users: {e}")
+    except Exception:
+        logger.exception("Error searching users")
         return cors_enabled_response({'message': 'Error retrieving user search results'}, 500)
 
 
@@ -641,130 +775,36 @@ def search_clients():
         return cors_enabled_response({'message': 'Query parameter is required'}, 400)
 
     # Retrieve the filter parameter; default to "non_archived"
-    filter_param = request.args.get('filter', 'non_archived').strip().lower()
+    filter_param = normalize_source(request.args.get('filter'), 'non_archived')
 
     try:
         matching_clients = []
+        if filter_param not in VALID_SOURCES:
+            return cors_enabled_response({'message': 'Invalid filter parameter'}, 400)
+
         if user_role == 'admin':
             # For admins, search among all clients without assignment restrictions.
-            if filter_param in ['non_archived', 'active']:
-                clients_ref = db.collection('users').where('role', '==', 'client').stream()
-                matching_clients = [
-                    {
-                        'id': client.id,
-                        'first_name': client.to_dict().get('first_name', ''),
-                        'last_name': client.to_dict().get('last_name', ''),
-                        'is_archived': False
-                    }
-                    for client in clients_ref
-                    if query in client.to_dict().get('first_name', '').lower() or
-                       query in client.to_dict().get('last_name', '').lower()
-                ]
-            elif filter_param == 'archived':
-                archived_ref = db.collection('archived_users').stream()
-                matching_clients = [
-                    {
-                        'id': client.id,
-                        'first_name': client.to_dict().get('first_name', ''),
-                        'last_name': client.to_dict().get('last_name', ''),
-                        'is_archived': True
-                    }
-                    for client in archived_ref
-                    if query in client.to_dict().get('first_name', '').lower() or
-                       query in client.to_dict().get('last_name', '').lower()
-                ]
-            elif filter_param == 'all':
-                active_ref = db.collection('users').where('role', '==', 'client').stream()
-                archived_ref = db.collection('archived_users').stream()
-                active_clients = [
-                    {
-                        'id': client.id,
-                        'first_name': client.to_dict().get('first_name', ''),
-                        'last_name': client.to_dict().get('last_name', ''),
-                        'is_archived': False
-                    }
-                    for client in active_ref
-                    if query in client.to_dict().get('first_name', '').lower() or
-                       query in client.to_dict().get('last_name', '').lower()
-                ]
-                archived_clients = [
-                    {
-                        'id': client.id,
-                        'first_name': client.to_dict().get('first_name', ''),
-                        'last_name': client.to_dict().get('last_name', ''),
-                        'is_archived': True
-                    }
-                    for client in archived_ref
-                    if query in client.to_dict().get('first_name', '').lower() or
-                       query in client.to_dict().get('last_name', '').lower()
-                ]
-                matching_clients = active_clients + archived_clients
-            else:
-                return cors_enabled_response({'message': 'Invalid filter parameter'}, 400)
-
+            filters = [('role', '==', 'client')]
         elif user_role == 'clinician':
             # Clinicians can only search among their assigned clients.
-            if filter_param in ['non_archived', 'active']:
-                clients_ref = db.collection('users').where('assigned_clinician_id', '==', user_id).stream()
-                matching_clients = [
-                    {
-                        'id': client.id,
-                        'first_name': client.to_dict().get('first_name', ''),
-                        'last_name': client.to_dict().get('last_name', ''),
-                        'is_archived': False
-                    }
-                    for client in clients_ref
-                    if query in client.to_dict().get('first_name', '').lower() or
-                       query in client.to_dict().get('last_name', '').lower()
-                ]
-            elif filter_param == 'archived':
-                archived_ref = db.collection('archived_users').where('assigned_clinician_id', '==', user_id).stream()
-                matching_clients = [
-                    {
-                        'id': client.id,
-                        'first_name': client.to_dict().get('first_name', ''),
-                        'last_name': client.to_dict().get('last_name', ''),
-                        'is_archived': True
-                    }
-                    for client in archived_ref
-                    if query in client.to_dict().get('first_name', '').lower() or
-                       query in client.to_dict().get('last_name', '').lower()
-                ]
-            elif filter_param == 'all':
-                active_ref = db.collection('users').where('assigned_clinician_id', '==', user_id).stream()
-                archived_ref = db.collection('archived_users').where('assigned_clinician_id', '==', user_id).stream()
-                active_clients = [
-                    {
-                        'id': client.id,
-                        'first_name': client.to_dict().get('first_name', ''),
-                        'last_name': client.to_dict().get('last_name', ''),
-                        'is_archived': False
-                    }
-                    for client in active_ref
-                    if query in client.to_dict().get('first_name', '').lower() or
-                       query in client.to_dict().get('last_name', '').lower()
-                ]
-                archived_clients = [
-                    {
-                        'id': client.id,
-                        'first_name': client.to_dict().get('first_name', ''),
-                        'last_name': client.to_dict().get('last_name', ''),
-                        'is_archived': True
-                    }
-                    for client in archived_ref
-                    if query in client.to_dict().get('first_name', '').lower() or
-                       query in client.to_dict().get('last_name', '').lower()
-                ]
-                matching_clients = active_clients + archived_clients
-            else:
-                return cors_enabled_response({'message': 'Invalid filter parameter'}, 400)
+            filters = [('assigned_clinician_id', '==', user_id)]
         else:
             return cors_enabled_response({'message': 'Unauthorized: Clients cannot search for other users'}, 403)
 
+        for client, archived in stream_users(db, filter_param, filters):
+            data = client.to_dict()
+            if query in data.get('first_name', '').lower() or query in data.get('last_name', '').lower():
+                matching_clients.append({
+                    'id': client.id,
+                    'first_name': data.get('first_name', ''),
+                    'last_name': data.get('last_name', ''),
+                    'is_archived': archived
+                })
+
         return cors_enabled_response({'clients': matching_clients}, 200)
 
-    except Exception as e:
-        print(f"Error searching clients: {e}")
+    except Exception:
+        logger.exception("Error searching clients")
         return cors_enabled_response({'message': 'Error retrieving client search results'}, 500)
 
 
@@ -783,74 +823,35 @@ def search_all_clients():
     if not query:
         return cors_enabled_response({'message': 'Query parameter is required'}, 400)
     
-    filter_param = request.args.get('filter', 'non_archived').strip().lower()
+    filter_param = normalize_source(request.args.get('filter'), 'non_archived')
 
     # Split the query into tokens for partial matching.
     tokens = query.split()
 
     try:
         matching_clients = []
+        if filter_param not in VALID_SOURCES:
+            return cors_enabled_response({'message': 'Invalid filter parameter'}, 400)
 
         # Helper function: returns True if every token is found in the client's combined name.
-        def match_client(user):
-            data = user.to_dict()
+        def match_client(data):
             combined = (data.get('first_name', '') + " " + data.get('last_name', '')).lower()
             return all(token in combined for token in tokens)
 
-        if filter_param in ['non_archived', 'active']:
-            # Search active clients from the "users" collection.
-            users_ref = db.collection('users').where('role', '==', 'client').stream()
-            matching_clients = [
-                {
-                    'id': user.id,
-                    'first_name': user.to_dict().get('first_name', ''),
-                    'last_name': user.to_dict().get('last_name', ''),
-                    'is_archived': False
-                }
-                for user in users_ref if match_client(user)
-            ]
-        elif filter_param == 'archived':
-            # Search archived clients from the "archived_users" collection.
-            archived_ref = db.collection('archived_users').stream()
-            matching_clients = [
-                {
-                    'id': user.id,
-                    'first_name': user.to_dict().get('first_name', ''),
-                    'last_name': user.to_dict().get('last_name', ''),
-                    'is_archived': True
-                }
-                for user in archived_ref if match_client(user)
-            ]
-        elif filter_param == 'all':
-            # Search both active and archived clients.
-            active_ref = db.collection('users').where('role', '==', 'client').stream()
-            archived_ref = db.collection('archived_users').stream()
-            active_clients = [
-                {
-                    'id': user.id,
-                    'first_name': user.to_dict().get('first_name', ''),
-                    'last_name': user.to_dict().get('last_name', ''),
-                    'is_archived': False
-                }
-                for user in active_ref if match_client(user)
-            ]
-            archived_clients = [
-                {
+        for user, archived in stream_users(db, filter_param, [('role', '==', 'client')]):
+            data = user.to_dict()
+            if match_client(data):
+                matching_clients.append({
                     'id': user.id,
-                    'first_name': user.to_dict().get('first_name', ''),
-                    'last_name': user.to_dict().get('last_name', ''),
-                    'is_archived': True
-                }
-                for user in archived_ref if match_client(user)
-            ]
-            matching_clients = active_clients + archived_clients
-        else:
-            return cors_enabled_response({'message': 'Invalid filter parameter'}, 400)
+                    'first_name': data.get('first_name', ''),
+                    'last_name': data.get('last_name', ''),
+                    'is_archived': archived
+                })
 
         return cors_enabled_response({'clients': matching_clients}, 200)
 
-    except Exception as e:
-        print(f"Error searching all clients: {e}")
+    except Exception:
+        logger.exception("Error searching all clients")
         return cors_enabled_response({'message': 'Error retrieving all client search results'}, 500)
 
 
@@ -862,26 +863,10 @@ def get_user_info():
     if not user_id:
         return cors_enabled_response({'message': 'User ID is required'}, 400)
 
-    # Determine the initial collection based on the source parameter.
-    source = request.args.get('source', 'active').strip().lower()
-    if source == 'archived':
-        collection_name = 'archived_users'
-        is_archived = True
-    else:
-        collection_name = 'users'
-        is_archived = False
-
-    user_doc = db.collection(collection_name).document(user_id).get()
-
-    # If not found in active and source is active, try the archived collection.
-    if not user_doc.exists and source == 'active':
-        archived_doc = db.collection('archived_users').document(user_id).get()
-        if archived_doc.exists:
-            user_doc = archived_doc
-            is_archived = True
-        else:
-            return cors_enabled_response({'message': 'User not found'}, 404)
-    elif not user_doc.exists:
+    # `source=archived` only matches archived clients; `source=active` finds either.
+    source = normalize_source(request.args.get('source'))
+    user_doc, client_archived = get_user(db, user_id)
+    if not user_doc or (source == 'archived' and not client_archived):
         return cors_enabled_response({'message': 'User not found'}, 404)
 
     user_data = user_doc.to_dict()
@@ -889,7 +874,7 @@ def get_user_info():
         'first_name': user_data.get('first_name', ''),
         'last_name': user_data.get('last_name', ''),
         'email': user_data.get('email', ''),
-        'is_archived': is_archived
+        'is_archived': client_archived
     }, 200)
 
 
@@ -977,40 +962,74 @@ def remove_user():
         return cors_enabled_response({'message': 'User ID is required'}, 400)
 
     try:
-        # Force logout from all devices: remove sessions from both active and archived collections.
-        active_sessions_ref = db.collection('users').document(user_id).collection('sessions')
-        for session in active_sessions_ref.stream():
-            session.reference.delete()
-        archived_sessions_ref = db.collection('archived_users').document(user_id).collection('sessions')
-        for session in archived_sessions_ref.stream():
-            session.reference.delete()
-
         # Fetch the user document from the `users` collection.
-        user_doc = db.collection('users').document(user_id).get()
+        user_ref = db.collection('users').document(user_id)
+        user_doc = user_ref.get()
         if not user_doc.exists:
             return cors_enabled_response({'message': 'User not found'}, 404)
 
         user_data = user_doc.to_dict()
         user_role = user_data.get('role')  # Assumes roles are stored in `users`
 
-        # Remove from `users` collection.
-        db.collection('users').document(user_id).delete()
-
-        # If the user is a clinician, remove from `clinicians`.
-        db.collection('clinicians').document(user_id).delete()
-
-        # If the user is an admin, also remove from `admins`.
+        # Force logout from all devices: remove sessions from both active and archived collections.
+        ops = delete_collection_ops(user_ref.collection('sessions'))
+        if LEGACY_ARCHIVE_READS:
+            ops += delete_collection_ops(db.collection(LEGACY_USERS_COLLECTION).document(user_id).collection('sessions'))
+
+        # Remove from `users` and `clinicians`, and from `admins` if the user is an admin
+        # (clients are deleted from `users` in the transaction below).
+        if user_role != 'client':
+            ops.append(delete_op(user_ref))
+            if user_data.get('email'):
+                ops.append(delete_op(email_key_ref(db, user_data['email'])))
+        ops.append(delete_op(db.collection('clinicians').document(user_id)))
         if user_role == "admin":
-            db.collection('admins').document(user_id).delete()
+            ops.append(delete_op(db.collection('admins').document(user_id)))
+
+        # Drop the user's metric rollup.
+        if user_role in ["clinician", "admin"]:
+            ops.append(delete_op(rollup_ref(db, user_id)))
 
         # Reassign clients if the user was a clinician or admin.
+        client_updates = []
         if user_role in ["clinician", "admin"]:
             clients_ref = db.collection('users').where('assigned_clinician_id', '==', user_id).stream()
-            client_updates = []
             for client in clients_ref:
                 client_updates.append(client.id)
-                db.collection('users').document(client.id).update({'assigned_clinician_id': None})
+                ops.append(update_op(client.reference, {'assigned_clinician_id': None}))
+
+        result = bulk_mutate(db, ops)
 
+        # A client is deleted together with their entry in their clinician's rollup and the removal of
+        # their sessions from the monthly trends. The timeline is read in the same transaction, so a
+        # check-in committed meanwhile is subtracted with the rest (or makes the transaction retry);
+        # their device sessions are already revoked, so no new one can start.
+        if user_role == 'client' and not result['failed']:
+            data_ref = db.collection(data_collection_for(user_doc)).document(user_id)
+
+            def delete_client(transaction):
+                previous_timeline = read_timeline(data_ref.get(transaction=transaction))
+                transaction.delete(user_ref)
+                if user_data.get('email'):
+                    transaction.delete(email_key_ref(db, user_data['email']))
+                if not is_archived(user_data):
+                    queue_client_state(transaction, db, user_data.get('assigned_clinician_id'), user_id, None)
+                queue_trend_delta(transaction, db, user_id, previous_timeline, [])
+
+            run_transaction(db, delete_client)
+
+        # Update the roster even on partial failure: some of the deletes may have landed.
+        if user_role in ["clinician", "admin"]:
+            clinician_removed(user_id)
+        elif not is_archived(user_data) and not result['failed']:
+            clients_moved(user_data.get('assigned_clinician_id'), -1)
+        if result['failed']:
+            return cors_enabled_response({
+                'message': 'Some changes could not be applied while removing the user',
+                'failed': result['failed']
+            }, 500)
+
+        if user_role in ["clinician", "admin"]:
             return cors_enabled_response({
                 'message': f'User {user_role} removed successfully',
                 'clients_updated': client_updates  # For debugging purposes
@@ -1019,7 +1038,7 @@ def remove_user():
         return cors_enabled_response({'message': 'User removed successfully'}, 200)
 
     except Exception as e:
-        print(f"Error removing user: {e}")
+        logger.exception("Error removing user")
         return cors_enabled_response({'message': 'An error occurred while removing the user', 'error': str(e)}, 500)
 
 
@@ -1027,30 +1046,24 @@ def remove_user():
 def get_only_clinicians():
     """Fetch all clinicians (excluding admins)."""
     try:
-        clinicians_ref = db.collection('clinicians').stream()
-        # Include the is_admin flag in the fetched data.
-        clinicians = [
-            {"id": c.id, "name": c.to_dict().get("name", ""), "is_admin": c.to_dict().get("is_admin", False)}
-            for c in clinicians_ref
-        ]
-        # Filter out users that are admins.
-        filtered_clinicians = [clin for clin in clinicians if not clin.get("is_admin")]
-        
-        return cors_enabled_response({"clinicians": filtered_clinicians or []}, 200)
+        clinicians = roster.clinicians(query=request.args.get('query'), is_admin=False)
+        return reference_cache.conditional_response({"clinicians": clinicians}, cors_enabled_response)
 
     except Exception as e:
         return cors_enabled_response({"message": "Failed to fetch clinicians", "error": str(e)}, 500)
     
 @main_bp.route('/get-clinicians', methods=['GET'])
 def get_clinicians():
+    """
+    Fetch all clinicians (admins included) from the roster.
+    Optional filters: `query` (name contains) and `is_admin` (true/false).
+    """
     try:
-        clinicians_ref = db.collection('clinicians').stream()
-        clinicians = [
-            {"id": c.id, "name": c.to_dict().get("name", "")}
-            for c in clinicians_ref
-        ]
-        
-        return cors_enabled_response({"clinicians": clinicians or []}, 200)
+        is_admin = request.args.get('is_admin')
+        if is_admin is not None:
+            is_admin = is_admin.strip().lower() in ("1", "true", "yes")
+        clinicians = roster.clinicians(query=request.args.get('query'), is_admin=is_admin)
+        return reference_cache.conditional_response({"clinicians": clinicians}, cors_enabled_response)
 
     except Exception as e:
         return cors_enabled_response({"message": "Failed to fetch clinicians", "error": str(e)}, 500)
@@ -1060,10 +1073,8 @@ def get_clinicians():
 def get_admins():
     """Fetch all admins."""
     try:
-        admins_ref = db.collection('admins').stream()
-        admins = [{"id": a.id, "name": a.to_dict().get("name", "")} for a in admins_ref]
-
-        return cors_enabled_response({"admins": admins or []}, 200)
+        admins = roster.admins(query=request.args.get('query'))
+        return reference_cache.conditional_response({"admins": admins}, cors_enabled_response)
 
     except Exception as e:
         return cors_enabled_response({"message": "Failed to fetch admins", "error": str(e)}, 500)
@@ -1083,10 +1094,12 @@ def get_clinician_data():
       - % Not Improving: % of clients (with ≥3 sessions) where the latest score is 
                          equal to or lower than the lower score of the first two sessions.
       - The same three percentages are also computed for clients whose latest session is within the past 6 months.
+      - With `window` (30d/90d/182d/365d) or `from`/`to`: the same three percentages for
+        improvement within that window (first versus last session inside it), under "window".
     
     Additionally returns the current search filters in admin_search_filters.
+    Counts come from the clinician's metric rollup (app/rollups.py).
     """
-    from datetime import datetime, timedelta, timezone
     try:
         decoded_token, error_response, status_code = validate_token()
         if error_response:
@@ -1098,175 +1111,213 @@ def get_clinician_data():
         clinician_id = request.args.get('clinician_id')
         if not clinician_id:
             return cors_enabled_response({'message': 'Clinician ID is required'}, 400)
+        try:
+            window = parse_window(request.args)
+        except ValueError as e:
+            return cors_enabled_response({'message': str(e)}, 400)
     
-        # Fetch active (non-archived) clients assigned to the clinician.
-        clients_ref = db.collection('users').where('assigned_clinician_id', '==', clinician_id).stream()
-        clients = [{**client.to_dict(), 'user_id': client.id} for client in clients_ref]
-        total_clients = len(clients)
-    
-        # If no clients, return zeros.
-        if total_clients == 0:
-            return cors_enabled_response({
-                'total_clients': 0,
-                'percent_improved': 0,
-                'percent_clinically_significant': 0,
-                'percent_not_improving': 0,
-                'percent_improved_last_6_months': 0,
-                'percent_clinically_significant_last_6_months': 0,
-                'percent_not_improving_last_6_months': 0,
-                'admin_search_filters': {
-                    'clinician_id': clinician_id,
-                    'metric': request.args.get('metric', 'total_clients').strip().lower(),
-                    'time': request.args.get('time', 'all').strip().lower()
-                }
-            }, 200)
-    
-        # Read filter parameters.
-        metric = request.args.get('metric', 'total_clients').strip().lower()
-        time_filter = request.args.get('time', 'all').strip().lower()
-    
-        # --- Helper Functions ---
-        def calculate_scores(user_id):
-            """
-            For "improved" and "clinically_significant": 
-            Fetch sessions (ordered by timestamp) from active data.
-            If the client has at least 3 sessions, returns (initial_score, latest_score, latest_timestamp).
-            Otherwise returns (None, None, None).
-            """
-            sessions_ref = db.collection("user_data").document(user_id).collection("sessions")
-            sessions = list(sessions_ref.order_by("timestamp", direction=firestore.Query.ASCENDING).stream())
-            if len(sessions) < 3:
-                return None, None, None
-            session_scores = []
-            for session in sessions:
-                s_data = session.to_dict()
-                timestamp = s_data.get("timestamp")
-                responses = s_data.get("summary_responses", [])
-                try:
-                    values = [float(r.get("response_value", 0)) for r in responses]
-                except Exception:
-                    values = []
-                if values:
-                    total_score = sum(values) - 10
-                    session_scores.append({"timestamp": timestamp, "score": total_score})
-            session_scores.sort(key=lambda x: x["timestamp"])
-            if len(session_scores) < 3:
-                return None, None, None
-            return session_scores[0]["score"], session_scores[-1]["score"], session_scores[-1]["timestamp"]
-    
-        def calculate_not_improving_scores(user_id):
-            """
-            For "not-improving": Require at least 3 sessions.
-            Look at the first two sessions and take the lower score,
-            then return that score along with the latest session score and timestamp.
-            """
-            sessions_ref = db.collection("user_data").document(user_id).collection("sessions")
-            sessions = list(sessions_ref.order_by("timestamp", direction=firestore.Query.ASCENDING).stream())
-            if len(sessions) < 3:
-                return None, None, None
-            first_two_scores = []
-            for session in sessions[:2]:
-                s_data = session.to_dict()
-                responses = s_data.get("summary_responses", [])
-                try:
-                    values = [float(r.get("response_value", 0)) for r in responses]
-                except Exception:
-                    values = []
-                if values:
-                    total_score = sum(values) - 10
-                    first_two_scores.append(total_score)
-            if len(first_two_scores) < 2:
-                return None, None, None
-            first_two_lowest = min(first_two_scores)
-            all_session_scores = []
-            for session in sessions:
-                s_data = session.to_dict()
-                responses = s_data.get("summary_responses", [])
-                try:
-                    values = [float(r.get("response_value", 0)) for r in responses]
-                except Exception:
-                    values = []
-                if values:
-                    total_score = sum(values) - 10
-                    all_session_scores.append({"timestamp": s_data.get("timestamp"), "score": total_score})
-            if not all_session_scores:
-                return None, None, None
-            all_session_scores.sort(key=lambda x: x["timestamp"])
-            latest = all_session_scores[-1]["score"]
-            latest_timestamp = all_session_scores[-1]["timestamp"]
-            return first_two_lowest, latest, latest_timestamp
-    
-        def is_clinically_significant(initial, latest):
-            # Example: initial > 18 and improvement (initial - latest) >= 12.
-            return initial is not None and initial > 18 and (initial - latest) >= 12
-        
-        def is_recent(timestamp):
-            six_months_ago = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(days=182)
-            return timestamp and timestamp >= six_months_ago
-    
-        # --- Compute Counters for Improvement Metrics ---
-        count_improved = 0
-        count_clinically_significant = 0
-        count_not_improving = 0
-        count_improved_6m = 0
-        count_clinically_significant_6m = 0
-        count_not_improving_6m = 0
-    
-        for client in clients:
-            user_id = client['user_id']
-            # Use the helper functions.
-            initial, latest, latest_ts = calculate_scores(user_id)
-            first_two_lowest, latest_ni, latest_ts_ni = calculate_not_improving_scores(user_id)
-    
-            # Only consider improvement metrics if client has at least 3 sessions.
-            if initial is not None and latest is not None:
-                if latest < initial:
-                    count_improved += 1
-                if is_clinically_significant(initial, latest):
-                    count_clinically_significant += 1
-            if first_two_lowest is not None and latest_ni is not None:
-                if latest_ni <= first_two_lowest:
-                    count_not_improving += 1
-    
-            # For 6-month metrics, only count if the client's latest session is recent.
-            if latest_ts and is_recent(latest_ts):
-                if initial is not None and latest is not None and latest < initial:
-                    count_improved_6m += 1
-                if initial is not None and latest is not None and is_clinically_significant(initial, latest):
-                    count_clinically_significant_6m += 1
-            if latest_ts_ni and is_recent(latest_ts_ni):
-                if first_two_lowest is not None and latest_ni is not None and latest_ni <= first_two_lowest:
-                    count_not_improving_6m += 1
-    
-        # Compute percentages based on the total number of active clients.
-        percent_improved = (count_improved / total_clients) * 100 if total_clients else 0
-        percent_clinically_significant = (count_clinically_significant / total_clients) * 100 if total_clients else 0
-        percent_not_improving = (count_not_improving / total_clients) * 100 if total_clients else 0
-        percent_improved_6m = (count_improved_6m / total_clients) * 100 if total_clients else 0
-        percent_clinically_significant_6m = (count_clinically_significant_6m / total_clients) * 100 if total_clients else 0
-        percent_not_improving_6m = (count_not_improving_6m / total_clients) * 100 if total_clients else 0
-    
-        # Prepare the search filters for navigation to the admin-search-clients page.
-        search_filters = {
-            "clinician_id": clinician_id,
-            "metric": metric,
-            "time": time_filter
-        }
-    
+        def compute():
+            # Counted from the clinician's rollup: one read, however many sessions their clients have.
+            with span("load_rollup"):
+                states = load_rollups(db, [clinician_id])[clinician_id]
+            summary = summarize(states)
+            summary.pop('counts')
+            if window is not None:
+                # Improvement inside the window needs the clients' timelines, not just their first and last scores.
+                with span("load_timelines", clients=len(states)):
+                    timelines = load_timelines(db, [(user_id, 'user_data') for user_id in states])
+                summary['window'] = window_summary(timelines, window)
+            # Prepare the search filters for navigation to the admin-search-clients page.
+            summary['admin_search_filters'] = {
+                'clinician_id': clinician_id,
+                'metric': request.args.get('metric', 'total_clients').strip().lower(),
+                'time': request.args.get('time', 'all').strip().lower()
+            }
+            return (summary, 200)
+
+        flight_key = (
+            clinician_id,
+            request.args.get('metric', 'total_clients').strip().lower(),
+            request.args.get('time', 'all').strip().lower(),
+            window.cache_key() if window else None,
+        )
+        data, status = clinician_data_flight.do(flight_key, compute)
+        return cors_enabled_response(data, status)
+
+    except Exception as e:
+        logger.exception("Error in /clinician-data")
+        return cors_enabled_response({'message': 'Failed to fetch clinician data.', 'error': str(e)}, 500)
+
+@main_bp.route('/clinician-comparison', methods=['GET'])
+def clinician_comparison():
+    """
+    Metrics for every clinician at once, for comparing caseloads side by side.
+    Each entry has the /clinician-data metrics plus the raw counts behind them.
+    Reads one rollup document per clinician (app/rollups.py); names come from the roster.
+
+    Query parameters:
+      - sort (optional): "name", "total_clients" or any percent_* metric (default "total_clients").
+      - order (optional): "asc" or "desc" (default "asc" for name, otherwise "desc").
+      - query (optional): only clinicians whose name contains this text.
+      - window / from / to (optional): also compute each clinician's metrics within that
+        window under "window"; this reads every client's timeline.
+    Accessible only by admins.
+    """
+    decoded_token, error_response, status_code = validate_token()
+    if error_response:
+        return cors_enabled_response(error_response, status_code)
+
+    if decoded_token.get('role') != 'admin':
+        return cors_enabled_response({'message': 'Unauthorized: Only admins can access this data'}, 403)
+
+    sort_key = request.args.get('sort', 'total_clients').strip()
+    if sort_key not in ['name', 'total_clients'] + [percent_key for _, percent_key in METRICS]:
+        return cors_enabled_response({'message': 'Invalid sort parameter'}, 400)
+    order = request.args.get('order', 'asc' if sort_key == 'name' else 'desc').strip().lower()
+    if order not in ('asc', 'desc'):
+        return cors_enabled_response({'message': 'Invalid order parameter'}, 400)
+    try:
+        window = parse_window(request.args)
+    except ValueError as e:
+        return cors_enabled_response({'message': str(e)}, 400)
+
+    try:
+        clinicians = roster.clinicians(query=request.args.get('query'))
+        with span("load_rollups", clinicians=len(clinicians)):
+            rollups = load_rollups(db, [clinician['id'] for clinician in clinicians])
+        timelines = {}
+        if window is not None:
+            client_ids = [user_id for states in rollups.values() for user_id in states]
+            with span("load_timelines", clients=len(client_ids)):
+                timelines = load_timelines(db, [(user_id, 'user_data') for user_id in client_ids])
+
+        recent = recent_window()
+        rows = []
+        for clinician in clinicians:
+            states = rollups[clinician['id']]
+            row = {
+                'clinician_id': clinician['id'],
+                'name': clinician['name'],
+                'is_admin': clinician['is_admin'],
+                **summarize(states, recent),
+            }
+            if window is not None:
+                row['window'] = window_summary({user_id: timelines[user_id] for user_id in states}, window)
+            rows.append(row)
+        rows.sort(key=lambda row: (row[sort_key].lower() if sort_key == 'name' else row[sort_key]), reverse=order == 'desc')
+
+        body = {'clinicians': rows, 'sort': sort_key, 'order': order}
+        if window is not None:
+            body['window'] = window.to_dict()
+        return cors_enabled_response(body, 200)
+
+    except Exception as e:
+        logger.exception("Error in /clinician-comparison")
+        return cors_enabled_response({'message': 'Failed to fetch clinician comparison.', 'error': str(e)}, 500)
+
+
+# Longest range /outcome-trends serves (10 years of months).
+MAX_TREND_MONTHS = 120
+
+
+@main_bp.route('/outcome-trends', methods=['GET'])
+def outcome_trends():
+    """
+    Month-by-month outcome trends for all clients (active and archived), read from the
+    monthly trend rollups (app/trends.py) rather than the clients' sessions:
+      - months: scored sessions per month with their mean score and standard deviation
+      - cohorts: clients by intake month (month of their first session), with how many of
+        those with 3+ sessions improved, improved clinically significantly or are not improving
+    `window` (30d/90d/182d/365d, default 365d) or `from`/`to` select the months covered.
+    Accessible only by admins.
+    """
+    decoded_token, error_response, status_code = validate_token()
+    if error_response:
+        return cors_enabled_response(error_response, status_code)
+
+    if decoded_token.get('role') != 'admin':
+        return cors_enabled_response({'message': 'Unauthorized: Only admins can access outcome trends'}, 403)
+
+    now = datetime.now(timezone.utc)
+    try:
+        window = parse_window(request.args, now) or preset_window('365d', now)
+    except ValueError as e:
+        return cors_enabled_response({'message': str(e)}, 400)
+    # The window's end is exclusive; an open start means the year before the end.
+    last = window.end - timedelta(microseconds=1) if window.end else now
+    first = window.start or last - timedelta(days=365)
+    months = month_range(month_key(first), month_key(last))
+    if len(months) > MAX_TREND_MONTHS:
+        return cors_enabled_response({'message': f'Trends cover at most {MAX_TREND_MONTHS} months.'}, 400)
+
+    try:
+        with span("load_trends", months=len(months)):
+            totals = load_trends(db, months)
         return cors_enabled_response({
-            'total_clients': total_clients,
-            'percent_improved': percent_improved,
-            'percent_clinically_significant': percent_clinically_significant,
-            'percent_not_improving': percent_not_improving,
-            'percent_improved_last_6_months': percent_improved_6m,
-            'percent_clinically_significant_last_6_months': percent_clinically_significant_6m,
-            'percent_not_improving_last_6_months': percent_not_improving_6m,
-            'admin_search_filters': search_filters
+            'window': window.to_dict(),
+            'months': monthly_series(totals, months),
+            'cohorts': cohort_series(totals, months),
         }, 200)
-    
+
     except Exception as e:
-        print(f"Error in /clinician-data: {e}")
-        return cors_enabled_response({'message': 'Failed to fetch clinician data.', 'error': str(e)}, 500)
+        logger.exception("Error in /outcome-trends")
+        return cors_enabled_response({'message': 'Failed to fetch outcome trends.', 'error': str(e)}, 500)
+
+
+@main_bp.route('/question-analytics', methods=['GET'])
+def question_analytics_data():
+    """
+    Per-question outcome analytics (app/question_analytics.py): for each question, the mean
+    change from first to latest session, the responder rate and the correlation with
+    total-score improvement, overall and per clinician.
+
+    Query parameters:
+      - status (optional): "all" (default), "active" or "archived" clients.
+      - threshold (optional): points of improvement on a question that count as a response (default 1).
+    Accessible only by admins. Serves the result stored by the batch job
+    (`python -m app.question_analytics`) while it is recent. Without one, it scans
+    every session. "source" says which: "stored" or "live".
+    """
+    decoded_token, error_response, status_code = validate_token()
+    if error_response:
+        return cors_enabled_response(error_response, status_code)
+
+    if decoded_token.get('role') != 'admin':
+        return cors_enabled_response({'message': 'Unauthorized: Only admins can access question analytics'}, 403)
+    status = request.args.get('status', 'all').strip().lower()
+    if status not in ('all', 'active', 'archived'):
+        return cors_enabled_response({'message': 'Invalid status parameter'}, 400)
+    try:
+        threshold = float(request.args.get('threshold', question_analytics.DEFAULT_THRESHOLD))
+    except ValueError:
+        return cors_enabled_response({'message': 'Invalid threshold parameter'}, 400)
+    if not math.isfinite(threshold):
+        return cors_enabled_response({'message': 'Invalid threshold parameter'}, 400)
+
+    try:
+        data = question_analytics.load_stored(db, status, threshold)
+        if data is not None:
+            data['source'] = 'stored'
+        elif not question_analytics.available():
+            return cors_enabled_response({'message': 'Question analytics are unavailable: NumPy is not installed'}, 503)
+        else:
+            def compute():
+                with span("question_analytics", status=status):
+                    return question_analytics.compute_question_analytics(db, status, threshold)
+
+            data = dict(question_analytics_flight.do((status, threshold), compute), source='live')
+
+        # Names come from the roster, so stored results show current names too. The result may be
+        # shared with other requests through the single-flight cache, so the entries are copied.
+        clinician_names = roster.names()
+        data['clinicians'] = [dict(clinician, name=clinician_names.get(clinician['clinician_id']))
+                              for clinician in data['clinicians']]
+        return cors_enabled_response(data, 200)
+
+    except Exception as e:
+        logger.exception("Error in /question-analytics")
+        return cors_enabled_response({'message': 'Failed to compute question analytics.', 'error': str(e)}, 500)
+
 
 @main_bp.route('/overall-data', methods=['GET'])
 def overall_data():
@@ -1276,8 +1327,10 @@ def overall_data():
       - % of clients clinically significantly improved
       - % of clients improved in the past 6 months
       - % of clients clinically significantly improved in the past 6 months
+    With `window` (30d/90d/182d/365d) or `from`/`to`, also returns the same percentages
+    for improvement within that window (first versus last session inside it) under "window".
     Accessible only by admins.
-    Uses batch read operations to speed up retrieval.
+    Reads each client's score timeline (one get_all) instead of their sessions.
     """
     decoded_token, error_response, status_code = validate_token()
     if error_response:
@@ -1285,134 +1338,67 @@ def overall_data():
     
     if decoded_token.get('role') != "admin":
         return cors_enabled_response({'message': 'Unauthorized: Only admins can access overall data'}, 403)
+
+    try:
+        window = parse_window(request.args)
+    except ValueError as e:
+        return cors_enabled_response({'message': str(e)}, 400)
     
     try:
-        # Query active clients from 'users' collection.
-        active_clients_stream = db.collection('users').where('role', '==', 'client').stream()
-        active_clients = []
-        for client in active_clients_stream:
-            data = client.to_dict()
-            data['user_id'] = client.id
-            data['is_archived'] = False
-            active_clients.append(data)
-        
-        # Query archived clients from 'archived_users' collection.
-        archived_clients_stream = db.collection('archived_users').stream()
-        archived_clients = []
-        for client in archived_clients_stream:
-            data = client.to_dict()
-            data['user_id'] = client.id
-            data['is_archived'] = True
-            archived_clients.append(data)
-        
-        # Combine both lists.
-        clients = active_clients + archived_clients
-        total_clients = len(clients)
-        
-        if total_clients == 0:
-            return cors_enabled_response({
-                'total_clients': 0,
-                'percent_improved': 0,
-                'percent_clinically_significant': 0,
-                'percent_improved_last_6_months': 0,
-                'percent_clinically_significant_last_6_months': 0,
-            }, 200)
-        
-        # Helper function: use batch reads to fetch sessions and, if needed, responses.
-        def calculate_scores_for_client(user_id, is_archived):
-            """
-            Retrieve all sessions for a client from the appropriate collection using batch reads.
-            Returns a tuple of:
-              (initial_score, latest_score, latest_session_timestamp)
-            If fewer than 2 sessions are found, returns (None, None, None).
-            """
-            try:
-                collection = "user_data" if not is_archived else "archived_user_data"
-                sessions_coll = db.collection(collection).document(user_id).collection("sessions")
-                # List all session document references.
-                session_doc_refs = list(sessions_coll.list_documents())
-                if not session_doc_refs:
-                    return None, None, None
-                # Batch read all session documents.
-                sessions = db.get_all(session_doc_refs)
-                session_scores = []
-                for session in sessions:
-                    session_data = session.to_dict()
-                    timestamp = session_data.get("timestamp")
-                    # Try to use precomputed summary_responses first.
-                    responses = session_data.get("summary_responses")
-                    if responses:
-                        try:
-                            # Convert each response value to float.
-                            values = [float(r.get('response_value', 0)) for r in responses]
-                        except Exception as ex:
-                            values = []
-                    else:
-                        # If summary_responses is not available, batch-read the responses subcollection.
-                        responses_coll = sessions_coll.document(session.id).collection("responses")
-                        response_refs = list(responses_coll.list_documents())
-                        responses_docs = db.get_all(response_refs)
-                        values = []
-                        for resp in responses_docs:
-                            r_data = resp.to_dict()
-                            if 'response_value' in r_data:
-                                try:
-                                    values.append(float(r_data.get('response_value')))
-                                except:
-                                    continue
-                    if values:
-                        total_score = sum(values) - 10  # Adjust as per your scaling.
-                        session_scores.append({"timestamp": timestamp, "score": total_score})
-                session_scores.sort(key=lambda x: x["timestamp"])
-                if len(session_scores) < 2:
-                    return None, None, None
-                return session_scores[0]["score"], session_scores[-1]["score"], session_scores[-1]["timestamp"]
-            except Exception as e:
-                print(f"Error fetching scores for {user_id}: {e}")
-                return None, None, None
-
-        def is_clinically_significant(initial, latest):
-            """Determine if a client shows clinically significant improvement."""
-            return initial is not None and initial > 18 and (initial - latest) >= 12
-
-        def is_recent(timestamp):
-            """Check if the timestamp is within the past 6 months."""
-            six_months_ago = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(days=182)
-            return timestamp and timestamp >= six_months_ago
-
-        improved = 0
-        clinically_significant = 0
-        improved_last_6 = 0
-        clinically_significant_last_6 = 0
-
-        for client in clients:
-            initial, latest, last_ts = calculate_scores_for_client(client['user_id'], client['is_archived'])
-            if initial is not None and latest is not None:
+        def compute():
+            # Query active and archived clients in one pass over 'users'.
+            with span("load_clients"):
+                clients = [(client.id, data_collection_for(client)) for client, _ in stream_users(db, 'all', [('role', '==', 'client')])]
+            total_clients = len(clients)
+            with span("load_timelines", clients=total_clients):
+                timelines = load_timelines(db, clients)
+
+            def is_clinically_significant(initial, latest):
+                """Determine if a client shows clinically significant improvement."""
+                return initial is not None and initial > 18 and (initial - latest) >= 12
+
+            recent = recent_window()
+            improved = 0
+            clinically_significant = 0
+            improved_last_6 = 0
+            clinically_significant_last_6 = 0
+
+            for timeline in timelines.values():
+                # Clients need at least 2 scored sessions to compare.
+                if len(timeline) < 2:
+                    continue
+                initial, latest, last_ts = timeline[0]["score"], timeline[-1]["score"], timeline[-1]["timestamp"]
                 if latest < initial:
                     improved += 1
                 if is_clinically_significant(initial, latest):
                     clinically_significant += 1
-                if is_recent(last_ts):
+                if recent.contains(last_ts):
                     if latest < initial:
                         improved_last_6 += 1
                     if is_clinically_significant(initial, latest):
                         clinically_significant_last_6 += 1
 
-        percent_improved = (improved / total_clients) * 100 if total_clients > 0 else 0
-        percent_clinically_significant = (clinically_significant / total_clients) * 100 if total_clients > 0 else 0
-        percent_improved_last_6 = (improved_last_6 / total_clients) * 100 if total_clients > 0 else 0
-        percent_clinically_significant_last_6 = (clinically_significant_last_6 / total_clients) * 100 if total_clients > 0 else 0
+            percent_improved = (improved / total_clients) * 100 if total_clients > 0 else 0
+            percent_clinically_significant = (clinically_significant / total_clients) * 100 if total_clients > 0 else 0
+            percent_improved_last_6 = (improved_last_6 / total_clients) * 100 if total_clients > 0 else 0
+            percent_clinically_significant_last_6 = (clinically_significant_last_6 / total_clients) * 100 if total_clients > 0 else 0
+
+            data = {
+                'total_clients': total_clients,
+                'percent_improved': percent_improved,
+                'percent_clinically_significant': percent_clinically_significant,
+                'percent_improved_last_6_months': percent_improved_last_6,
+                'percent_clinically_significant_last_6_months': percent_clinically_significant_last_6
+            }
+            if window is not None:
+                data['window'] = window_summary(timelines, window, total_clients, min_sessions=2)
+            return (data, 200)
 
-        return cors_enabled_response({
-            'total_clients': total_clients,
-            'percent_improved': percent_improved,
-            'percent_clinically_significant': percent_clinically_significant,
-            'percent_improved_last_6_months': percent_improved_last_6,
-            'percent_clinically_significant_last_6_months': percent_clinically_significant_last_6
-        }, 200)
+        data, status = overall_data_flight.do(window.cache_key() if window else (), compute)
+        return cors_enabled_response(data, status)
 
     except Exception as e:
-        print(f"Error calculating overall data: {e}")
+        logger.exception("Error calculating overall data")
         return cors_enabled_response({'message': 'Error calculating overall data', 'error': str(e)}, 500)
 
     
@@ -1457,25 +1443,26 @@ def logout_all():
     if decoded_token.get('role') != "admin" and decoded_token.get('id') != target_user_id:
         return cors_enabled_response({'message': 'Unauthorized: Cannot log out other users'}, 403)
 
-    # Remove all sessions from active users.
-    sessions_ref = db.collection('users').document(target_user_id).collection('sessions')
-    for session in sessions_ref.stream():
-        session.reference.delete()
+    # Remove all sessions from active users, and from legacy archived users (if any).
+    ops = delete_collection_ops(db.collection('users').document(target_user_id).collection('sessions'))
+    if LEGACY_ARCHIVE_READS:
+        ops += delete_collection_ops(db.collection(LEGACY_USERS_COLLECTION).document(target_user_id).collection('sessions'))
 
-    # Remove all sessions from archived users (if any).
-    archived_sessions_ref = db.collection('archived_users').document(target_user_id).collection('sessions')
-    for session in archived_sessions_ref.stream():
-        session.reference.delete()
+    result = bulk_mutate(db, ops)
+    if result['failed']:
+        return cors_enabled_response({
+            'message': 'Some devices could not be logged out',
+            'failed': result['failed']
+        }, 500)
 
-    return cors_enabled_response({'message': 'Logged out from all devices'}, 200)
+    return cors_enabled_response({'message': 'Logged out from all devices', 'sessions_revoked': len(result['succeeded'])}, 200)
 
 
 @main_bp.route('/archive-client/<user_id>', methods=['POST'])
 def archive_client(user_id):
     """
-    Archive a client by moving their data from active collections (users and user_data)
-    to archived collections (archived_users and archived_user_data). Once moved, the original
-    documents are deleted. This version uses Firestore batch writes to minimize network round-trips.
+    Archive a client by flagging their `users` document with `is_archived` and `archived_at`.
+    Their sessions stay in `user_data`, so the cost does not depend on the client's history.
     Additionally, it forces a logout from all devices by deleting active sessions.
     """
     try:
@@ -1491,90 +1478,18 @@ def archive_client(user_id):
                 403
             )
 
-        # Set up batching.
-        BATCH_LIMIT = 500
-        op_count = 0
-        batch = db.batch()
-
-        def commit_batch_if_needed():
-            nonlocal op_count, batch
-            if op_count >= BATCH_LIMIT:
-                batch.commit()
-                batch = db.batch()
-                op_count = 0
-
-        # --- Force Logout: Delete all sessions from active user's "sessions" subcollection ---
-        sessions_to_delete = list(db.collection("users").document(user_id).collection("sessions").stream())
-        print(f"Deleting {len(sessions_to_delete)} active sessions for user {user_id} to force logout.")
-        for session in sessions_to_delete:
-            batch.delete(session.reference)
-            op_count += 1
-            commit_batch_if_needed()
-
-        # --- Step 1: Archive the client's basic info from "users" to "archived_users" ---
-        client_ref = db.collection("users").document(user_id)
-        client_snapshot = client_ref.get()
-        if not client_snapshot.exists:
+        with span("archive_user", user_id=user_id):
+            user_data = archive_user(db, user_id)
+        if user_data is None:
             return cors_enabled_response({'message': 'Client not found.'}, 404)
-        client_data = client_snapshot.to_dict()
-        archived_user_ref = db.collection("archived_users").document(user_id)
-        batch.set(archived_user_ref, client_data)
-        op_count += 1
-        commit_batch_if_needed()
-        batch.delete(client_ref)
-        op_count += 1
-        commit_batch_if_needed()
-        print(f"Archived client basic info for user {user_id}.")
-
-        # --- Step 2: Archive the client's data from "user_data" to "archived_user_data" ---
-        user_data_ref = db.collection("user_data").document(user_id)
-        archived_user_data_ref = db.collection("archived_user_data").document(user_id)
-        batch.set(archived_user_data_ref, {"archived_at": firestore.SERVER_TIMESTAMP}, merge=True)
-        op_count += 1
-        commit_batch_if_needed()
-
-        # Process the sessions subcollection.
-        sessions = list(user_data_ref.collection("sessions").stream())
-        print(f"Found {len(sessions)} sessions for user {user_id}.")
-        for session in sessions:
-            session_data = session.to_dict()
-            session_id = session.id
-            archived_session_ref = archived_user_data_ref.collection("sessions").document(session_id)
-            batch.set(archived_session_ref, session_data)
-            op_count += 1
-            commit_batch_if_needed()
-
-            # Process each response in the session's "responses" subcollection.
-            responses = list(session.reference.collection("responses").stream())
-            print(f"Session {session_id} has {len(responses)} responses.")
-            for response in responses:
-                response_data = response.to_dict()
-                response_id = response.id
-                batch.set(archived_session_ref.collection("responses").document(response_id), response_data)
-                op_count += 1
-                commit_batch_if_needed()
-                batch.delete(response.reference)
-                op_count += 1
-                commit_batch_if_needed()
-            # Delete the original session document.
-            batch.delete(session.reference)
-            op_count += 1
-            commit_batch_if_needed()
-
-        # Delete the top-level user_data document if it exists.
-        if user_data_ref.get().exists:
-            batch.delete(user_data_ref)
-            op_count += 1
-            commit_batch_if_needed()
-
-        # Commit any remaining operations.
-        if op_count > 0:
-            batch.commit()
+        if not is_archived(user_data):
+            clients_moved(user_data.get('assigned_clinician_id'), -1)
+        logger.info("Archived client", extra={"user_id": user_id})
 
         return cors_enabled_response({'message': 'Client archived successfully.'}, 200)
 
     except Exception as e:
-        print(f"Error archiving client {user_id}: {e}")
+        logger.exception("Error archiving client", extra={"user_id": user_id})
         return cors_enabled_response({'message': 'Error archiving client.', 'error': str(e)}, 500)
 
 
@@ -1582,9 +1497,8 @@ def archive_client(user_id):
 @main_bp.route('/unarchive-client/<user_id>', methods=['POST'])
 def unarchive_client(user_id):
     """
-    Unarchive a client by moving their data from archived collections (archived_users and archived_user_data)
-    back to active collections (users and user_data). Once moved, the archived documents are deleted.
-    This version uses Firestore batch writes to minimize network calls.
+    Unarchive a client by clearing the `is_archived` flag on their `users` document.
+    Clients archived before the flag migration are first folded back from the legacy collections.
     """
     try:
         # Validate token and ensure only clinicians or admins can perform unarchiving.
@@ -1599,91 +1513,16 @@ def unarchive_client(user_id):
                 403
             )
 
-        # Set up batching
-        BATCH_LIMIT = 500
-        op_count = 0
-        batch = db.batch()
-
-        def commit_batch_if_needed():
-            nonlocal op_count, batch
-            if op_count >= BATCH_LIMIT:
-                batch.commit()
-                batch = db.batch()
-                op_count = 0
-
-        # 1. Unarchive the client's basic info: Move from archived_users to users.
-        archived_user_ref = db.collection("archived_users").document(user_id)
-        archived_user_snapshot = archived_user_ref.get()
-        if not archived_user_snapshot.exists:
+        user_data = unarchive_user(db, user_id)
+        if user_data is None:
             return cors_enabled_response({'message': 'Archived client not found.'}, 404)
-
-        client_data = archived_user_snapshot.to_dict()
-        active_user_ref = db.collection("users").document(user_id)
-        batch.set(active_user_ref, client_data)
-        op_count += 1
-        commit_batch_if_needed()
-        batch.delete(archived_user_ref)
-        op_count += 1
-        commit_batch_if_needed()
-        print(f"Unarchived client basic info for user {user_id}.")
-
-        # 2. Unarchive the client's data: Move from archived_user_data to user_data.
-        archived_user_data_ref = db.collection("archived_user_data").document(user_id)
-        archived_user_data_snapshot = archived_user_data_ref.get()
-        active_user_data_ref = db.collection("user_data").document(user_id)
-        
-        if archived_user_data_snapshot.exists:
-            user_data = archived_user_data_snapshot.to_dict()
-            # Copy top-level fields from the archived document to the active document.
-            batch.set(active_user_data_ref, user_data)
-            op_count += 1
-            commit_batch_if_needed()
-            print(f"Copied top-level archived_user_data for user {user_id}.")
-
-            # Process each session in the archived_user_data subcollection.
-            sessions = list(archived_user_data_ref.collection("sessions").stream())
-            print(f"Found {len(sessions)} sessions in archived data for user {user_id}.")
-            for session in sessions:
-                session_data = session.to_dict()
-                session_id = session.id
-                active_session_ref = active_user_data_ref.collection("sessions").document(session_id)
-                batch.set(active_session_ref, session_data)
-                op_count += 1
-                commit_batch_if_needed()
-                print(f"Unarchived session {session_id} for user {user_id}.")
-
-                # Process the responses subcollection under each session.
-                responses = list(session.reference.collection("responses").stream())
-                print(f"Session {session_id} has {len(responses)} responses in archived data.")
-                for response in responses:
-                    response_data = response.to_dict()
-                    response_id = response.id
-                    batch.set(active_session_ref.collection("responses").document(response_id), response_data)
-                    op_count += 1
-                    commit_batch_if_needed()
-                    batch.delete(response.reference)
-                    op_count += 1
-                    commit_batch_if_needed()
-                # Delete the archived session document.
-                batch.delete(session.reference)
-                op_count += 1
-                commit_batch_if_needed()
-
-            # Delete the top-level archived_user_data document.
-            batch.delete(archived_user_data_ref)
-            op_count += 1
-            commit_batch_if_needed()
-            print(f"Deleted archived_user_data for user {user_id}.")
-        else:
-            print(f"No archived user_data found for user {user_id}.")
-
-        if op_count > 0:
-            batch.commit()
+        clients_moved(user_data.get('assigned_clinician_id'), 1)
+        logger.info("Unarchived client", extra={"user_id": user_id})
 
         return cors_enabled_response({'message': 'Client unarchived successfully.'}, 200)
 
     except Exception as e:
-        print(f"Error unarchiving client {user_id}: {e}")
+        logger.exception("Error unarchiving client", extra={"user_id": user_id})
         return cors_enabled_response({'message': 'Error unarchiving client.', 'error': str(e)}, 500)
 
 @main_bp.route('/admin-search-clients', methods=['GET'])
@@ -1703,6 +1542,9 @@ def admin_search_clients():
             "not-improving" - only return clients whose most recent score is equal to or lower than 
                               the lowest score of their first two sessions.
       - time (optional): "all" (default) or "6months" to only include clients whose latest session is within the past 6 months.
+      - window (30d/90d/182d/365d) or from/to (optional): judge the metric on the sessions inside
+        that window only (first versus last session in it); with total_clients, list the clients
+        with at least one session in the window.
     """
     decoded_token, error_response, status_code = validate_token()
     if error_response:
@@ -1716,171 +1558,125 @@ def admin_search_clients():
     query_text = request.args.get('query', '').strip().lower()   # Search query parameter.
     metric = request.args.get('metric', 'total_clients').strip().lower()
     time_filter = request.args.get('time', 'all').strip().lower()
+    if metric not in ("total_clients", "improved", "clinically_significant", "not-improving"):
+        return cors_enabled_response({'message': 'Invalid metric parameter'}, 400)
+    try:
+        window = parse_window(request.args)
+    except ValueError as e:
+        return cors_enabled_response({'message': str(e)}, 400)
+    recent = recent_window()
     
     try:
-        # --- Step 1: Fetch clients based on clinician filter ---
-        active_clients = []
-        archived_clients = []
-        if clinician_id:
-            active_clients_stream = db.collection('users').where('assigned_clinician_id', '==', clinician_id).stream()
-            archived_clients_stream = db.collection('archived_users').where('assigned_clinician_id', '==', clinician_id).stream()
-        else:
+        def compute():
+            # --- Step 1: Fetch clients based on clinician filter ---
             # If clinician_id is blank, get all clients.
-            active_clients_stream = db.collection('users').stream()
-            archived_clients_stream = db.collection('archived_users').stream()
-        
-        for client in active_clients_stream:
-            data = client.to_dict()
-            data['user_id'] = client.id
-            data['is_archived'] = False
-            active_clients.append(data)
-            
-        for client in archived_clients_stream:
-            data = client.to_dict()
-            data['user_id'] = client.id
-            data['is_archived'] = True
-            archived_clients.append(data)
-        
-        # Combine both lists.
-        clients = active_clients + archived_clients
-
-        # --- Step 2: If a search query is provided, filter by client name ---
-        if query_text:
-            filtered_by_query = []
-            for client in clients:
-                first_name = client.get('first_name', '').lower()
-                last_name = client.get('last_name', '').lower()
-                if query_text in first_name or query_text in last_name:
-                    filtered_by_query.append(client)
-            clients = filtered_by_query
-
-        # --- Step 3: Helper Functions to Calculate Scores ---
-
-        def calculate_scores_for_client(user_id, is_archived):
-            """
-            For improvement metrics ("improved" and "clinically_significant"):
-            Fetch sessions for a client from the appropriate parent collection and
-            calculate the score for the earliest and the latest session (using summary_responses).
-            Returns a tuple: (initial_score, latest_score, latest_timestamp) if there are at least 3 sessions;
-            otherwise returns (None, None, None).
-            """
-            collection = "user_data" if not is_archived else "archived_user_data"
-            sessions_ref = db.collection(collection).document(user_id).collection("sessions")
-            sessions = list(sessions_ref.order_by("timestamp", direction=firestore.Query.ASCENDING).stream())
-            if len(sessions) < 3:
-                return None, None, None  # Only consider clients with 3 or more sessions
-            session_scores = []
-            for session in sessions:
-                s_data = session.to_dict()
-                timestamp = s_data.get("timestamp")
-                responses = s_data.get("summary_responses", [])
-                try:
-                    values = [float(r.get("response_value", 0)) for r in responses]
-                except Exception:
-                    values = []
-                if values:
-                    total_score = sum(values) - 10  # Adjust as needed.
-                    session_scores.append({"timestamp": timestamp, "score": total_score})
-            session_scores.sort(key=lambda x: x["timestamp"])
-            if len(session_scores) < 2:
-                return None, None, None
-            return session_scores[0]["score"], session_scores[-1]["score"], session_scores[-1]["timestamp"]
-
-        def calculate_scores_for_not_improving(user_id, is_archived):
-            """
-            For "not-improving": Look at the client's first 2 sessions and take the lowest score.
-            Also, get the latest score (and timestamp) from all sessions.
-            Returns (first_two_lowest, latest_score, latest_timestamp) if there are at least 2 sessions.
-            For improvement metrics, require at least 3 sessions.
-            """
-            collection = "user_data" if not is_archived else "archived_user_data"
-            sessions_ref = db.collection(collection).document(user_id).collection("sessions")
-            sessions = list(sessions_ref.order_by("timestamp", direction=firestore.Query.ASCENDING).stream())
-            if len(sessions) < 3:
-                return None, None, None  # Require at least 3 sessions for improvement metrics.
-            # Calculate first 2 session scores
-            first_two_sessions = sessions[:2]
-            first_two_scores = []
-            for session in first_two_sessions:
-                s_data = session.to_dict()
-                timestamp = s_data.get("timestamp")
-                responses = s_data.get("summary_responses", [])
-                try:
-                    values = [float(r.get("response_value", 0)) for r in responses]
-                except Exception:
-                    values = []
-                if values:
-                    total_score = sum(values) - 10
-                    first_two_scores.append({"timestamp": timestamp, "score": total_score})
-            if len(first_two_scores) < 2:
-                return None, None, None
-            first_two_lowest = min(first_two_scores[0]["score"], first_two_scores[1]["score"])
-            # Calculate latest score from all sessions
-            all_session_scores = []
-            for session in sessions:
-                s_data = session.to_dict()
-                timestamp = s_data.get("timestamp")
-                responses = s_data.get("summary_responses", [])
-                try:
-                    values = [float(r.get("response_value", 0)) for r in responses]
-                except Exception:
-                    values = []
-                if values:
-                    total_score = sum(values) - 10
-                    all_session_scores.append({"timestamp": timestamp, "score": total_score})
-            all_session_scores.sort(key=lambda x: x["timestamp"])
-            if not all_session_scores:
-                return None, None, None
-            latest_score = all_session_scores[-1]["score"]
-            latest_timestamp = all_session_scores[-1]["timestamp"]
-            return first_two_lowest, latest_score, latest_timestamp
-
-        def is_clinically_significant(initial, latest):
-            # Example criteria: initial > 18 and difference >= 12.
-            return initial is not None and initial > 18 and (initial - latest) >= 12
-        
-        def is_recent(timestamp):
-            six_months_ago = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(days=182)
-            return timestamp and timestamp >= six_months_ago
-        
-        # --- Step 4: Filter clients based on metric and time ---
-        filtered_clients = []
-        if metric == "total_clients":
-            # For total_clients, include all clients regardless of session count.
-            filtered_clients = clients
-        else:
+            filters = [('assigned_clinician_id', '==', clinician_id)] if clinician_id else []
+            clients = []
+            data_collections = {}  # user_id -> collection holding that client's sessions
+            with span("load_clients"):
+                for client, archived in stream_users(db, 'all', filters):
+                    data = client.to_dict()
+                    data.pop('password', None)  # never returned, nor kept in the shared result cache
+                    data['user_id'] = client.id
+                    data['is_archived'] = archived
+                    clients.append(data)
+                    data_collections[client.id] = data_collection_for(client)
+
+            # --- Step 2: If a search query is provided, filter by client name ---
+            if query_text:
+                filtered_by_query = []
+                for client in clients:
+                    first_name = client.get('first_name', '').lower()
+                    last_name = client.get('last_name', '').lower()
+                    if query_text in first_name or query_text in last_name:
+                        filtered_by_query.append(client)
+                clients = filtered_by_query
+
+            # --- Step 3: Load the clients' score timelines (one get_all, no session reads) ---
+            timelines = {}
+            if metric != "total_clients" or window is not None:
+                scored = [(c['user_id'], data_collections[c['user_id']]) for c in clients if c.get('role') == 'client']
+                with span("load_timelines", clients=len(scored)):
+                    timelines = load_timelines(db, scored)
+
+            def scores(user_id):
+                """
+                (initial, lowest of the first two, latest, latest timestamp) over the client's
+                sessions inside the window (all sessions without one), or None with fewer than 3.
+                """
+                timeline = timelines.get(user_id, [])
+                if window is not None:
+                    timeline = entries_in(timeline, window)
+                if len(timeline) < 3:
+                    return None  # Only consider clients with 3 or more sessions
+                return (timeline[0]["score"], min(timeline[0]["score"], timeline[1]["score"]),
+                        timeline[-1]["score"], timeline[-1]["timestamp"])
+
+            # --- Step 4: Filter clients based on metric and time ---
+            filtered_clients = []
             for client in clients:
+                if metric == "total_clients":
+                    # Without a window, include all clients regardless of session count.
+                    if window is None or entries_in(timelines.get(client['user_id'], []), window):
+                        filtered_clients.append(client)
+                    continue
+                with span("score_client", user_id=client['user_id']):
+                    client_scores = scores(client['user_id'])
+                if client_scores is None:
+                    continue
+                initial, first_two_lowest, latest, last_ts = client_scores
+                if time_filter == "6months" and not recent.contains(last_ts):
+                    continue
                 if metric == "not-improving":
-                    first_two_lowest, latest, last_ts = calculate_scores_for_not_improving(client['user_id'], client['is_archived'])
-                    if first_two_lowest is None or latest is None:
-                        continue
-                    # For "not-improving": if the latest score is equal to or lower than the lowest of the first two sessions.
+                    # The latest score is equal to or lower than the lowest of the first two sessions.
                     if latest <= first_two_lowest:
                         client['improvement'] = first_two_lowest - latest
                         filtered_clients.append(client)
-                else:
-                    initial, latest, last_ts = calculate_scores_for_client(client['user_id'], client['is_archived'])
-                    if initial is None or latest is None:
-                        # For total_clients, include client even if insufficient sessions.
-                        if metric == "total_clients":
-                            filtered_clients.append(client)
-                        continue
-                    if time_filter == "6months" and not is_recent(last_ts):
-                        continue
-                    if metric == "improved":
-                        if latest < initial:
-                            client['improvement'] = initial - latest
-                            filtered_clients.append(client)
-                    elif metric == "clinically_significant":
-                        if is_clinically_significant(initial, latest):
-                            client['improvement'] = initial - latest
-                            filtered_clients.append(client)
-                    else:
-                        return cors_enabled_response({'message': 'Invalid metric parameter'}, 400)
-        
-        return cors_enabled_response({'clients': filtered_clients}, 200)
-    
+                elif metric == "improved":
+                    if latest < initial:
+                        client['improvement'] = initial - latest
+                        filtered_clients.append(client)
+                elif is_clinically_significant(initial, latest):
+                    client['improvement'] = initial - latest
+                    filtered_clients.append(client)
+
+            # Clinician names come from the roster rather than a read per clinician.
+            clinician_names = roster.names()
+            for client in filtered_clients:
+                client['assigned_clinician_name'] = clinician_names.get(client.get('assigned_clinician_id'))
+            return ({'clients': filtered_clients}, 200)
+
+        flight_key = (clinician_id, query_text, metric, time_filter, window.cache_key() if window else None)
+        data, status = admin_search_clients_flight.do(flight_key, compute)
+        return cors_enabled_response(data, status)
+
     except Exception as e:
-        print(f"Error in /admin-search-clients: {e}")
+        logger.exception("Error in /admin-search-clients")
         return cors_enabled_response({'message': 'Error retrieving clients', 'error': str(e)}, 500)
 
+
+@main_bp.route('/admin/profiles', methods=['GET'])
+def list_request_profiles():
+    """List captured request profiles, newest first (admins only)."""
+    decoded_token, error_response, status_code = validate_token()
+    if error_response:
+        return error_response
+    if decoded_token.get('role') != 'admin':
+        return cors_enabled_response({'message': 'Unauthorized: Admins only.'}, 403)
+
+    return cors_enabled_response({'enabled': profiling_enabled(), 'profiles': list_profiles()}, 200)
+
+
+@main_bp.route('/admin/profiles/<name>', methods=['GET'])
+def get_request_profile(name):
+    """Return one captured request profile (admins only)."""
+    decoded_token, error_response, status_code = validate_token()
+    if error_response:
+        return error_response
+    if decoded_token.get('role') != 'admin':
+        return cors_enabled_response({'message': 'Unauthorized: Admins only.'}, 403)
+
+    profile = load_profile(name)
+    if profile is None:
+        return cors_enabled_response({'message': 'Profile not found.'}, 404)
+    return cors_enabled_response(profile, 200)
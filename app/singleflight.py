@@ -0,0 +1,182 @@
+"""
+Single-flight execution with a short-lived result cache.
+
+``SingleFlight(name).do(key, compute)`` runs ``compute()`` at most once at a
+time per key: concurrent callers with the same key wait for the running
+computation and get its result. The result is kept for
+``SINGLEFLIGHT_TTL_SECONDS`` (default 30), so reloads within that window are
+answered from the cache.
+
+Gunicorn's sync workers are separate processes, so coalescing works at two
+levels: threads of one process wait on an Event, and processes on the host
+wait on an ``flock`` per key in ``SINGLEFLIGHT_DIR`` (default
+/tmp/headway-singleflight). The process that gets the lock computes and
+writes the result next to it as JSON; the others find it when they get the
+lock in turn. The directories are created 0700 and used only while they are
+private to this user (app/private_dir.py); otherwise processes do not
+coalesce. Results that JSON cannot hold (beyond datetimes) are only cached
+in-process. A waiter gives up after ``SINGLEFLIGHT_WAIT_SECONDS`` (default 120) and
+computes on its own. A computation that raises is not cached, and the next
+caller retries it.
+
+Cached results are only shared between callers of the same key, so keys must
+include everything the result depends on, and callers must check
+authorisation before calling `do`. Hits and misses are exported through
+``metrics.record_cache`` as ``singleflight:<name>``.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from .metrics import record_cache
+from .private_dir import open_private, private_directory
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_TTL_SECONDS = float(os.getenv("SINGLEFLIGHT_TTL_SECONDS", "30"))
+SINGLEFLIGHT_WAIT_SECONDS = float(os.getenv("SINGLEFLIGHT_WAIT_SECONDS", "120"))
+SINGLEFLIGHT_DIR = os.getenv("SINGLEFLIGHT_DIR", "/tmp/headway-singleflight")
+
+POLL_INTERVAL = 0.02
+DATETIME_TAG = "$datetime"
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {DATETIME_TAG: value.isoformat()}
+    raise TypeError(f"{type(value).__name__} is not JSON serialisable")
+
+
+def _decode(obj):
+    if len(obj) == 1 and DATETIME_TAG in obj:
+        return datetime.fromisoformat(obj[DATETIME_TAG])
+    return obj
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name, ttl=None, directory=None):
+        self.name = name
+        self.ttl = SINGLEFLIGHT_TTL_SECONDS if ttl is None else ttl
+        self.directory = os.path.join(directory or SINGLEFLIGHT_DIR, name)
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call in progress in this process
+        self._results = {}  # key -> (stored_at, result)
+
+    def do(self, key, compute):
+        """Return compute()'s result for `key`, sharing it with concurrent and recent callers."""
+        if self.ttl <= 0:
+            return compute()
+
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and time.time() - cached[0] < self.ttl:
+                record_cache(f"singleflight:{self.name}", True)
+                return cached[1]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            record_cache(f"singleflight:{self.name}", True)
+            if call.done.wait(SINGLEFLIGHT_WAIT_SECONDS):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            return compute()
+
+        try:
+            call.result = self._shared(key, compute)
+            with self._lock:
+                self._results[key] = (time.time(), call.result)
+                self._prune()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _prune(self):
+        now = time.time()
+        for key in [k for k, (stored_at, _) in self._results.items() if now - stored_at >= self.ttl]:
+            del self._results[key]
+
+    def _shared(self, key, compute):
+        """Coalesce with other processes: one computes while holding the key's lock, the rest read its result."""
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        result_path = os.path.join(self.directory, f"{digest}.json")
+        try:
+            if not private_directory(self.directory):
+                logger.warning("Single-flight directory is not private; computing without coalescing",
+                               extra={"directory": self.directory})
+                record_cache(f"singleflight:{self.name}", False)
+                return compute()
+            fd = open_private(os.path.join(self.directory, f"{digest}.lock"), os.O_RDWR | os.O_CREAT)
+        except OSError:
+            logger.exception("Single-flight directory unavailable; computing without coalescing")
+            record_cache(f"singleflight:{self.name}", False)
+            return compute()
+
+        try:
+            locked = self._lock_file(fd)
+            result = self._read_fresh(result_path)
+            if result is not None:
+                record_cache(f"singleflight:{self.name}", True)
+                return result[0]
+
+            record_cache(f"singleflight:{self.name}", False)
+            value = compute()
+            if locked:
+                self._write(result_path, value)
+            return value
+        finally:
+            os.close(fd)  # also releases the lock
+
+    def _lock_file(self, fd):
+        deadline = time.monotonic() + SINGLEFLIGHT_WAIT_SECONDS
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(POLL_INTERVAL)
+
+    def _write(self, path, value):
+        try:
+            body = json.dumps({"stored_at": time.time(), "value": value}, default=_encode)
+        except (TypeError, ValueError):
+            logger.debug("Single-flight result is not JSON serialisable; not sharing it", extra={"flight": self.name})
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = open_private(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def _read_fresh(self, path):
+        try:
+            with open(open_private(path, os.O_RDONLY), encoding="utf-8") as f:
+                stored = json.load(f, object_hook=_decode)
+            stored_at, value = stored["stored_at"], stored["value"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if time.time() - stored_at >= self.ttl:
+            return None
+        return (value,)
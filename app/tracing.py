@@ -0,0 +1,272 @@
+"""
+Request tracing in the Zipkin v2 span format.
+
+A traced request gets a root SERVER span; code inside it opens child spans
+with ``span(name, **tags)`` or the ``@traced()`` decorator, and every
+Firestore RPC becomes a CLIENT span (fed by app/instrumentation.py) under
+whichever span was open when it was issued. Bulk-write worker threads run in
+a copy of the request's context, so their batch commits nest under the span
+that started them and show whether they were on the critical path.
+
+``TRACE_SAMPLE_RATE`` (default 0 = off) is the fraction of requests traced.
+Requests carrying B3 headers (``X-B3-TraceId`` / ``X-B3-SpanId`` /
+``X-B3-Sampled``) join the caller's trace and follow its sampling decision;
+traced responses carry ``X-B3-TraceId``.
+
+Finished traces are exported by a background thread, either as one JSON
+array of spans per line to ``TRACE_FILE`` (default
+/tmp/headway-traces.jsonl; each line is a valid Zipkin ``POST /api/v2/spans``
+body) or, with ``TRACE_ZIPKIN_URL`` set, straight to a Zipkin-compatible
+collector (Zipkin, Jaeger, Tempo). ``TRACE_MAX_SPANS`` caps the spans kept per
+trace; the root span records how many were dropped.
+
+Outside a traced request ``span()`` returns a shared no-op, so instrumented
+code paths cost one ContextVar lookup when tracing is off.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+from .instrumentation import add_operation_observer
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "/tmp/headway-traces.jsonl")
+TRACE_ZIPKIN_URL = os.getenv("TRACE_ZIPKIN_URL", "").strip()
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "headway-backend")
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "5000"))
+
+TRACE_HEADER = "X-B3-TraceId"
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+def tracing_enabled():
+    return TRACE_SAMPLE_RATE > 0
+
+
+def _new_id(bits=64):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or _new_id(128)
+        self.spans = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, span, force=False):
+        with self._lock:
+            if force or len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "remote", "tags", "timestamp", "duration",
+                 "_started", "_token")
+
+    def __init__(self, trace, name, parent_id=None, kind=None, remote=None, tags=None):
+        self.trace = trace
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.remote = remote
+        self.tags = {k: str(v) for k, v in (tags or {}).items()}
+        self.timestamp = None
+        self.duration = None
+
+    def tag(self, key, value):
+        self.tags[key] = str(value)
+
+    def start(self):
+        self.timestamp = int(time.time() * 1_000_000)
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def finish(self, exc=None):
+        self.duration = max(1, int((time.perf_counter() - self._started) * 1_000_000))
+        if exc is not None:
+            self.tags["error"] = repr(exc)
+        _current.reset(self._token)
+        self.trace.add(self, force=self.kind == "SERVER")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc)
+        return False
+
+    def to_zipkin(self):
+        entry = {
+            "traceId": self.trace.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+            "localEndpoint": {"serviceName": TRACE_SERVICE_NAME},
+        }
+        if self.parent_id:
+            entry["parentId"] = self.parent_id
+        if self.kind:
+            entry["kind"] = self.kind
+        if self.remote:
+            entry["remoteEndpoint"] = {"serviceName": self.remote}
+        if self.tags:
+            entry["tags"] = self.tags
+        return entry
+
+
+class _NoopSpan:
+    def tag(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def current_span():
+    return _current.get()
+
+
+def span(name, **tags):
+    """Child span of the current span; a no-op outside a traced request."""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(parent.trace, name, parent.span_id, tags=tags)
+
+
+def traced(name=None):
+    """Decorator: run the function inside `span(name or function name)`."""
+    def decorate(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _observe_firestore(operation, started_at, duration):
+    parent = _current.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, f"firestore {operation}", parent.span_id, kind="CLIENT", remote="firestore")
+    child.timestamp = int(started_at * 1_000_000)
+    child.duration = max(1, int(duration * 1_000_000))
+    parent.trace.add(child)
+
+
+class _Exporter:
+    """Ships finished traces from a background thread so requests never wait on I/O."""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=1000)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, spans):
+        with self._lock:
+            # A thread started before a fork does not exist in the child
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            logger.warning("Trace export queue full; dropping trace")
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                body = json.dumps(spans, separators=(",", ":"))
+                if TRACE_ZIPKIN_URL:
+                    req = urllib.request.Request(
+                        TRACE_ZIPKIN_URL, data=body.encode("utf-8"), headers={"Content-Type": "application/json"})
+                    urllib.request.urlopen(req, timeout=5).close()
+                else:
+                    # One write per trace on an O_APPEND descriptor, so workers sharing the file do not interleave
+                    fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                    try:
+                        os.write(fd, (body + "\n").encode("utf-8"))
+                    finally:
+                        os.close(fd)
+            except Exception:
+                logger.exception("Trace export failed")
+
+
+_exporter = _Exporter()
+
+
+def init_app(app):
+    """Trace a TRACE_SAMPLE_RATE fraction of `app`'s requests; a no-op when it is 0."""
+    if not tracing_enabled():
+        return
+
+    from flask import g, request
+
+    add_operation_observer(_observe_firestore)
+
+    @app.before_request
+    def _start_trace():
+        trace_id = request.headers.get(TRACE_HEADER)
+        sampled = request.headers.get("X-B3-Sampled")
+        if trace_id:
+            if sampled == "0" or (sampled is None and random.random() >= TRACE_SAMPLE_RATE):
+                return
+        elif random.random() >= TRACE_SAMPLE_RATE:
+            return
+        rule = request.url_rule
+        root = Span(
+            Trace(trace_id),
+            f"{request.method} {rule.rule if rule is not None else '<unmatched>'}",
+            parent_id=request.headers.get("X-B3-SpanId") if trace_id else None,
+            kind="SERVER",
+            tags={"http.method": request.method, "http.path": request.path},
+        )
+        g.trace_root = root.start()
+
+    @app.after_request
+    def _trace_header(response):
+        root = g.get("trace_root")
+        if root is not None:
+            root.tag("http.status_code", response.status_code)
+            response.headers[TRACE_HEADER] = root.trace.trace_id
+        return response
+
+    @app.teardown_request
+    def _finish_trace(exc):
+        root = g.pop("trace_root", None)
+        if root is None:
+            return
+        root.finish(exc)
+        if root.trace.dropped:
+            root.tag("dropped_spans", root.trace.dropped)
+        _exporter.submit([s.to_zipkin() for s in root.trace.spans])
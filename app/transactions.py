@@ -0,0 +1,18 @@
+"""
+Helper for running a function inside a Firestore transaction.
+
+The function receives the transaction as its first argument and must do all of
+its reads (``ref.get(transaction=transaction)`` /
+``query.stream(transaction=transaction)``) before queuing any writes on it.
+Firestore retries the function if the commit hits contention.
+"""
+from .datastore import is_memory_client, resolve
+
+
+def run_transaction(db, fn, *args, **kwargs):
+    """Run `fn(transaction, *args, **kwargs)` in a new transaction and return its result."""
+    db = resolve(db)
+    if is_memory_client(db):
+        return db.run_transaction(fn, *args, **kwargs)
+    from google.cloud import firestore
+    return firestore.transactional(fn)(db.transaction(), *args, **kwargs)
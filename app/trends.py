@@ -0,0 +1,196 @@
+"""
+Monthly outcome trends.
+
+``trend_rollups/{year}-{shard}`` documents hold running totals per calendar
+month (UTC) of that year:
+
+    {"months":  {"2024-03": {"sessions": 41, "score_sum": 512.0, "score_sq_sum": 7301.0}},
+     "cohorts": {"2024-03": {"clients": 9, "evaluated": 6, "improved": 4,
+                             "clinically_significant": 1, "not_improving": 2}}}
+
+``months`` totals the scored sessions held in each month, so the mean score
+and its spread come straight from the sums. ``cohorts`` counts clients by
+intake month (the month of their first scored session) and, for those with 3
+or more sessions (``evaluated``), their outcome from first to latest session,
+as in app/rollups.py. Active and archived clients are both counted.
+
+Whenever a client's timeline changes, the difference between their old and
+new contribution is written as Increment transforms in the same commit
+(``queue_trend_delta``), so updates read nothing. Removing a client
+subtracts their contribution in the transaction that deletes them. A client
+always lands in the same one of ``TREND_SHARDS`` documents per year (default
+4), which spreads writes from concurrent check-ins over several documents; a
+trend query reads years x shards documents.
+
+The totals are rebuilt from the stored timelines with
+
+    python -m app.trends
+
+which import_checkins also runs after rebuilding timelines.
+"""
+import math
+import os
+import zlib
+from datetime import timezone
+
+from .archive import data_collection_for, stream_users
+from .bulk_writes import bulk_mutate, delete_op, set_op
+from .client_timeline import load_timelines
+from .datastore import Increment
+from .rollups import MIN_SESSIONS, outcomes
+
+TRENDS_COLLECTION = "trend_rollups"
+TREND_SHARDS = max(1, int(os.getenv("TREND_SHARDS", "4")))
+
+MONTH_FIELDS = ("sessions", "score_sum", "score_sq_sum")
+COHORT_FIELDS = ("clients", "evaluated", "improved", "clinically_significant", "not_improving")
+
+
+def month_key(timestamp):
+    """"YYYY-MM" of a timestamp, in UTC (naive timestamps are taken as UTC)."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return f"{timestamp.year:04d}-{timestamp.month:02d}"
+
+
+def shard_for(user_id):
+    return zlib.crc32(user_id.encode("utf-8")) % TREND_SHARDS
+
+
+def trend_ref(db, year, shard):
+    return db.collection(TRENDS_COLLECTION).document(f"{year}-{shard}")
+
+
+def contribution(timeline):
+    """{(section, month): {field: value}} that a client's timeline adds to the trends."""
+    totals = {}
+    for entry in timeline:
+        month = totals.setdefault(("months", month_key(entry["timestamp"])), dict.fromkeys(MONTH_FIELDS, 0))
+        month["sessions"] += 1
+        month["score_sum"] += entry["score"]
+        month["score_sq_sum"] += entry["score"] ** 2
+    if timeline:
+        cohort = totals[("cohorts", month_key(timeline[0]["timestamp"]))] = {"clients": 1}
+        if len(timeline) >= MIN_SESSIONS:
+            cohort["evaluated"] = 1
+            first_two_lowest = min(timeline[0]["score"], timeline[1]["score"])
+            for count_key, hit in outcomes(timeline[0]["score"], first_two_lowest, timeline[-1]["score"]):
+                cohort[count_key] = int(hit)
+    return totals
+
+
+def add_contribution(totals, user_id, timeline, sign=1):
+    """
+    Add a client's contribution (sign=-1: remove it) to `totals`, which maps
+    (year, shard) to {section: {month: {field: value}}}, the trend documents' layout.
+    """
+    shard = shard_for(user_id)
+    for (section, month), values in contribution(timeline).items():
+        target = totals.setdefault((month[:4], shard), {}).setdefault(section, {}).setdefault(month, {})
+        for field, value in values.items():
+            target[field] = target.get(field, 0) + sign * value
+
+
+def increment_fields(doc):
+    """Fields to merge into a trend document to add `doc`'s totals (None if they are all zero)."""
+    fields = {}
+    for section, months in doc.items():
+        for month, values in months.items():
+            increments = {field: Increment(value) for field, value in values.items() if value}
+            if increments:
+                fields.setdefault(section, {})[month] = increments
+    return fields or None
+
+
+def _delta_fields(user_id, old_timeline, new_timeline):
+    """(year, shard, fields to merge) for each trend document a client's timeline change touches."""
+    totals = {}
+    add_contribution(totals, user_id, new_timeline)
+    add_contribution(totals, user_id, old_timeline, sign=-1)
+    for (year, shard), doc in totals.items():
+        fields = increment_fields(doc)
+        if fields:
+            yield year, shard, fields
+
+
+def queue_trend_delta(writer, db, user_id, old_timeline, new_timeline):
+    """Queue the trend updates for a client's timeline change on `writer` (a transaction or batch)."""
+    for year, shard, fields in _delta_fields(user_id, old_timeline, new_timeline):
+        writer.set(trend_ref(db, year, shard), fields, merge=True)
+
+
+def rebuild_trends(db):
+    """Recompute every trend document from the clients' timelines. Returns the number of documents written."""
+    clients = [(client.id, data_collection_for(client)) for client, _ in stream_users(db, 'all', [('role', '==', 'client')])]
+    totals = {}
+    for user_id, timeline in load_timelines(db, clients).items():
+        add_contribution(totals, user_id, timeline)
+    ops = [set_op(trend_ref(db, year, shard), doc) for (year, shard), doc in totals.items()]
+    current = {trend_ref(db, year, shard).id for year, shard in totals}
+    ops += [delete_op(ref) for ref in db.collection(TRENDS_COLLECTION).list_documents() if ref.id not in current]
+    bulk_mutate(db, ops)
+    return len(totals)
+
+
+def month_range(first, last):
+    """Every "YYYY-MM" from `first` to `last` inclusive."""
+    year, month = int(first[:4]), int(first[5:])
+    months = []
+    while f"{year:04d}-{month:02d}" <= last:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def load_trends(db, months):
+    """{"months": {month: totals}, "cohorts": {month: totals}} for `months`, summed over the shards in one get_all."""
+    years = sorted({month[:4] for month in months})
+    refs = [trend_ref(db, year, shard) for year in years for shard in range(TREND_SHARDS)]
+    wanted = set(months)
+    totals = {"months": {}, "cohorts": {}}
+    if not refs:
+        return totals
+    for snap in db.get_all(refs):
+        data = snap.to_dict() if snap.exists else None
+        for section, target in totals.items():
+            for month, values in (data or {}).get(section, {}).items():
+                if month in wanted:
+                    summed = target.setdefault(month, {})
+                    for field, value in values.items():
+                        summed[field] = summed.get(field, 0) + value
+    return totals
+
+
+def monthly_series(totals, months):
+    """Per-month session counts with mean score and (population) standard deviation."""
+    series = []
+    for month in months:
+        values = totals["months"].get(month, {})
+        sessions = values.get("sessions", 0)
+        row = {"month": month, "sessions": sessions, "mean_score": None, "score_stddev": None}
+        if sessions > 0:
+            mean = values.get("score_sum", 0) / sessions
+            variance = values.get("score_sq_sum", 0) / sessions - mean ** 2
+            row.update(mean_score=mean, score_stddev=math.sqrt(max(variance, 0.0)))
+        series.append(row)
+    return series
+
+
+def cohort_series(totals, months):
+    """Per intake month: clients, and outcome counts with percentages of the evaluated clients."""
+    series = []
+    for month in months:
+        values = totals["cohorts"].get(month, {})
+        row = {"month": month}
+        row.update({field: values.get(field, 0) for field in COHORT_FIELDS})
+        for count_key in ("improved", "clinically_significant", "not_improving"):
+            row[f"percent_{count_key}"] = (row[count_key] / row["evaluated"]) * 100 if row["evaluated"] else 0
+        series.append(row)
+    return series
+
+
+if __name__ == "__main__":
+    from app import db
+
+    written = rebuild_trends(db)
+    print(f"Rebuilt {written} trend documents")
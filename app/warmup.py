@@ -0,0 +1,71 @@
+"""
+Startup timing and worker warm-up.
+
+Modules register warm-up steps with ``@register_warmup("name")``; the steps
+run once per worker before it accepts traffic (gunicorn's post_worker_init
+hook in gunicorn.conf.py, or run.py for the development server). A failing
+step is logged and skipped, so a slow or unavailable dependency delays the
+first request instead of taking the worker down. ``WARMUP_ENABLED=false``
+skips them.
+
+Phases timed with ``timed(phase)`` (package import, app creation, client
+construction, each warm-up step) are logged together in one "Startup timings"
+line once warm-up finishes.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+
+_steps = []  # (name, fn)
+_timings = {}  # phase -> milliseconds
+_warmed = False
+_warm_lock = threading.Lock()
+
+
+def record_timing(phase, seconds):
+    _timings[phase] = round(seconds * 1000, 1)
+
+
+@contextmanager
+def timed(phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - started)
+
+
+def startup_timings():
+    return dict(_timings)
+
+
+def register_warmup(name):
+    """Decorator: run `fn()` during worker warm-up, in registration order."""
+    def decorate(fn):
+        _steps.append((name, fn))
+        return fn
+    return decorate
+
+
+def run_warmups():
+    """Run every registered warm-up step once per process and log the startup timings."""
+    global _warmed
+    with _warm_lock:
+        if _warmed:
+            return startup_timings()
+        if WARMUP_ENABLED:
+            for name, fn in _steps:
+                try:
+                    with timed(f"warmup.{name}"):
+                        fn()
+                except Exception:
+                    logger.exception("Warm-up step failed", extra={"step": name})
+        _warmed = True
+    logger.info("Startup timings", extra={"pid": os.getpid(), "timings_ms": startup_timings()})
+    return startup_timings()
@@ -0,0 +1,118 @@
+"""
+Time windows for the analytics endpoints.
+
+A window is picked with query parameters:
+
+* ``window`` - a preset: ``30d``, ``90d``, ``182d`` or ``365d`` (a bare number
+  of days such as ``90`` also works, and ``6months`` is ``182d``)
+* ``from`` / ``to`` - ISO 8601 dates or date-times; either may be left out.
+  A date-only ``to`` includes that whole day. Naive values are taken as UTC.
+
+Presets end now and are resolved once per request, so every client is judged
+against the same boundaries. Client timelines are sorted by timestamp (see
+app/client_timeline.py), so ``entries_in`` finds a window's sessions by
+binary search instead of scanning the timeline.
+"""
+from datetime import datetime, time, timedelta, timezone
+
+PRESET_DAYS = {"30d": 30, "90d": 90, "182d": 182, "365d": 365}
+PRESET_ALIASES = {"6months": "182d"}
+# The "last 6 months" figures the endpoints have always reported.
+RECENT_PRESET = "182d"
+
+
+class TimeWindow:
+    """Half-open interval [start, end) of session timestamps; None means unbounded."""
+
+    __slots__ = ("start", "end", "label")
+
+    def __init__(self, start=None, end=None, label="custom"):
+        self.start = start
+        self.end = end
+        self.label = label
+
+    def contains(self, timestamp):
+        if timestamp is None:
+            return False
+        return (self.start is None or timestamp >= self.start) and (self.end is None or timestamp < self.end)
+
+    def cache_key(self):
+        # Presets move with the clock; results cached for a few seconds can share them.
+        return (self.label,) if self.label in PRESET_DAYS else (self.label, self.start, self.end)
+
+    def to_dict(self):
+        return {
+            "label": self.label,
+            "from": self.start.isoformat() if self.start else None,
+            "to": self.end.isoformat() if self.end else None,
+        }
+
+
+def preset_window(name, now=None):
+    """The window covering the last `name` (e.g. "90d") up to `now`."""
+    name = PRESET_ALIASES.get(name, name)
+    if name.isdigit():
+        name = f"{name}d"
+    if name not in PRESET_DAYS:
+        raise ValueError(f"Unknown window {name!r}; use one of {', '.join(PRESET_DAYS)} or from/to dates.")
+    now = now or datetime.now(timezone.utc)
+    return TimeWindow(now - timedelta(days=PRESET_DAYS[name]), None, name)
+
+
+def recent_window(now=None):
+    """The 6-month window behind the *_last_6_months metrics."""
+    return preset_window(RECENT_PRESET, now)
+
+
+def _parse_bound(value, end_of_day):
+    value = value.strip()
+    if len(value) == 10:  # YYYY-MM-DD
+        day = datetime.strptime(value, "%Y-%m-%d").date()
+        if end_of_day:
+            day += timedelta(days=1)
+        return datetime.combine(day, time.min, tzinfo=timezone.utc)
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_window(args, now=None):
+    """
+    The window selected by request args (`window`, or `from`/`to`), or None if
+    none is given. Raises ValueError with a message for the client on bad input.
+    """
+    preset = (args.get("window") or "").strip().lower()
+    start_arg = (args.get("from") or "").strip()
+    end_arg = (args.get("to") or "").strip()
+    if preset:
+        if start_arg or end_arg:
+            raise ValueError("Use either window or from/to, not both.")
+        return preset_window(preset, now)
+    if not start_arg and not end_arg:
+        return None
+    try:
+        start = _parse_bound(start_arg, end_of_day=False) if start_arg else None
+        end = _parse_bound(end_arg, end_of_day=True) if end_arg else None
+    except ValueError:
+        raise ValueError('"from" and "to" must be ISO 8601 dates or date-times.')
+    if start and end and start >= end:
+        raise ValueError('"from" must be before "to".')
+    return TimeWindow(start, end)
+
+
+def _bisect_left(timeline, timestamp):
+    """Index of the first entry at or after `timestamp` (timeline sorted by timestamp)."""
+    lo, hi = 0, len(timeline)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if timeline[mid]["timestamp"] < timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def entries_in(timeline, window):
+    """The entries of a sorted timeline that fall inside `window`."""
+    lo = 0 if window.start is None else _bisect_left(timeline, window.start)
+    hi = len(timeline) if window.end is None else _bisect_left(timeline, window.end)
+    return timeline[lo:hi]
@@ -0,0 +1,58 @@
+"""
+Firestore operation budgets per endpoint.
+
+Each budget maps the dataset's shape to the most reads, writes and RPCs one
+call may cost. They describe the current access patterns; a change that makes
+an endpoint read per session instead of per client, or adds a round trip per
+client, fails the benchmark run. Tighten them when an endpoint gets cheaper.
+
+Dataset fields (see benchmarks.run.dataset_shape):
+  users, clients, sessions            - whole dataset
+  clinicians                          - clinicians and admins
+  clinician_clients                   - clients of the benchmark clinician (any status)
+  clinician_active_clients / _sessions - their active clients and those clients' sessions
+  client_sessions                     - sessions of the benchmark client
+  questions                           - answers per check-in
+"""
+from app.instrumentation import OperationBudgetExceeded, assert_budget
+from app.trends import TREND_SHARDS
+
+BUDGETS = {
+    # token check + users query + legacy query + one get_all of every client's timeline
+    "overall-data": lambda d: {"rpcs": 4, "reads": 2 + 2 * d["clients"], "writes": 0},
+    "overall-data:window-90d": lambda d: {"rpcs": 4, "reads": 2 + 2 * d["clients"], "writes": 0},
+    # token check + the clinician's rollup
+    "clinician-data": lambda d: {"rpcs": 2, "reads": 2, "writes": 0},
+    # token check + one get_all of every clinician's rollup (names come from the in-memory roster)
+    "clinician-comparison": lambda d: {"rpcs": 2, "reads": 1 + d["clinicians"], "writes": 0},
+    # token check + one get_all of the trend documents for the (at most two) years in the default 365 days
+    "outcome-trends": lambda d: {"rpcs": 2, "reads": 1 + 2 * TREND_SHARDS, "writes": 0},
+    # token check + stored result lookup (none in the benchmark) + users query + legacy query
+    # + one collection-group query over the sessions
+    "question-analytics": lambda d: {"rpcs": 5, "reads": 4 + d["clients"] + d["sessions"], "writes": 0},
+    "admin-search-clients": lambda d: {"rpcs": 3, "reads": 2 + d["users"], "writes": 0},
+    # ... plus one get_all of the clients' timelines for metric filters
+    "admin-search-clients:improved-6months": lambda d: {"rpcs": 4, "reads": 2 + 2 * d["users"], "writes": 0},
+    "search-users": lambda d: {"rpcs": 3, "reads": 2 + d["users"], "writes": 0},
+    "search-clients": lambda d: {"rpcs": 2, "reads": 1 + max(d["clinician_clients"], 1), "writes": 0},
+    "search-all-clients": lambda d: {"rpcs": 3, "reads": 2 + d["clients"], "writes": 0},
+    "past-responses": lambda d: {"rpcs": 4, "reads": 4 + d["client_sessions"], "writes": 0},
+    # token check + archive check + transaction (begin, get_all, commit): session, answers, timeline,
+    # clinician rollup and up to two trend documents (session month, intake month) in one commit
+    "submit-responses": lambda d: {"rpcs": 5, "reads": 4, "writes": 5 + d["questions"]},
+}
+
+
+def check_budgets(results, dataset):
+    """Return a list of budget violations for `results` ({endpoint: {reads, writes, round_trips}})."""
+    violations = []
+    for endpoint, result in results.items():
+        budget = BUDGETS.get(endpoint)
+        if budget is None:
+            continue
+        counts = {"reads": result["reads"], "writes": result["writes"], "rpcs": result["round_trips"]}
+        try:
+            assert_budget(counts, endpoint, **budget(dataset))
+        except OperationBudgetExceeded as e:
+            violations.append(str(e))
+    return violations
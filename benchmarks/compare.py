@@ -0,0 +1,73 @@
+"""
+Compare two benchmark reports.
+
+    python -m benchmarks.compare before.json after.json [--thresholds benchmarks/thresholds.json]
+
+thresholds.json gives, per metric, the largest allowed ratio of new to
+baseline value (``default``), optionally overridden per endpoint
+(``endpoints``). Wall-time metrics also get an absolute allowance
+(``wall_ms_noise``) so sub-millisecond jitter on fast endpoints is not
+reported. Read, write and round-trip counts are deterministic for a given
+seed, so their default ratio is 1.0: any increase is a regression.
+"""
+import argparse
+import json
+import os
+import sys
+
+WALL_METRICS = ("median", "p95")
+
+
+def _metric(result, name):
+    if name.startswith("wall_ms."):
+        return result["wall_ms"].get(name.split(".", 1)[1])
+    return result.get(name)
+
+
+def compare_reports(baseline, report, thresholds):
+    """Return a list of human-readable regressions of `report` against `baseline`."""
+    regressions = []
+    noise = thresholds.get("wall_ms_noise", 0)
+    for key, result in sorted(report["results"].items()):
+        before = baseline["results"].get(key)
+        if before is None:
+            continue
+        if result["status"] != before["status"]:
+            regressions.append(f"{key}: status {before['status']} -> {result['status']}")
+
+        limits = dict(thresholds.get("default", {}))
+        limits.update(thresholds.get("endpoints", {}).get(result["endpoint"], {}))
+        for name, ratio in sorted(limits.items()):
+            old, new = _metric(before, name), _metric(result, name)
+            if old is None or new is None:
+                continue
+            allowed = old * ratio
+            if name.startswith("wall_ms.") and name.split(".", 1)[1] in WALL_METRICS:
+                allowed += noise
+            if new > allowed:
+                regressions.append(f"{key}: {name} {old} -> {new} (allowed {allowed:g})")
+    return regressions
+
+
+def compare_files(baseline_path, report_path, thresholds_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(report_path, encoding="utf-8") as f:
+        report = json.load(f)
+    with open(thresholds_path, encoding="utf-8") as f:
+        thresholds = json.load(f)
+    return compare_reports(baseline, report, thresholds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a benchmark report against a baseline.")
+    parser.add_argument("baseline")
+    parser.add_argument("report")
+    parser.add_argument("--thresholds", default=os.path.join(os.path.dirname(__file__), "thresholds.json"))
+    args = parser.parse_args()
+
+    regressions = compare_files(args.baseline, args.report, args.thresholds)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print("No regressions." if not regressions else f"{len(regressions)} regression(s).")
+    sys.exit(1 if regressions else 0)
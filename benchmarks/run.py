@@ -0,0 +1,247 @@
+"""
+Endpoint benchmark suite.
+
+    python -m benchmarks.run                                  # 1k, 10k and 100k clients
+    python -m benchmarks.run --sizes 1000,10000 --latency-ms 5 --output after.json --baseline before.json
+
+For each dataset size the in-memory datastore is filled by
+populate_test_data.generate_dataset, then each endpoint in ENDPOINTS is called
+through Flask's test client. The report records per endpoint and size:
+
+* wall time (min / median / p95 / max over --repeat calls, after one warm-up)
+* Firestore document reads, writes and round trips for a single call, and the
+  app's own count of them (the ``X-Firestore-Ops`` header, which the suite enables)
+* peak Python memory allocated during a single call (tracemalloc)
+
+The counts are also checked against the per-endpoint operation budgets in
+benchmarks/budgets.py; any violation makes the run exit with status 1.
+
+--latency-ms adds a simulated round-trip time to every datastore call, which
+is what makes N+1 access patterns visible. With --baseline the new report is
+checked against an earlier one using benchmarks/thresholds.json (see
+benchmarks/compare.py) and the exit status is 1 on a regression.
+
+A 100k-client dataset keeps several million documents in memory; use
+--sessions-per-client to trade history depth for memory.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+os.environ.setdefault("DATASTORE_BACKEND", "memory")
+# Every timed call must do the full work, not hit the analytics result cache.
+os.environ.setdefault("SINGLEFLIGHT_TTL_SECONDS", "0")
+# The app's own per-request counts (X-Firestore-Ops) are recorded next to the datastore's.
+os.environ.setdefault("FIRESTORE_OPS_HEADER", "true")
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# (name, role making the request, method, path template). {clinician_id} and
+# {client_id} are filled in from the generated dataset.
+ENDPOINTS = [
+    ("overall-data", "admin", "GET", "/overall-data"),
+    ("overall-data:window-90d", "admin", "GET", "/overall-data?window=90d"),
+    ("clinician-data", "admin", "GET", "/clinician-data?clinician_id={clinician_id}"),
+    ("clinician-comparison", "admin", "GET", "/clinician-comparison"),
+    ("outcome-trends", "admin", "GET", "/outcome-trends"),
+    ("question-analytics", "admin", "GET", "/question-analytics"),
+    ("admin-search-clients", "admin", "GET", "/admin-search-clients"),
+    ("admin-search-clients:improved-6months", "admin", "GET", "/admin-search-clients?metric=improved&time=6months"),
+    ("search-users", "admin", "GET", "/search-users?query=client1"),
+    ("search-clients", "clinician", "GET", "/search-clients?query=client"),
+    ("search-all-clients", "admin", "GET", "/search-all-clients?query=client1&filter=all"),
+    ("past-responses", "admin", "GET", "/past-responses?user_id={client_id}&source=all"),
+    ("submit-responses", "client", "POST", "/user-data/{client_id}/sessions/benchmark_session/responses"),
+]
+
+
+def _login(client, email, password):
+    response = client.post("/login", json={"email": email, "password": password})
+    if response.status_code != 200:
+        raise RuntimeError(f"Benchmark login as {email} failed: {response.status_code} {response.get_data(as_text=True)}")
+    return response.get_json()["access_token"]
+
+
+def dataset_shape(db, clinician_email, questions):
+    """
+    Pick the clinician the clinician-scoped endpoints run as and one of their
+    active clients, and count what the operation budgets are expressed in.
+    """
+    from app.email_keys import lookup_email
+
+    def session_count(user_id):
+        return len(db.collection("user_data").document(user_id).collection("sessions").list_documents())
+
+    clinician_id = lookup_email(db, clinician_email)["user_id"]
+    clinician_clients = list(db.collection("users").where("assigned_clinician_id", "==", clinician_id).stream())
+    active = [c for c in clinician_clients if not c.to_dict().get("is_archived")]
+    client = active[0]
+    return {
+        "clinician_id": clinician_id,
+        "client_id": client.id,
+        "client_email": client.to_dict()["email"],
+        "users": len(db.collection("users").list_documents()),
+        "clinicians": len(db.collection("clinicians").list_documents()),
+        "clients": len(list(db.collection("users").where("role", "==", "client").stream())),
+        "sessions": len(list(db.collection_group("sessions").stream())),
+        "clinician_clients": len(clinician_clients),
+        "clinician_active_clients": len(active),
+        "clinician_active_sessions": sum(session_count(c.id) for c in active),
+        "client_sessions": session_count(client.id),
+        "questions": questions,
+    }
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(test_client, db, method, path, token, repeat, body=None):
+    """Call `path` once to warm up, `repeat` times for timing, then once each for counts and memory."""
+    from app.instrumentation import OPS_HEADER
+
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def call():
+        return test_client.open(path, method=method, headers=headers, json=body)
+
+    status = call().status_code
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    db.reset_stats()
+    response = call()
+    counts = db.stats()
+
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "status": status,
+        "wall_ms": {
+            "min": round(min(timings), 3),
+            "median": round(statistics.median(timings), 3),
+            "p95": round(_percentile(timings, 0.95), 3),
+            "max": round(max(timings), 3),
+        },
+        "reads": counts["reads"],
+        "writes": counts["writes"],
+        "round_trips": counts["round_trips"],
+        "ops_header": response.headers.get(OPS_HEADER),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run(sizes, sessions_per_client=6, latency_ms=0.0, repeat=5, seed=42, endpoints=None):
+    from app import app as flask_app, db
+    from app.datastore import is_memory_client
+    from populate_test_data import DEFAULT_PASSWORD, DatasetConfig, generate_dataset
+    from .budgets import check_budgets
+
+    if not is_memory_client(db):
+        raise RuntimeError("Benchmarks run against the in-memory datastore; unset DATASTORE_BACKEND or set it to 'memory'.")
+
+    selected = [e for e in ENDPOINTS if not endpoints or e[0] in endpoints]
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "latency_ms": latency_ms,
+        "sessions_per_client": sessions_per_client,
+        "seed": seed,
+        "results": {},
+        "budget_violations": [],
+    }
+    test_client = flask_app.test_client()
+
+    for size in sizes:
+        db.latency_ms = 0
+        db.reset()
+        started = time.perf_counter()
+        config = DatasetConfig(
+            clinicians=max(10, size // 100),
+            clients=size,
+            sessions_per_client=sessions_per_client,
+            seed=seed,
+        )
+        counts = generate_dataset(db, config)
+        print(f"[{size} clients] generated {db.document_count()} documents "
+              f"({counts['sessions']} sessions) in {time.perf_counter() - started:.1f}s")
+
+        shape = dataset_shape(db, "clinician3@example.com", config.questions)
+        tokens = {
+            "admin": _login(test_client, "admin1_clinician1@example.com", DEFAULT_PASSWORD),
+            "clinician": _login(test_client, "clinician3@example.com", DEFAULT_PASSWORD),
+            "client": _login(test_client, shape["client_email"], DEFAULT_PASSWORD),
+        }
+        answers = {"responses": [{"question_id": f"q{q}", "response_value": 3} for q in range(1, config.questions + 1)]}
+
+        db.latency_ms = latency_ms
+        size_results = {}
+        for name, role, method, template in selected:
+            body = answers if method == "POST" else None
+            result = measure(test_client, db, method, template.format(**shape), tokens[role], repeat, body)
+            result.update(endpoint=name, clients=size)
+            report["results"][f"{name}@{size}"] = result
+            size_results[name] = result
+            print(f"[{size} clients] {name}: status={result['status']} median={result['wall_ms']['median']}ms "
+                  f"reads={result['reads']} writes={result['writes']} round_trips={result['round_trips']} "
+                  f"peak={result['peak_kb']}KB")
+
+        for violation in check_budgets(size_results, shape):
+            print(f"[{size} clients] BUDGET {violation}")
+            report["budget_violations"].append(f"{size} clients: {violation}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analytics and search endpoints against the in-memory datastore.")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES), help="comma-separated client counts")
+    parser.add_argument("--sessions-per-client", type=int, default=6)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated datastore round-trip time")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per endpoint")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--endpoint", action="append", help="only run this endpoint (repeatable)")
+    parser.add_argument("--output", default="benchmark-report.json")
+    parser.add_argument("--baseline", help="earlier report to check for regressions")
+    parser.add_argument("--thresholds", default=os.path.join(os.path.dirname(__file__), "thresholds.json"))
+    args = parser.parse_args(argv)
+
+    report = run(
+        [int(size) for size in args.sizes.split(",") if size.strip()],
+        sessions_per_client=args.sessions_per_client,
+        latency_ms=args.latency_ms,
+        repeat=args.repeat,
+        seed=args.seed,
+        endpoints=args.endpoint,
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    failed = bool(report["budget_violations"])
+    if args.baseline:
+        from .compare import compare_files
+        regressions = compare_files(args.baseline, args.output, args.thresholds)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
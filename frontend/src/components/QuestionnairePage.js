@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import "../styles/global.css";
 import "../styles/questionnaire.css";
@@ -13,6 +13,7 @@ const QuestionnairePage = () => {
     const [currentIndex, setCurrentIndex] = useState(0);
     const [responses, setResponses] = useState({});
     const [isLoading, setIsLoading] = useState(true);
+    const submissionRef = useRef(null); // Session ID + idempotency key reused across retries
     const navigate = useNavigate();
 
     const userId = localStorage.getItem("user_id");
@@ -73,6 +74,7 @@ const QuestionnairePage = () => {
 
     const handleAnswerSelect = (questionId, value) => {
         setResponses({ ...responses, [questionId]: value });
+        submissionRef.current = null; // Changed answers are a new submission
 
         // Automatically move to the next question if there's another one
         if (currentIndex < questions.length - 1) {
@@ -96,7 +98,12 @@ const QuestionnairePage = () => {
         const token = localStorage.getItem("token");
         const deviceToken = localStorage.getItem("device_token");
 
-        const sessionId = `session_${Date.now()}`; // Generate unique session ID
+        // Generate the session ID once per check-in so retries are recognised as duplicates.
+        if (!submissionRef.current) {
+            const sessionId = `session_${Date.now()}`;
+            submissionRef.current = { sessionId, idempotencyKey: `${userId}:${sessionId}` };
+        }
+        const { sessionId, idempotencyKey } = submissionRef.current;
 
         const payload = {
             session_id: sessionId,
@@ -107,22 +114,36 @@ const QuestionnairePage = () => {
             })),
         };
     
-        try {
-            // ✅ Send ALL responses in one request
-            const response = await fetch(`${API_URL}/user-data/${userId}/sessions/${sessionId}/responses`, {
+        const sendResponses = () =>
+            fetch(`${API_URL}/user-data/${userId}/sessions/${sessionId}/responses`, {
                 method: "POST",
                 headers: {
                     "Content-Type": "application/json",
                     Authorization: `Bearer ${token}`,
                     "Device-Token": deviceToken,
+                    "Idempotency-Key": idempotencyKey,
                 },
                 body: JSON.stringify(payload),
             });
+
+        try {
+            // ✅ Send ALL responses in one request, retrying network failures with the same key
+            let response;
+            for (let attempt = 0; attempt < 3; attempt++) {
+                try {
+                    response = await sendResponses();
+                    if (response.status !== 409) break; // 409: the first attempt is still being stored
+                } catch (networkError) {
+                    if (attempt === 2) throw networkError;
+                }
+                await new Promise((resolve) => setTimeout(resolve, 1000 * (attempt + 1)));
+            }
     
             if (!response.ok) {
                 throw new Error("Failed to submit responses.");
             }
     
+            submissionRef.current = null;
             navigate("/client-dashboard");
         } catch (error) {
             console.error("Error submitting responses:", error);
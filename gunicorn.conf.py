@@ -0,0 +1,33 @@
+"""
+Gunicorn settings (picked up automatically from the working directory).
+
+Each worker builds the app and runs the warm-up steps (app/warmup.py: open
+the Firestore channel, fill caches) before it accepts traffic.
+
+Workers record Prometheus metrics in PROMETHEUS_MULTIPROC_DIR so /metrics can
+aggregate every worker; the directory is emptied when the master starts and
+a dead worker's live gauges are dropped when it exits.
+"""
+import os
+import shutil
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/headway-prometheus")
+
+
+def on_starting(server):
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_worker_init(worker):
+    from app.warmup import run_warmups
+    run_warmups()
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
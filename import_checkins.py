@@ -0,0 +1,296 @@
+"""
+Bulk import of historical check-ins from CSV or JSONL.
+
+    python import_checkins.py checkins.csv
+    python import_checkins.py checkins.jsonl --workers 16
+
+Each row becomes one session under user_data/{user_id}/sessions, with its
+per-question documents under .../responses.
+
+CSV rows need a `user_id` or `email` column and a `timestamp` column.
+`session_id` and `questionnaire_id` are optional. Every other column is
+treated as a question ID holding that question's response value.
+
+JSONL rows are objects with the same keys. Answers go either in
+`responses` ([{"question_id", "response_value"}, ...]) or in `scores`
+({question_id: value}).
+
+Rows are written through parallel bulk writes with backpressure. Progress is
+checkpointed to <input>.checkpoint.json so an interrupted import resumes
+where it stopped, and is saved even when the import fails. Rows that cannot be
+imported (malformed JSON, non-numeric or non-finite answers, ...) are logged to
+<input>.errors.jsonl. Rows without a session_id get one derived from their
+content, so re-importing a file overwrites rather than duplicates.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from app import db
+from app.bulk_writes import BulkWriter, set_op
+from app.client_timeline import rebuild_client_timeline
+from app.rollups import build_rollup
+from app.trends import rebuild_trends
+from app.email_keys import lookup_email
+
+RESERVED_COLUMNS = {"user_id", "email", "session_id", "timestamp", "questionnaire_id"}
+DEFAULT_QUESTIONNAIRE_ID = "default_questionnaire"
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_rows(path):
+    """Yield one dict per input row (None for a blank line, an ImportRowError for one that does not parse)."""
+    if path.endswith(".jsonl") or path.endswith(".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    yield None
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield ImportRowError(f"invalid JSON: {e}")
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+
+
+def parse_timestamp(value, date_format=None):
+    if not value:
+        raise ImportRowError("missing timestamp")
+    try:
+        if date_format:
+            parsed = datetime.strptime(str(value).strip(), date_format)
+        else:
+            parsed = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise ImportRowError(f"unparseable timestamp {value!r}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def parse_responses(row):
+    if isinstance(row.get("responses"), list):
+        pairs = [(r.get("question_id"), r.get("response_value")) for r in row["responses"]]
+    elif isinstance(row.get("scores"), dict):
+        pairs = list(row["scores"].items())
+    else:
+        pairs = [(k, v) for k, v in row.items() if k not in RESERVED_COLUMNS and v not in (None, "")]
+
+    responses = []
+    for question_id, value in pairs:
+        if not question_id:
+            raise ImportRowError("response without a question_id")
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ImportRowError(f"non-numeric response {value!r} for {question_id}")
+        if not math.isfinite(number):
+            raise ImportRowError(f"non-finite response {value!r} for {question_id}")
+        value = int(number) if number.is_integer() else number
+        responses.append({"question_id": str(question_id), "response_value": value})
+    if not responses:
+        raise ImportRowError("no responses")
+    return responses
+
+
+class UserResolver:
+    """Resolve emails to user IDs through the email_keys index, caching results."""
+
+    def __init__(self):
+        self._cache = {}
+
+    def __call__(self, row):
+        if row.get("user_id"):
+            return str(row["user_id"]).strip()
+        email = (row.get("email") or "").strip().lower()
+        if not email:
+            raise ImportRowError("row has neither user_id nor email")
+        if email not in self._cache:
+            entry = lookup_email(db, email)
+            self._cache[email] = entry["user_id"] if entry else None
+        if not self._cache[email]:
+            raise ImportRowError(f"no user registered with email {email}")
+        return self._cache[email]
+
+
+def build_session_ops(user_id, row, date_format):
+    """Map a row onto the session document and its response documents."""
+    timestamp = parse_timestamp(row.get("timestamp"), date_format)
+    questionnaire_id = row.get("questionnaire_id") or DEFAULT_QUESTIONNAIRE_ID
+    responses = parse_responses(row)
+    session_id = row.get("session_id")
+    if not session_id:
+        digest = hashlib.sha1(f"{user_id}|{timestamp.isoformat()}|{questionnaire_id}".encode("utf-8")).hexdigest()
+        session_id = f"import_{digest[:20]}"
+
+    session_ref = db.collection("user_data").document(user_id).collection("sessions").document(str(session_id))
+    ops = [set_op(session_ref, {
+        "questionnaire_id": questionnaire_id,
+        "timestamp": timestamp,
+        "summary_responses": responses,
+    })]
+    for response in responses:
+        ops.append(set_op(session_ref.collection("responses").document(f"response_{response['question_id']}"), response))
+    return ops
+
+
+class Checkpoint:
+    """
+    Tracks which rows are durably written. Batches finish out of order, so the
+    checkpoint is the first row not yet finished; everything before it is done.
+    """
+
+    def __init__(self, path, state):
+        self.path = path
+        self.next_row = state.get("next_row", 0)
+        self.errors = state.get("errors", 0)
+        self.rows_written = state.get("rows_written", 0)
+        self.touched_users = set(state.get("touched_users", []))
+        self._finished = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, restart=False):
+        if restart or not os.path.exists(path):
+            return cls(path, {})
+        with open(path, encoding="utf-8") as f:
+            return cls(path, json.load(f))
+
+    def finish(self, row_number, user_id=None, error=False):
+        with self._lock:
+            self._finished.add(row_number)
+            if error:
+                self.errors += 1
+            else:
+                self.rows_written += 1
+                if user_id:
+                    self.touched_users.add(user_id)
+            while self.next_row in self._finished:
+                self._finished.remove(self.next_row)
+                self.next_row += 1
+
+    def save(self):
+        with self._lock:
+            state = {
+                "next_row": self.next_row,
+                "errors": self.errors,
+                "rows_written": self.rows_written,
+                "touched_users": sorted(self.touched_users),
+            }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+
+def import_file(path, workers=8, batch_size=500, date_format=None, restart=False,
+                progress_interval=5.0, rebuild_timelines=True):
+    checkpoint = Checkpoint.load(path + ".checkpoint.json", restart)
+    errors_file = open(path + ".errors.jsonl", "w" if restart else "a", encoding="utf-8")
+    errors_lock = threading.Lock()
+    resolve_user = UserResolver()
+
+    def log_error(row_number, message):
+        with errors_lock:
+            errors_file.write(json.dumps({"row": row_number, "error": message}) + "\n")
+
+    def on_batch_done(outcomes):
+        for (row_number, user_id), error in outcomes:
+            if error:
+                log_error(row_number, error)
+            checkpoint.finish(row_number, user_id, error=bool(error))
+
+    if checkpoint.next_row:
+        print(f"Resuming {path} at row {checkpoint.next_row}")
+
+    started = time.monotonic()
+    last_report = started
+    rows_seen = 0
+    # Whatever stops the import, the rows finished so far are checkpointed.
+    try:
+        with BulkWriter(db, batch_size=batch_size, max_workers=workers, on_batch_done=on_batch_done) as writer:
+            for row_number, row in enumerate(read_rows(path)):
+                if row_number < checkpoint.next_row:
+                    continue
+                rows_seen += 1
+                try:
+                    if isinstance(row, ImportRowError):
+                        raise row
+                    if not row:
+                        raise ImportRowError("empty row")
+                    if not isinstance(row, dict):
+                        raise ImportRowError(f"row is a JSON {type(row).__name__}, not an object")
+                    user_id = resolve_user(row)
+                    writer.add_group((row_number, user_id), build_session_ops(user_id, row, date_format))
+                except ImportRowError as e:
+                    log_error(row_number, str(e))
+                    checkpoint.finish(row_number, error=True)
+
+                now = time.monotonic()
+                if now - last_report >= progress_interval:
+                    checkpoint.save()
+                    rate = rows_seen / (now - started)
+                    print(f"rows={checkpoint.next_row} written={checkpoint.rows_written} "
+                          f"errors={checkpoint.errors} rate={rate:.0f} rows/s")
+                    last_report = now
+    finally:
+        checkpoint.save()
+        errors_file.close()
+    elapsed = time.monotonic() - started
+    print(f"Imported {checkpoint.rows_written} rows ({checkpoint.errors} errors) "
+          f"in {elapsed:.1f}s, {rows_seen / elapsed if elapsed else 0:.0f} rows/s")
+
+    if rebuild_timelines and checkpoint.touched_users:
+        print(f"Rebuilding score timelines for {len(checkpoint.touched_users)} clients")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda user_id: rebuild_client_timeline(db, user_id), checkpoint.touched_users))
+
+        users = db.get_all([db.collection("users").document(user_id) for user_id in checkpoint.touched_users])
+        clinician_ids = {(u.to_dict() or {}).get("assigned_clinician_id") for u in users if u.exists} - {None}
+        print(f"Rebuilding metric rollups for {len(clinician_ids)} clinicians")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda clinician_id: build_rollup(db, clinician_id), clinician_ids))
+
+        # Rebuilt timelines replace the old ones without a diff, so recount the trends.
+        print("Rebuilding monthly trends")
+        rebuild_trends(db)
+    return checkpoint
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import historical check-ins from CSV or JSONL.")
+    parser.add_argument("path", help="CSV or JSONL file to import")
+    parser.add_argument("--workers", type=int, default=8, help="parallel batch commits (default 8)")
+    parser.add_argument("--batch-size", type=int, default=500, help="operations per batch commit (max 500)")
+    parser.add_argument("--date-format", help="strptime format for timestamps, e.g. %%d/%%m/%%Y (default ISO 8601)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint and start over")
+    parser.add_argument("--skip-timelines", action="store_true", help="do not rebuild client score timelines, rollups and trends afterwards")
+    args = parser.parse_args(argv)
+
+    checkpoint = import_file(
+        args.path,
+        workers=args.workers,
+        batch_size=min(args.batch_size, 500),
+        date_format=args.date_format,
+        restart=args.restart,
+        rebuild_timelines=not args.skip_timelines,
+    )
+    return 1 if checkpoint.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,171 +1,285 @@
+"""
+Synthetic dataset generator.
+
+    python populate_test_data.py                      # 10 clinicians, 100 clients
+    python populate_test_data.py --clients 100000 --clinicians 500 --years 4 --seed 7
+
+Creates admins, clinicians and clients (with email keys), and for every client
+a history of check-in sessions spread over the last `--years` years, plus the
+client's score timeline, the clinician rollups and the monthly trends. A
+fraction of clients is flagged as archived.
+
+The same seed and options produce the same documents (IDs, names, answers and
+timestamps), so a dataset can be reproduced exactly. All accounts share one
+password hash, computed once. Writes go through parallel bulk batches.
+"""
+import argparse
 import random
-import uuid
-from datetime import datetime, timezone
-from google.cloud import firestore
-import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 
-import firebase_admin
-from firebase_admin import credentials, firestore
 from werkzeug.security import generate_password_hash
-from google.oauth2 import service_account
-
-# Configuration for test data
-NUM_CLINICIANS = 10
-NUM_ADMIN_CLINICIANS = 2  # out of 10, the first 2 will be admins
-NUM_CLIENTS_PER_CLINICIAN = 10
-NUM_SESSIONS_PER_CLIENT = 10
-NUM_QUESTIONS = 10  # Assume the questionnaire has 10 questions
+
+from app.bulk_writes import BulkWriter, set_op
+from app.client_timeline import merge_entries, timeline_entry, timeline_fields
+from app.datastore import SERVER_TIMESTAMP
+from app.email_keys import email_key_ref, email_key_data
+from app.rollups import BUILT_FIELD, CLIENTS_FIELD, client_state, rollup_ref
+from app.roster import reload_roster
+from app.trends import add_contribution, increment_fields, trend_ref
+
 QUESTIONNAIRE_ID = "default_questionnaire"
 DEFAULT_PASSWORD = "Headway!"
 
-if os.getenv("RENDER"):
-    CREDENTIALS_PATH = "/etc/secrets/secret_key.json"
-else:
-    CREDENTIALS_PATH = os.path.join(os.getcwd(), "secret_key.json")
-
-if not os.path.exists(CREDENTIALS_PATH):
-    raise RuntimeError(f"Missing Firebase credentials file at {CREDENTIALS_PATH}")
 
-# Load credentials using the google.oauth2 service_account
-cred = service_account.Credentials.from_service_account_file(CREDENTIALS_PATH)
+@dataclass
+class DatasetConfig:
+    clinicians: int = 10
+    admins: int = 2  # the first `admins` clinicians are admins
+    clients: int = 100  # spread round-robin across clinicians
+    sessions_per_client: int = 10  # average; each client gets between half and 1.5x this
+    questions: int = 10
+    years: float = 2.0
+    archived_fraction: float = 0.1
+    seed: int = 42
+    end_date: datetime = None  # defaults to today (midnight UTC)
+    password: str = DEFAULT_PASSWORD
+    workers: int = 8
 
-# Initialize Firebase Admin SDK if not already initialized
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(credentials.Certificate(CREDENTIALS_PATH))
 
-# Initialize Firestore client with these credentials
-db = firestore.Client(credentials=cred)
+def _doc_id(rng):
+    """A Firestore-style 20-character ID drawn from the seeded generator."""
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+    return "".join(rng.choice(alphabet) for _ in range(20))
 
 
-def create_admin(admin_number, clinician_first_name):
-    # Name format: "AdminX_of_[clinician_first_name] Test"
-    name = f"Admin{admin_number}_of_{clinician_first_name} Test"
-    email = f"admin{admin_number}_{clinician_first_name.lower()}@example.com"
-    hashed_password = generate_password_hash(DEFAULT_PASSWORD, method="scrypt")
-    user_data = {
-        "first_name": name.split("_of_")[0],
-        "last_name": "Test",
+def _user_doc(first_name, last_name, email, role, password_hash, created_at, **extra):
+    data = {
+        "first_name": first_name,
+        "last_name": last_name,
         "email": email,
-        "password": hashed_password,
-        "role": "admin",
-        "created_at": datetime.utcnow()
+        "password": password_hash,
+        "role": role,
+        "created_at": created_at,
+        "is_archived": False,
     }
-    # Create document with an auto-generated ID in "users"
-    user_ref = db.collection("users").document()
-    user_ref.set(user_data)
-    user_id = user_ref.id
-    # Add to 'admins' collection
-    db.collection("admins").document(user_id).set({
-        "id": user_id,
-        "name": name
-    })
-    # Also add to 'clinicians' collection (admins have clinician privileges)
-    db.collection("clinicians").document(user_id).set({
-        "id": user_id,
-        "name": name,
-        "is_admin": True,
-        "assigned_clinician_id": None
-    })
-    return user_id, name
-
-def create_clinician(clinician_number):
-    # Name format: "ClinicianX Test"
-    name = f"Clinician{clinician_number} Test"
-    email = f"clinician{clinician_number}@example.com"
-    hashed_password = generate_password_hash(DEFAULT_PASSWORD, method="scrypt")
-    user_data = {
-        "first_name": f"Clinician{clinician_number}",
-        "last_name": "Test",
-        "email": email,
-        "password": hashed_password,
-        "role": "clinician",
-        "created_at": datetime.utcnow()
-    }
-    user_ref = db.collection("users").document()
-    user_ref.set(user_data)
-    user_id = user_ref.id
-    # Add to 'clinicians' collection
-    db.collection("clinicians").document(user_id).set({
-        "id": user_id,
-        "name": name,
-        "is_admin": False,
-        "assigned_clinician_id": None
-    })
-    return user_id, f"Clinician{clinician_number}"
-
-def create_client(client_number, clinician_first_name, clinician_id):
-    # Name format: "ClientX_of_[clinician_first_name] Test"
-    name = f"Client{client_number}_of_{clinician_first_name} Test"
-    email = f"client{client_number}_{clinician_first_name.lower()}@example.com"
-    hashed_password = generate_password_hash(DEFAULT_PASSWORD, method="scrypt")
-    user_data = {
-        "first_name": f"Client{client_number}",
-        "last_name": f"of_{clinician_first_name} Test",
-        "email": email,
-        "password": hashed_password,
-        "role": "client",
-        "assigned_clinician_id": clinician_id,
-        "created_at": datetime.utcnow()
-    }
-    user_ref = db.collection("users").document()
-    user_ref.set(user_data)
-    user_id = user_ref.id
-    return user_id, name
-
-def create_session_for_client(user_id):
-    # Create a unique session ID using timestamp and a short random hex
-    session_id = f"session_{int(datetime.utcnow().timestamp() * 1000)}_{uuid.uuid4().hex[:6]}"
-    timestamp = datetime.utcnow().replace(tzinfo=timezone.utc)
-    
-    # Build summary responses for each question.
-    summary_responses = []
-    for i in range(1, NUM_QUESTIONS + 1):
-        response_value = random.randint(1, 5)  # Generate a random response
-        summary_responses.append({
+    data.update(extra)
+    return data
+
+
+def _staff_groups(db, config, rng, password_hash, start):
+    """Return the (tag, ops) groups for every clinician and admin, and their (id, name) pairs."""
+    groups, staff = [], []
+    for number in range(1, config.clinicians + 1):
+        user_id = _doc_id(rng)
+        is_admin = number <= config.admins
+        first_name = f"Clinician{number}"
+        email = f"clinician{number}@example.com"
+        name = f"{first_name} Test"
+        if is_admin:
+            first_name = f"Admin{number}"
+            email = f"admin{number}_clinician{number}@example.com"
+            name = f"Admin{number}_of_Clinician{number} Test"
+
+        created_at = start + timedelta(days=rng.uniform(0, 30))
+        ops = [
+            set_op(db.collection("users").document(user_id), _user_doc(
+                first_name, "Test", email, "admin" if is_admin else "clinician", password_hash, created_at)),
+            set_op(email_key_ref(db, email), email_key_data(email, user_id)),
+            set_op(db.collection("clinicians").document(user_id), {
+                "id": user_id,
+                "name": name,
+                "is_admin": is_admin,
+                "assigned_clinician_id": None,
+            }),
+        ]
+        if is_admin:
+            ops.append(set_op(db.collection("admins").document(user_id), {"id": user_id, "name": name}))
+        staff.append((user_id, f"Clinician{number}"))
+        groups.append((("staff", user_id), ops))
+    return groups, staff
+
+
+def _session_times(rng, first, end, count):
+    """Roughly evenly spaced check-in times between `first` and `end`, with jitter."""
+    span = (end - first).total_seconds()
+    step = span / max(count, 1)
+    times = []
+    for i in range(count):
+        offset = step * i + rng.uniform(0, step)
+        times.append(first + timedelta(seconds=offset))
+    return times
+
+
+def _client_groups(db, config, rng, password_hash, client_number, clinician, start, end, rollups, trends):
+    """
+    Yield (tag, ops) groups for one client: the user, each session, then the timeline.
+    Active clients' rollup states are added to `rollups[clinician_id]`, and every
+    client's trend contribution to `trends`.
+    """
+    clinician_id, clinician_name = clinician
+    user_id = _doc_id(rng)
+    email = f"client{client_number}_{clinician_name.lower()}@example.com"
+    created_at = start + timedelta(seconds=rng.uniform(0, (end - start).total_seconds() * 0.9))
+    archived = rng.random() < config.archived_fraction
+
+    extra = {"assigned_clinician_id": clinician_id}
+    if archived:
+        extra.update(is_archived=True, archived_at=created_at + (end - created_at) * rng.uniform(0.5, 1.0))
+    user_ops = [
+        set_op(db.collection("users").document(user_id), _user_doc(
+            f"Client{client_number}", f"of_{clinician_name} Test", email, "client", password_hash, created_at, **extra)),
+        set_op(email_key_ref(db, email), email_key_data(email, user_id, archived=archived)),
+    ]
+    yield ("archived_client" if archived else "client", user_id), user_ops
+
+    # Each client drifts from a baseline towards a target, so trends are visible in the analytics.
+    baseline = rng.uniform(1.5, 4.5)
+    target = min(5.0, max(1.0, baseline + rng.uniform(-2.0, 2.0)))
+    low = max(1, config.sessions_per_client // 2)
+    count = rng.randint(low, max(low, config.sessions_per_client * 3 // 2))
+    last = extra.get("archived_at", end)
+
+    data_ref = db.collection("user_data").document(user_id)
+    entries = []
+    for index, timestamp in enumerate(_session_times(rng, created_at, last, count)):
+        progress = index / max(count - 1, 1)
+        mean = baseline + (target - baseline) * progress
+        summary_responses = [{
             "questionnaire_id": QUESTIONNAIRE_ID,
-            "question_id": f"q{i}",
-            "response_value": response_value,
+            "question_id": f"q{q}",
+            "response_value": min(5, max(1, round(rng.gauss(mean, 0.8)))),
             "timestamp": timestamp,
-        })
-    
-    # Create session data with summary_responses
-    session_data = {
-        "questionnaire_id": QUESTIONNAIRE_ID,
-        "timestamp": timestamp,
-        "summary_responses": summary_responses
-    }
-    session_ref = db.collection("user_data").document(user_id).collection("sessions").document(session_id)
-    session_ref.set(session_data)
-    
-    # For each question, create a response document in the "responses" subcollection using the same summary data.
-    for i, response in enumerate(summary_responses, start=1):
-        response_doc_id = f"response_{i}"
-        session_ref.collection("responses").document(response_doc_id).set(response)
-    
-    return session_id
-
-def populate_test_data():
-    clinician_ids = []
-    # Create clinicians (first NUM_ADMIN_CLINICIANS will be admins)
-    for i in range(1, NUM_CLINICIANS + 1):
-        if i <= NUM_ADMIN_CLINICIANS:
-            user_id, name = create_admin(i, f"Clinician{i}")
-            print(f"Created admin: {name} with ID: {user_id}")
-            clinician_ids.append((user_id, f"Clinician{i}"))
-        else:
-            user_id, name = create_clinician(i)
-            print(f"Created clinician: {name} with ID: {user_id}")
-            clinician_ids.append((user_id, f"Clinician{i}"))
-
-    # For each clinician, create clients
-    for clinician_id, clinician_name in clinician_ids:
-        for j in range(1, NUM_CLIENTS_PER_CLINICIAN + 1):
-            client_id, client_name = create_client(j, clinician_name, clinician_id)
-            print(f"Created client: {client_name} with ID: {client_id}")
-            # For each client, create NUM_SESSIONS_PER_CLIENT sessions
-            for k in range(1, NUM_SESSIONS_PER_CLIENT + 1):
-                session_id = create_session_for_client(client_id)
-                print(f"Created session {session_id} for client {client_name}")
+        } for q in range(1, config.questions + 1)]
+
+        session_id = f"session_{int(timestamp.timestamp() * 1000)}_{rng.getrandbits(24):06x}"
+        session_ref = data_ref.collection("sessions").document(session_id)
+        ops = [set_op(session_ref, {
+            "questionnaire_id": QUESTIONNAIRE_ID,
+            "timestamp": timestamp,
+            "summary_responses": summary_responses,
+        })]
+        for response in summary_responses:
+            ops.append(set_op(session_ref.collection("responses").document(f"response_{response['question_id']}"), response))
+        entries.append(timeline_entry(session_id, timestamp, summary_responses))
+        yield ("session", user_id), ops
+
+    timeline = merge_entries([], entries)
+    if not archived:
+        rollups[clinician_id][user_id] = client_state(timeline)
+    add_contribution(trends, user_id, timeline)
+    yield ("timeline", user_id), [set_op(data_ref, timeline_fields(timeline), merge=True)]
+
+
+def generate_dataset(db, config, on_progress=None):
+    """
+    Write a synthetic dataset described by `config` to `db`.
+
+    Returns a dict of counts (clinicians, clients, archived_clients, sessions,
+    failed_groups). `on_progress(counts)` is called after each client.
+    """
+    rng = random.Random(config.seed)
+    end = config.end_date or datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=365.25 * config.years)
+    # Hashing is deliberately slow; every generated account shares one hash.
+    password_hash = generate_password_hash(config.password, method="scrypt")
+
+    staff_groups, staff = _staff_groups(db, config, rng, password_hash, start)
+    if not staff and config.clients:
+        raise ValueError("At least one clinician is needed to assign clients to.")
+
+    rollups = {clinician_id: {} for clinician_id, _ in staff}
+    trends = {}
+    counts = {"clinicians": len(staff), "clients": 0, "archived_clients": 0, "sessions": 0, "failed_groups": 0}
+    failures_lock = threading.Lock()
+
+    def on_batch_done(outcomes):
+        for (kind, user_id), error in outcomes:
+            if error:
+                with failures_lock:
+                    counts["failed_groups"] += 1
+                print(f"Failed to write {kind} group for {user_id}: {error}")
+
+    with BulkWriter(db, max_workers=config.workers, on_batch_done=on_batch_done) as writer:
+        for tag, ops in staff_groups:
+            writer.add_group(tag, ops)
+
+        for client_number in range(1, config.clients + 1):
+            clinician = staff[(client_number - 1) % len(staff)]
+            for tag, ops in _client_groups(db, config, rng, password_hash, client_number, clinician, start, end, rollups, trends):
+                writer.add_group(tag, ops)
+                if tag[0] == "session":
+                    counts["sessions"] += 1
+                elif tag[0] in ("client", "archived_client"):
+                    counts["clients"] += 1
+                    counts["archived_clients"] += tag[0] == "archived_client"
+            if on_progress:
+                on_progress(counts)
+
+        for clinician_id, states in rollups.items():
+            writer.add_group(("rollup", clinician_id), [
+                set_op(rollup_ref(db, clinician_id), {CLIENTS_FIELD: states, BUILT_FIELD: SERVER_TIMESTAMP})])
+        # Added to any trend totals already stored, like the clients themselves.
+        for (year, shard), doc in trends.items():
+            fields = increment_fields(doc)
+            if fields:
+                writer.add_group(("trends", f"{year}-{shard}"), [set_op(trend_ref(db, year, shard), fields, merge=True)])
+
+    # Running app workers on this host (or this process) reload their clinician roster.
+    reload_roster()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Populate Firestore with a synthetic check-in dataset.")
+    parser.add_argument("--clinicians", type=int, default=10)
+    parser.add_argument("--admins", type=int, default=2, help="how many of the clinicians are admins")
+    parser.add_argument("--clients", type=int, default=100, help="total clients, spread across clinicians")
+    parser.add_argument("--sessions-per-client", type=int, default=10, help="average sessions per client")
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--years", type=float, default=2.0, help="how far back session history goes")
+    parser.add_argument("--archived-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end-date", help="latest session date (YYYY-MM-DD, default today); fix it to reproduce a dataset exactly")
+    parser.add_argument("--workers", type=int, default=8, help="parallel batch commits")
+    args = parser.parse_args(argv)
+
+    end_date = None
+    if args.end_date:
+        end_date = datetime.strptime(args.end_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    config = DatasetConfig(
+        clinicians=args.clinicians,
+        admins=min(args.admins, args.clinicians),
+        clients=args.clients,
+        sessions_per_client=args.sessions_per_client,
+        questions=args.questions,
+        years=args.years,
+        archived_fraction=args.archived_fraction,
+        seed=args.seed,
+        end_date=end_date,
+        workers=args.workers,
+    )
+
+    from app import db
+
+    started = time.monotonic()
+    last_report = [started]
+
+    def report(counts):
+        now = time.monotonic()
+        if now - last_report[0] >= 5:
+            print(f"clients={counts['clients']} sessions={counts['sessions']} "
+                  f"rate={counts['sessions'] / (now - started):.0f} sessions/s")
+            last_report[0] = now
+
+    counts = generate_dataset(db, config, on_progress=report)
+    elapsed = time.monotonic() - started
+    print(f"Created {counts['clinicians']} clinicians, {counts['clients']} clients "
+          f"({counts['archived_clients']} archived) and {counts['sessions']} sessions in {elapsed:.1f}s"
+          + (f"; {counts['failed_groups']} groups failed" if counts["failed_groups"] else ""))
+
 
 if __name__ == "__main__":
-    populate_test_data()
+    main()
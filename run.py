@@ -1,11 +1,13 @@
 import os
-from app import create_app
 
-# Set the default environment to "development" if not already set
+# Set the default environment to "development" if not already set (before the app reads it)
 os.environ.setdefault("ENVIRONMENT", "development")
 
-# Create the Flask app
-app = create_app()
+from app import get_app
+from app.warmup import run_warmups
+
+# Get the Flask app (built once per process)
+app = get_app()
 
 if __name__ == "__main__":
     # Get the environment variable
@@ -17,4 +19,7 @@ if __name__ == "__main__":
 
     print(f"🔧 Running Flask in {environment} mode on port {port}...")
 
+    # Open the Firestore channel and fill caches before serving
+    run_warmups()
+
     app.run(host="0.0.0.0", port=port, debug=debug)
@@ -0,0 +1,49 @@
+"""
+Regression tests run against the in-memory datastore (app/memory_store.py):
+
+    python -m pytest tests
+"""
+import os
+
+os.environ.setdefault("DATASTORE_BACKEND", "memory")
+os.environ.setdefault("ADMISSION_CONTROL", "false")
+os.environ.setdefault("SINGLEFLIGHT_TTL_SECONDS", "0")
+
+import pytest
+
+from app import app as flask_app, db
+from app.trends import TRENDS_COLLECTION
+from populate_test_data import DEFAULT_PASSWORD, DatasetConfig, generate_dataset
+
+
+@pytest.fixture
+def memory_db():
+    """The app's datastore, emptied before and after the test."""
+    db.reset()
+    yield db
+    db.reset()
+
+
+@pytest.fixture
+def client_auth(memory_db):
+    """(user_id, Authorization headers) for an active client of a small generated dataset."""
+    generate_dataset(memory_db, DatasetConfig(clinicians=1, admins=0, clients=1, sessions_per_client=2,
+                                              archived_fraction=0.0, seed=1, workers=1))
+    client = next(iter(memory_db.collection("users").where("role", "==", "client").stream()))
+    response = flask_app.test_client().post(
+        "/login", json={"email": client.to_dict()["email"], "password": DEFAULT_PASSWORD})
+    return client.id, {"Authorization": f"Bearer {response.get_json()['access_token']}"}
+
+
+def _nonzero(value):
+    """Drop the zero totals and empty maps that increments leave behind but a rebuild does not write."""
+    if isinstance(value, dict):
+        value = {key: _nonzero(item) for key, item in value.items()}
+        return {key: item for key, item in value.items() if item not in ({}, 0, 0.0)}
+    return value
+
+
+@pytest.fixture
+def trend_totals(memory_db):
+    """Callable returning the trend documents' non-zero totals, for comparing incremental updates with a rebuild."""
+    return lambda: {ref.id: _nonzero(ref.get().to_dict()) for ref in memory_db.collection(TRENDS_COLLECTION).list_documents()}
@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from app import idempotency
+from app.idempotency import record_ref, run_idempotent
+
+
+def _store(memory_db, body, status=201):
+    def handler(transaction):
+        transaction.set(memory_db.collection("writes").document(), {"body": body})
+        return body, status
+    return handler
+
+
+def test_retry_replays_the_stored_response(memory_db):
+    first = run_idempotent(memory_db, "scope", "key", "fingerprint", _store(memory_db, {"n": 1}))
+    second = run_idempotent(memory_db, "scope", "key", "fingerprint", _store(memory_db, {"n": 2}))
+
+    assert first == ({"n": 1}, 201, False)
+    assert second == ({"n": 1}, 201, True)
+    assert len(list(memory_db.collection("writes").stream())) == 1
+
+
+def test_error_response_releases_the_claim(memory_db):
+    assert run_idempotent(memory_db, "scope", "key", "fingerprint", _store(memory_db, {}, 400))[1] == 400
+    assert not record_ref(memory_db, "scope", "key").get().exists
+
+
+def test_taken_over_claim_returns_the_new_owners_response(memory_db, monkeypatch):
+    """A request whose claim expired mid-write must not overwrite the response of the request that took over."""
+    monkeypatch.setattr(idempotency, "PENDING_TIMEOUT", timedelta(0))
+    taken_over = []
+
+    def stalled(transaction):
+        if not taken_over:
+            # Another worker sees the claim as abandoned, takes it over and completes first.
+            inflight = idempotency._inflight
+            idempotency._inflight = {}
+            try:
+                taken_over.append(run_idempotent(memory_db, "scope", "key", "fingerprint", _store(memory_db, {"by": "second"})))
+            finally:
+                idempotency._inflight = inflight
+        transaction.set(memory_db.collection("writes").document(), {"body": {"by": "first"}})
+        return {"by": "first"}, 201
+
+    body, status, replayed = run_idempotent(memory_db, "scope", "key", "fingerprint", stalled)
+
+    assert taken_over == [({"by": "second"}, 201, False)]
+    assert (body, status, replayed) == ({"by": "second"}, 201, True)
+    record = record_ref(memory_db, "scope", "key").get().to_dict()
+    assert record["status"] == "completed" and record["response_body"] == {"by": "second"}
+    assert [doc.to_dict()["body"] for doc in memory_db.collection("writes").stream()] == [{"by": "second"}]
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+import import_checkins
+
+
+def _row(day, value=3, **extra):
+    return json.dumps({"user_id": "client_a", "timestamp": f"2024-05-{day:02d}T08:00:00Z", "scores": {"q1": value}, **extra})
+
+
+def _import(path):
+    return import_checkins.import_file(str(path), workers=1, progress_interval=3600, rebuild_timelines=False)
+
+
+def _sessions(memory_db):
+    return sorted(s.id for s in memory_db.collection("user_data").document("client_a").collection("sessions").stream())
+
+
+def test_malformed_rows_are_logged_and_checkpointed(memory_db, tmp_path):
+    path = tmp_path / "checkins.jsonl"
+    path.write_text("\n".join([
+        _row(1, session_id="s1"), "{bad json", "[1, 2]", "7",
+        _row(2, value="nan"), _row(3, value="inf"), _row(4, session_id="s4"),
+    ]) + "\n")
+
+    checkpoint = _import(path)
+
+    assert (checkpoint.next_row, checkpoint.rows_written, checkpoint.errors) == (7, 2, 5)
+    assert _sessions(memory_db) == ["s1", "s4"]
+    errors = [json.loads(line) for line in (tmp_path / "checkins.jsonl.errors.jsonl").read_text().splitlines()]
+    assert [error["row"] for error in errors] == [1, 2, 3, 4, 5]
+    saved = json.loads((tmp_path / "checkins.jsonl.checkpoint.json").read_text())
+    assert saved["next_row"] == 7 and saved["rows_written"] == 2
+
+
+def test_interrupted_import_resumes_after_the_finished_rows(memory_db, tmp_path, monkeypatch):
+    path = tmp_path / "checkins.jsonl"
+    path.write_text("\n".join(_row(day, session_id=f"s{day}") for day in range(1, 6)) + "\n")
+    build_session_ops = import_checkins.build_session_ops
+
+    def crash_on_row_4(user_id, row, date_format):
+        if row["session_id"] == "s4":
+            raise RuntimeError("worker killed")
+        return build_session_ops(user_id, row, date_format)
+
+    monkeypatch.setattr(import_checkins, "build_session_ops", crash_on_row_4)
+    with pytest.raises(RuntimeError):
+        _import(path)
+    saved = json.loads((tmp_path / "checkins.jsonl.checkpoint.json").read_text())
+    assert saved["next_row"] == 3 and saved["rows_written"] == 3
+
+    seen = []
+    monkeypatch.setattr(import_checkins, "build_session_ops",
+                        lambda user_id, row, date_format: seen.append(row["session_id"]) or build_session_ops(user_id, row, date_format))
+    checkpoint = _import(path)
+
+    assert seen == ["s4", "s5"]
+    assert (checkpoint.next_row, checkpoint.rows_written, checkpoint.errors) == (5, 5, 0)
+    assert _sessions(memory_db) == ["s1", "s2", "s3", "s4", "s5"]
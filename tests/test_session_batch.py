@@ -0,0 +1,42 @@
+from app import app as flask_app, routes
+from app.client_timeline import TIMELINE_FIELD
+from app.trends import rebuild_trends
+
+BATCH = {"sessions": [
+    {"session_id": f"offline_{day}", "timestamp": f"2024-03-0{day}T09:00:00Z",
+     "responses": [{"question_id": "q1", "response_value": day + 2}, {"question_id": "q2", "response_value": 3}]}
+    for day in (1, 2, 3)
+]}
+
+
+def _timeline_ids(memory_db, user_id):
+    data = memory_db.collection("user_data").document(user_id).get().to_dict()
+    return {entry["session_id"] for entry in data.get(TIMELINE_FIELD, [])}
+
+
+def test_retried_batch_repairs_a_missed_timeline_update(memory_db, client_auth, trend_totals, monkeypatch):
+    user_id, headers = client_auth
+    rebuild_trends(memory_db)
+    test_client = flask_app.test_client()
+    update_client_timeline = routes.update_client_timeline
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("datastore unavailable")
+
+    # The sessions commit, then the timeline transaction fails.
+    monkeypatch.setattr(routes, "update_client_timeline", unavailable)
+    assert test_client.post(f"/user-data/{user_id}/sessions/batch", json=BATCH, headers=headers).status_code == 500
+    assert not _timeline_ids(memory_db, user_id) & {"offline_1", "offline_2", "offline_3"}
+
+    monkeypatch.setattr(routes, "update_client_timeline", update_client_timeline)
+    response = test_client.post(f"/user-data/{user_id}/sessions/batch", json=BATCH, headers=headers)
+    assert response.status_code == 200
+    assert [result["status"] for result in response.get_json()["results"]] == ["duplicate"] * 3
+    assert {"offline_1", "offline_2", "offline_3"} <= _timeline_ids(memory_db, user_id)
+
+    # Replaying again changes nothing, and the incremental trends match a rebuild.
+    trends = trend_totals()
+    test_client.post(f"/user-data/{user_id}/sessions/batch", json=BATCH, headers=headers)
+    assert trend_totals() == trends
+    rebuild_trends(memory_db)
+    assert trend_totals() == trends
@@ -0,0 +1,28 @@
+from datetime import datetime, timezone
+
+from app.trends import queue_trend_delta, rebuild_trends
+
+
+def _entry(session_id, month, score):
+    return {"session_id": session_id, "timestamp": datetime(2024, month, 10, tzinfo=timezone.utc), "score": score}
+
+
+def test_timeline_deltas_match_a_rebuild(memory_db, trend_totals):
+    memory_db.collection("users").document("client_a").set({"role": "client", "is_archived": False})
+    data_ref = memory_db.collection("user_data").document("client_a")
+    timelines = [
+        [],
+        [_entry("s1", 1, 20)],
+        [_entry("s1", 1, 20), _entry("s2", 2, 15), _entry("s3", 3, 9)],
+        [_entry("s1", 1, 20), _entry("s2", 2, 14), _entry("s3", 3, 9), _entry("s4", 3, 8)],
+        [_entry("s2", 2, 14)],  # sessions removed, intake month moves
+    ]
+    for old, new in zip(timelines, timelines[1:]):
+        batch = memory_db.batch()
+        batch.set(data_ref, {"score_timeline": new, "session_count": len(new)}, merge=True)
+        queue_trend_delta(batch, memory_db, "client_a", old, new)
+        batch.commit()
+
+        incremental = trend_totals()
+        rebuild_trends(memory_db)
+        assert trend_totals() == incremental
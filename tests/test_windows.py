@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta, timezone
+
+from app.windows import TimeWindow, entries_in
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+# Sorted, with repeated timestamps at the window boundaries.
+TIMELINE = [{"session_id": str(i), "timestamp": BASE + timedelta(days=day)} for i, day in enumerate([0, 1, 1, 3, 5, 5, 8])]
+
+
+def test_entries_in_matches_a_linear_filter():
+    bounds = [None] + [BASE + timedelta(days=day) for day in range(-1, 11)]
+    for start in bounds:
+        for end in bounds:
+            window = TimeWindow(start, end)
+            assert entries_in(TIMELINE, window) == [e for e in TIMELINE if window.contains(e["timestamp"])]
+
+
+def test_entries_in_empty_timeline():
+    assert entries_in([], TimeWindow(BASE, BASE + timedelta(days=1))) == []